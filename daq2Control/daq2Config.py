@@ -156,13 +156,16 @@ class daq2Config(object):
 				printError("Didn't find host %s in symbol map." % host.name, self)
 				raise e
 
+	def getBuilderAndProtocol(self):
+		builder = 'EvB' if self.useEvB else 'gevb2g'
+		if self.useMSIO: builder = 'mstreamio'
+		ptprotocol = 'IBV' if self.useIBV else 'UDAPL'
+		return builder, ptprotocol
 	def printHosts(self, out=None, prepend=''):
 		if out==None: out = stdout
 		separator = 70*'-'
 		out.write(prepend+separator+'\n')
-		builder = 'EvB' if self.useEvB else 'gevb2g'
-		if self.useMSIO: builder = 'mstreamio'
-		ptprotocol = 'IBV' if self.useIBV else 'UDAPL'
+		builder, ptprotocol = self.getBuilderAndProtocol()
 		out.write('%s%s configuration with %s/%s\n' % (prepend, self.testCase, builder,ptprotocol))
 		out.write(prepend+separator+'\n')
 		for host in self.hosts:
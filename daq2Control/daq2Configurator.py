@@ -1,6 +1,6 @@
 import os
-import subprocess
 import re
+import shutil
 import time
 from copy import deepcopy
 
@@ -46,11 +46,42 @@ def getLog2SizeAndUnit(size):
 
 
 ######################################################################
+## Parsed fragments, keyed by absolute path, with the file's mtime
+_fragmentCache = {}
+_fragmentCacheStats = {'hits':0, 'misses':0}
+def cloneElement(element):
+	"""Copies an Element and all its children (faster than deepcopy)"""
+	clone = element.makeelement(element.tag, element.attrib)
+	clone.text = element.text
+	clone.tail = element.tail
+	clone.extend([cloneElement(child) for child in element])
+	return clone
+def fragmentCacheStats():
+	"""Returns a dictionary with the number of cache 'hits' and 'misses'
+	of elementFromFile"""
+	return dict(_fragmentCacheStats)
+def clearFragmentCache():
+	_fragmentCache.clear()
+	_fragmentCacheStats['hits'] = 0
+	_fragmentCacheStats['misses'] = 0
 def elementFromFile(filename):
 	"""
 	Parses a .xml file and returns a xml.etree.ElementTree.Element object.
 	Raises a RuntimeError if the parsing failed.
+	Parsed files are cached (until their modification time changes) and
+	a fresh copy is returned for every call.
 	"""
+	path = os.path.abspath(filename)
+	try:
+		mtime = os.stat(path).st_mtime
+	except OSError:
+		mtime = None ## let open() below raise the IOError
+	cached = _fragmentCache.get(path)
+	if cached is not None and cached[0] == mtime:
+		_fragmentCacheStats['hits'] += 1
+		return cloneElement(cached[1])
+
+	_fragmentCacheStats['misses'] += 1
 	element = None
 	with open(filename, 'r') as file:
 		text = file.read()
@@ -60,7 +91,8 @@ def elementFromFile(filename):
 			printError('Error parsing xml file %s:\n%s' % (filename, str(e)) )
 			raise RuntimeError('Error parsing xml file %s' % filename)
 		file.close()
-	return element
+	_fragmentCache[path] = (mtime, element)
+	return cloneElement(element)
 def addFragmentFromFile(target, filename, index=-1):
 	element = elementFromFile(filename)
 	if index<0: target.append(element)
@@ -71,19 +103,279 @@ def split_list(alist, wanted_parts=1):
 	return [ alist[i*length // wanted_parts: (i+1)*length // wanted_parts]
 	         for i in range(wanted_parts) ]
 
+## In-process replacement for 'xmllint --format --nsclean', producing the
+## same output (minus the <?xml version="1.0"?> declaration)
+XML_INDENT_MAX_LEVEL = 30 ## libxml2 does not indent deeper than this
+_nonASCII = re.compile(u'[^\x00-\x7f]')
+def _charRef(match):
+	return '&#x%X;' % ord(match.group(0))
+def _escapeNonASCII(text):
+	try:
+		text.decode('ascii')
+		return text
+	except UnicodeDecodeError:
+		return _nonASCII.sub(_charRef, text.decode('utf-8')).encode('ascii')
+def _escapeXMLText(text):
+	text = text.replace('&', '&amp;').replace('<', '&lt;')
+	text = text.replace('>', '&gt;').replace('\r', '&#xD;')
+	return _escapeNonASCII(text)
+def _escapeXMLAttribute(text):
+	text = text.replace('&', '&amp;').replace('<', '&lt;')
+	text = text.replace('>', '&gt;').replace('"', '&quot;')
+	text = text.replace('\n', '&#10;').replace('\r', '&#13;')
+	text = text.replace('\t', '&#9;')
+	return _escapeNonASCII(text)
+
+class _XMLFormatter(object):
+	"""
+	Builds a light-weight tree from expat events, dropping ignorable
+	whitespace and redundant namespace declarations the same way libxml2
+	does, and serializes it with two-space indentation.
+	Nodes are tuples: ('E', name, attributes, children), ('T', text),
+	('C', cdata), ('M', comment), ('P', target, data).
+	"""
+	def __init__(self):
+		self.top = []
+		self.stack = [(self.top, {})] ## (children, namespaces in scope)
+		self.pending = []
+		self.incdata = False
+
+	def parse(self, text):
+		from xml.parsers import expat
+		parser = expat.ParserCreate()
+		parser.returns_unicode = False
+		parser.ordered_attributes = True
+		parser.buffer_text = True
+		parser.StartElementHandler = self.startElement
+		parser.EndElementHandler = self.endElement
+		parser.CharacterDataHandler = self.characters
+		parser.CommentHandler = self.comment
+		parser.ProcessingInstructionHandler = self.processingInstruction
+		parser.StartCdataSectionHandler = self.startCdata
+		parser.EndCdataSectionHandler = self.endCdata
+		parser.Parse(text, True)
+		return self.top
+
+	def flushText(self, closing=False):
+		if len(self.pending) == 0: return
+		text = ''.join(self.pending)
+		self.pending = []
+		children = self.stack[-1][0]
+		if children is self.top: return
+		if len(text.strip(' \t\n\r')) == 0:
+			## libxml2's heuristic for ignorable blanks
+			if not ((closing and len(children) == 0) or
+				    (len(children) > 0 and (children[-1][0] == 'T' or
+				                            children[0][0] == 'T'))):
+				return
+		children.append(('T', text))
+
+	def startElement(self, name, attributes):
+		self.flushText()
+		children, scope = self.stack[-1]
+		nsdefs, attrs = [], []
+		newscope = scope
+		for i in xrange(0, len(attributes), 2):
+			key, value = attributes[i], attributes[i+1]
+			if key == 'xmlns' or key.startswith('xmlns:'):
+				if scope.get(key) == value: continue ## nsclean
+				if newscope is scope: newscope = dict(scope)
+				newscope[key] = value
+				nsdefs.append((key, value))
+			else:
+				attrs.append((key, value))
+		element = ('E', name, nsdefs+attrs, [])
+		children.append(element)
+		self.stack.append((element[3], newscope))
+
+	def endElement(self, name):
+		self.flushText(closing=True)
+		self.stack.pop()
+
+	def characters(self, data):
+		if self.incdata:
+			self.stack[-1][0].append(('C', data))
+			return
+		self.pending.append(data)
+
+	def startCdata(self):
+		self.flushText()
+		self.incdata = True
+	def endCdata(self):
+		self.incdata = False
+
+	def comment(self, data):
+		self.flushText()
+		self.stack[-1][0].append(('M', data))
+
+	def processingInstruction(self, target, data):
+		self.flushText()
+		self.stack[-1][0].append(('P', target, data))
+
+	def serialize(self, node, level, format, out):
+		kind = node[0]
+		if kind == 'T':
+			out.append(_escapeXMLText(node[1]))
+		elif kind == 'C':
+			out.append('<![CDATA[%s]]>' % node[1])
+		elif kind == 'M':
+			out.append('<!--%s-->' % node[1])
+		elif kind == 'P':
+			if len(node[2]) > 0: out.append('<?%s %s?>' % (node[1], node[2]))
+			else:                out.append('<?%s?>' % node[1])
+		else:
+			_, name, attrs, children = node
+			out.append('<' + name)
+			for key, value in attrs:
+				out.append(' %s="%s"' % (key, _escapeXMLAttribute(value)))
+			if len(children) == 0:
+				out.append('/>')
+				return
+			out.append('>')
+			if format:
+				for child in children:
+					if child[0] in ('T', 'C'):
+						format = False
+						break
+			if format:
+				out.append('\n')
+				indent = 2*min(level+1, XML_INDENT_MAX_LEVEL)*' '
+				for child in children:
+					out.append(indent)
+					self.serialize(child, level+1, True, out)
+					out.append('\n')
+				out.append(2*min(level, XML_INDENT_MAX_LEVEL)*' ')
+			else:
+				for child in children:
+					self.serialize(child, level+1, False, out)
+			out.append('</%s>' % name)
+
+	def format(self, text):
+		out = []
+		for node in self.parse(text):
+			self.serialize(node, 0, True, out)
+			out.append('\n')
+		return ''.join(out)
+
+def formatXMLString(text):
+	"""
+	Returns text re-formatted like 'xmllint --format --nsclean', without
+	the xml declaration. Raises a RuntimeError if the parsing failed.
+	"""
+	try:
+		return _XMLFormatter().format(text)
+	except ExpatError as e:
+		printError('Error parsing xml:\n%s' % str(e))
+		raise RuntimeError('Error parsing xml')
+def writeFileAtomically(filename, text):
+	"""Writes to a temporary file next to filename and renames it"""
+	tmpfile = '%s.%d.tmp' % (filename, os.getpid())
+	with open(tmpfile, 'w') as file:
+		file.write(text)
+	os.rename(tmpfile, filename)
 def formatXMLFile(xmlfile):
-	## Pass through xmllint for formatting
-	subprocess.call(['xmllint', '--format', '--nsclean', xmlfile,
-	                 '-o', xmlfile])
+	with open(xmlfile, 'r') as file:
+		text = file.read()
+	writeFileAtomically(xmlfile, formatXMLString(text))
 
-	## Remove the <?xml version="1.0"?> added by xmllint
-	with open(xmlfile, 'r') as oldfile:
-		lines = oldfile.readlines()
-		lines.remove('<?xml version="1.0"?>\n')
-		with open(xmlfile+'temp', 'w') as newfile:
-			for line in lines:
-				newfile.write(line)
-	subprocess.call(['mv', '-f', xmlfile+'temp', xmlfile])
+def _encodeValue(value):
+	if isinstance(value, unicode): return value.encode('utf-8')
+	return value
+class StreamingXMLWriter(object):
+	"""
+	Writes a document one child of the root element at a time, with the
+	same output as formatXMLString(ElementTree.tostring(root)), but
+	without ever holding the full tree. Children are formatted into a
+	temporary body file; close() then writes the root tag with all
+	namespace declarations, the body, and renames the result to
+	destination. Namespace prefixes are assigned like in ElementTree.
+	"""
+	def __init__(self, destination, root):
+		self.destination = destination
+		self.namespaces = {} ## uri -> prefix
+		self.qnames = {}     ## '{uri}tag' -> 'prefix:tag'
+		self.root = root.makeelement(root.tag, root.attrib)
+		self.collectNamespaces(self.root)
+		self.nchildren = 0
+		self.bodyfile = '%s.%d.body' % (destination, os.getpid())
+		self.body = open(self.bodyfile, 'w')
+
+	def addQName(self, qname):
+		if qname[:1] != '{':
+			self.qnames[qname] = qname
+			return
+		uri, tag = qname[1:].rsplit('}', 1)
+		prefix = self.namespaces.get(uri)
+		if prefix is None:
+			prefix = ElementTree._namespace_map.get(uri)
+			if prefix is None:
+				prefix = 'ns%d' % len(self.namespaces)
+			if prefix != 'xml':
+				self.namespaces[uri] = prefix
+		self.qnames[qname] = '%s:%s' % (prefix, tag) if prefix else tag
+	def collectNamespaces(self, element):
+		for elem in element.iter():
+			if isinstance(elem.tag, basestring) and not elem.tag in self.qnames:
+				self.addQName(elem.tag)
+			for key, _ in elem.items():
+				if not key in self.qnames: self.addQName(key)
+
+	def emit(self, formatter, elem):
+		"""Feeds elem to formatter as the corresponding parser events"""
+		if elem.tag is ElementTree.Comment:
+			formatter.comment(_encodeValue(elem.text))
+		elif elem.tag is ElementTree.ProcessingInstruction:
+			target, _, data = _encodeValue(elem.text).partition(' ')
+			formatter.processingInstruction(target, data)
+		else:
+			attributes = []
+			for key, value in sorted(elem.items()):
+				## as an xml parser would normalize the attribute
+				value = _encodeValue(value).replace('\r', ' ')
+				attributes += [self.qnames[key], value.replace('\t', ' ')]
+			formatter.startElement(self.qnames[elem.tag], attributes)
+			if elem.text: self.emitText(formatter, elem.text)
+			for child in elem:
+				self.emit(formatter, child)
+				if child.tail: self.emitText(formatter, child.tail)
+			formatter.endElement(self.qnames[elem.tag])
+	def emitText(self, formatter, text):
+		text = _encodeValue(text).replace('\r\n', '\n')
+		formatter.characters(text.replace('\r', '\n'))
+
+	def write(self, element):
+		"""Formats element as the next child of the root and writes it"""
+		self.collectNamespaces(element)
+		formatter = _XMLFormatter()
+		self.emit(formatter, element)
+		out = [2*' ']
+		formatter.serialize(formatter.top[0], 1, True, out)
+		out.append('\n')
+		self.body.write(''.join(out))
+		self.nchildren += 1
+
+	def close(self):
+		self.body.close()
+		name = self.qnames[self.root.tag]
+		header = ['<' + name]
+		for uri, prefix in sorted(self.namespaces.items(),
+			                      key=lambda x: x[1]):
+			header.append(' xmlns:%s="%s"' % (prefix,
+				                              _escapeXMLAttribute(uri)))
+		for key, value in sorted(self.root.items()):
+			header.append(' %s="%s"' % (self.qnames[key],
+				                        _escapeXMLAttribute(value)))
+		tmpfile = '%s.%d.tmp' % (self.destination, os.getpid())
+		with open(tmpfile, 'w') as file:
+			if self.nchildren == 0:
+				file.write(''.join(header) + '/>\n')
+			else:
+				file.write(''.join(header) + '>\n')
+				with open(self.bodyfile, 'r') as body:
+					shutil.copyfileobj(body, file)
+				file.write('</%s>\n' % name)
+		os.remove(self.bodyfile)
+		os.rename(tmpfile, self.destination)
 
 
 ######################################################################
@@ -1004,11 +1296,8 @@ class daq2Configurator(object):
 			self.config.append(self.makeBU(n))
 
 	def writeConfig(self, destination):
-		with open(destination, 'w') as file:
-			file.write(ElementTree.tostring(self.config))
-			file.close()
-
-		formatXMLFile(destination)
+		writeFileAtomically(destination, formatXMLString(
+			                         ElementTree.tostring(self.config)))
 
 	def makeConfig(self, nferols=8, streams_per_ferol=2, nrus=1, nbus=2,
 		           destination='configuration.template.xml', separateEVM=False):
@@ -11,24 +11,78 @@
 ######################################################################
 
 import subprocess
-import re, os, shlex
+import re, os, shlex, shutil, hashlib
 import time
 import itertools
 from math import sqrt
 from sys import stdout
-from multiprocessing import Pool
 
 separator = 70*'-'
+MIN_RATE_SAMPLES = 6 ## before a measurement can be stopped early
 
 from daq2Config import daq2Config, host, FEROL
-from daq2Configurator import formatXMLFile
+from daq2Configurator import formatXMLString
 from daq2SymbolMap import daq2SymbolMap
 from daq2Utils import printError, printWarningWithWait, sleep
+from daq2Results import ResultsWriter, STORE_NAME, readLegacyCSV
 from logNormalTest import averageFractionSize
 import daq2Utils as utils
+import daq2Config as configModule, daq2Configurator as configuratorModule
+import daq2SymbolMap as symbolMapModule, daq2SOAP
 
 import xml.etree.ElementTree as ET
 
+def averageSizeRate(samples):
+	"""Average size and rate, and rms of the rate, of a list of
+	(size, rate) samples"""
+	sizes = [size for size,_ in samples]
+	rates = [rate for _,rate in samples]
+	av_size = reduce(lambda a,b:a+b, sizes)/len(sizes) ## in bytes
+	av_rate = reduce(lambda a,b:a+b, rates)/len(rates)
+	sigma_rate = sqrt(reduce(lambda a,b:a+b, map(lambda x:x*x, rates))/len(rates) - av_rate*av_rate)
+	return av_size, av_rate, sigma_rate
+def relativeError(samples):
+	"""Statistical error of the mean of a list of rate samples, relative
+	to the mean. Returns None for less than two samples or a zero mean."""
+	if len(samples) < 2: return None
+	mean = float(sum(samples))/len(samples)
+	if mean == 0: return None
+	variance = sum([(x-mean)**2 for x in samples])/(len(samples)-1)
+	return sqrt(variance/len(samples))/mean
+
+## Rendered split configs are cached by a hash of their inputs and of the
+## code that renders them. Bump the version for changes in the rendering
+## that are not in the modules below.
+CONFIG_CACHE_VERSION = 1
+CONFIG_CACHE_MAX_AGE = 30 ## days after their last use before entries are removed
+_renderingDigest = None
+def renderingCodeDigest():
+	"""Hash of the source of all modules involved in rendering a config"""
+	global _renderingDigest
+	if _renderingDigest is None:
+		sha = hashlib.sha1()
+		sha.update(str(CONFIG_CACHE_VERSION))
+		for filename in [configModule.__file__, configuratorModule.__file__,
+		                 symbolMapModule.__file__, daq2SOAP.__file__,
+		                 utils.__file__, __file__]:
+			filename = os.path.splitext(filename)[0] + '.py'
+			with open(filename, 'rb') as infile:
+				sha.update(infile.read())
+		_renderingDigest = sha.hexdigest()
+	return _renderingDigest
+
+## Set by daq2Control.renderSplitConfigs before forking the worker
+## processes, so that they inherit the (unpicklable) daq2Control object
+_renderingControl = None
+def fillConfigInWorker(filename):
+	"""Renders one split config file, returns (filename, error)"""
+	try:
+		_renderingControl.fillConfig(filename)
+		return filename, None
+	except Exception:
+		import traceback
+		return filename, traceback.format_exc()
+
 ######################################################################
 class daq2Control(object):
 	'''
@@ -62,6 +116,23 @@ class daq2Control(object):
 		self.__RETRY_COUNTER = 0
 		if not hasattr(self.options, 'retries'):
 			self.options.retries = 5
+		if not hasattr(self.options, 'stateTimeout'):
+			self.options.stateTimeout = 30
+		if not hasattr(self.options, 'useConfigCache'):
+			self.options.useConfigCache = True
+		if not hasattr(self.options, 'probeMode'):
+			self.options.probeMode = utils.PROBE_MODE
+		if not hasattr(self.options, 'probeTimeout'):
+			self.options.probeTimeout = utils.PROBE_TIMEOUT
+		if not hasattr(self.options, 'partialRetry'):
+			self.options.partialRetry = True
+
+		## Bookkeeping for restarting only the failed executives in retry()
+		self.__failedHosts  = []    ## hosts that failed a probe or state check
+		self.__configSent   = []    ## hosts that have their configuration
+		self.__onlyPrepare  = False
+		self.__recovering   = False ## inside recoverHosts()
+		self.__recoveryFailed = False
 
 		if self.config.useGTPe and self.options.useRate == 'max':
 			printWarningWithWait("Failed to specify rate for GTPe. Setting "
@@ -86,9 +157,29 @@ class daq2Control(object):
 		self._testEnv   = ""
 		if len(self._testType) > 0: self._testEnv = "-"+self._testType
 
+		## Rendered split config files, reused across runs
+		self._configCacheDir = None
+		self._configCachePruned = None ## pid of the process that pruned it
+		if self.options.useConfigCache:
+			self._configCacheDir = os.path.join(self._testDir,
+				                                self._platform, 'configCache')
+
+		## Long-lived thread pool used for all fan-out to hosts
+		self.workerPool = utils.getWorkerPool()
+
+		## Results store in the output directory, see prepareOutputDir()
+		self.results = None
+
 	def reset(self):
 		"""Reset counters."""
 		self.__RETRY_COUNTER = 0
+	def shutdown(self):
+		"""Stop the shared worker pool, close all SOAP connections and the
+		results store. Call once at the end of a run or scan, the pool is
+		created again when needed (e.g. for the next scan in scanAll)."""
+		utils.shutdownWorkerPool()
+		if self.results is not None:
+			self.results.close()
 	def setupConfig(self, configFile):
 		try:
 			self.config = daq2Config(configFile)
@@ -110,8 +201,77 @@ class daq2Control(object):
 			self.config.setFerolParameter('TCP_CWND_FED1',
 				                          self.options.setCWND)
 		if self.options.verbose>1: self.config.printHosts()
+	def configCacheKey(self, filename):
+		"""
+		Hash of a config fragment, the symbol map, the options that
+		modify the rendered configuration, and the rendering code
+		"""
+		sha = hashlib.sha1()
+		sha.update(renderingCodeDigest())
+		with open(filename, 'rb') as infile:
+			sha.update(infile.read())
+		sha.update(self.symbolMap.digest())
+		sha.update(repr((self.options.enablePauseFrame,
+			             self.options.disablePauseFrame,
+			             self.options.setCWND)))
+		return sha.hexdigest()
+	def getCachedConfig(self, cachekey, runconfig, cfg_cmd_file):
+		"""Copy a previously rendered config and command file to the run
+		directory. Returns False if they are not in the cache."""
+		cached = os.path.join(self._configCacheDir, cachekey)
+		if not (os.path.exists(cached+'.xml') and
+			    os.path.exists(cached+'.configure.cmd.xml')):
+			return False
+		shutil.copyfile(cached+'.xml', runconfig)
+		shutil.copyfile(cached+'.configure.cmd.xml', cfg_cmd_file)
+		## Mark them as used, for pruneConfigCache()
+		for filename in [cached+'.xml', cached+'.configure.cmd.xml']:
+			try:
+				os.utime(filename, None)
+			except OSError:
+				pass ## pruned concurrently
+		return True
+	def putCachedConfig(self, cachekey, runconfig, cfg_cmd_file):
+		cached = os.path.join(self._configCacheDir, cachekey)
+		if not os.path.isdir(self._configCacheDir):
+			try:
+				os.makedirs(self._configCacheDir)
+			except OSError:
+				pass ## created concurrently
+		self.pruneConfigCache()
+		## Write to a temporary file first and rename, so that concurrent
+		## runs never see partially written cache entries
+		for source,target in [(runconfig, cached+'.xml'),
+		                      (cfg_cmd_file, cached+'.configure.cmd.xml')]:
+			tmpfile = '%s.%d.tmp' % (target, os.getpid())
+			shutil.copyfile(source, tmpfile)
+			os.rename(tmpfile, target)
+	def pruneConfigCache(self, maxage=CONFIG_CACHE_MAX_AGE):
+		"""Removes cache entries not used for maxage days, once per
+		daq2Control instance (and process)"""
+		if self._configCachePruned == os.getpid(): return
+		self._configCachePruned = os.getpid()
+		cutoff = time.time() - maxage*24*3600
+		for filename in os.listdir(self._configCacheDir):
+			filename = os.path.join(self._configCacheDir, filename)
+			try:
+				if os.path.getmtime(filename) < cutoff:
+					os.remove(filename)
+			except OSError:
+				pass ## removed concurrently
 	def fillConfig(self, filename):
 		basename = os.path.split(filename)[1]
+		runconfig = os.path.join(self._runDir,basename)
+		cfg_cmd_file = '%s/%s.configure.cmd.xml' % (self._runDir, basename)
+
+		cachekey = None
+		if self._configCacheDir is not None and not self.options.dry:
+			cachekey = self.configCacheKey(filename)
+			if self.getCachedConfig(cachekey, runconfig, cfg_cmd_file):
+				if self.options.verbose > 5:
+					print 'Reusing cached configuration for', basename
+				return
+
 		configfragm = daq2Config(filename)
 		configfragm.fillFromSymbolMap(self.symbolMap)
 
@@ -125,22 +285,18 @@ class daq2Control(object):
 			configfragm.setFerolParameter('TCP_CWND_FED1',
 				                          self.options.setCWND)
 
-		runconfig = os.path.join(self._runDir,basename)
 		if self.options.verbose > 5:
 			print 'Filling configuration template in ' + runconfig
 		if not self.options.dry:
-			# write out the parsed xml to a file (still templated)
-			configfragm.config.write(runconfig)
-			# format the xml to resolve the namespaces
-			formatXMLFile(runconfig)
-
-			## fill the template with actual hosts and port numbers
-			filledconfig = self.symbolMap.fillTemplate(runconfig)
+			## format the parsed xml (still templated) to resolve the
+			## namespaces, and fill the template with actual hosts and
+			## port numbers
+			filledconfig = self.symbolMap.fillString(formatXMLString(
+				               ET.tostring(configfragm.config.getroot())))
 			with open(runconfig, 'w') as configfile:
 				configfile.write(filledconfig)
 
 		## Produce configure command file
-		cfg_cmd_file = '%s/%s.configure.cmd.xml' % (self._runDir, basename)
 		if self.options.verbose > 5:
 			print 'Producing configuration command file in', cfg_cmd_file
 		if not self.options.dry:
@@ -152,95 +308,110 @@ class daq2Control(object):
 				configureCmd = utils.SOAPEnvelope % configureBody
 				file.write(configureCmd)
 
+		if cachekey is not None:
+			self.putCachedConfig(cachekey, runconfig, cfg_cmd_file)
+
+	def renderSplitConfigs(self):
+		"""
+		Run fillConfig for all .xml files in the config directory, in
+		parallel on one process per core. Files are processed in sorted
+		order; all failures are collected and reported together.
+		"""
+		global _renderingControl
+		## TODO: Only do this for RUs that are not masked!
+		filenames = sorted([os.path.join(self.configDir, f)
+		                        for f in os.listdir(self.configDir)
+		                        if os.path.splitext(f)[1] == '.xml'])
+		if len(filenames) == 0: return
+
+		from multiprocessing import Pool, cpu_count
+		nworkers = min(cpu_count(), len(filenames))
+		_renderingControl = self
+		pool = None
+		results = []
+		try:
+			if self.options.dry or nworkers < 2:
+				mapped = itertools.imap(fillConfigInWorker, filenames)
+			else:
+				pool = Pool(nworkers)
+				mapped = pool.imap(fillConfigInWorker, filenames)
+			for n,result in enumerate(mapped):
+				utils.printProgress(n, len(filenames))
+				results.append(result)
+		finally:
+			if pool is not None:
+				pool.close()
+				pool.join()
+			_renderingControl = None
+		print ''
+
+		errors = [(f, e) for f,e in results if e is not None]
+		for filename,error in errors:
+			printError('Failed to render %s:\n%s' % (filename, error), self)
+		if len(errors) > 0:
+			raise RuntimeError('Failed to render %d of %d config files' % (
+				                                 len(errors), len(filenames)))
+
 	## Multi-commands
+	def getEVMGroup(self):
+		"""With the EvB, the EVM is the first RU"""
+		if self.config.useEvB:
+			return [(evm, self.config.namespace+'EVM', None, None)
+			                                 for evm in self.config.RUs[:1]]
+		return [(evm, self.config.namespace+'EVM', None, None)
+		                                    for evm in self.config.EVM]
+	def getRUGroup(self):
+		rus = self.config.RUs
+		if self.config.useEvB: rus = rus[1:]
+		return [(ru, self.config.namespace+'RU', None, None) for ru in rus]
+	def getBUGroup(self):
+		return [(bu, self.config.namespace+'BU', None, None)
+		                                    for bu in self.config.BUs]
+	def sendCmdToGroups(self, groups, cmd):
+		"""Send cmd to each group in order, to all members of a group in
+		parallel. Returns a list of utils.CommandResult."""
+		return utils.sendSimpleCmdToGroups(groups, cmd,
+			                               verbose=self.options.verbose,
+			                               dry=self.options.dry)
 	def sendCmdToEVMRUBU(self, cmd): ## ordering for configure
 		if self.options.verbose > 0: print separator
-		for n,evm in enumerate(self.config.EVM):
-			utils.sendSimpleCmdToApp(evm, self.config.namespace+'EVM',
-				                     cmd, verbose=self.options.verbose,
-				                     dry=self.options.dry)
-		for n,ru in enumerate(self.config.RUs):
-			classname = 'RU'
-			if self.config.useEvB and n==0: classname = 'EVM'
-			utils.sendSimpleCmdToApp(ru, self.config.namespace+classname,
-				                     cmd, verbose=self.options.verbose,
-				                     dry=self.options.dry)
-		for n,bu in enumerate(self.config.BUs):
-			utils.sendSimpleCmdToApp(bu, self.config.namespace+'BU',
-				                     cmd, verbose=self.options.verbose,
-				                     dry=self.options.dry)
+		return self.sendCmdToGroups([self.getEVMGroup(), self.getRUGroup(),
+			                         self.getBUGroup()], cmd)
 	def sendCmdToRUEVMBU(self, cmd): ## ordering for enable
+		## The EvB's EVM still goes before the RUs
 		if self.options.verbose > 0: print separator
-		for n,ru in enumerate(self.config.RUs):
-			classname = 'RU'
-			if self.config.useEvB and n==0: classname = 'EVM'
-			utils.sendSimpleCmdToApp(ru, self.config.namespace+classname,
-				                     cmd, verbose=self.options.verbose,
-				                     dry=self.options.dry)
-		for n,evm in enumerate(self.config.EVM):
-			utils.sendSimpleCmdToApp(evm, self.config.namespace+'EVM',
-				                     cmd, verbose=self.options.verbose,
-				                     dry=self.options.dry)
-		for n,bu in enumerate(self.config.BUs):
-			utils.sendSimpleCmdToApp(bu, self.config.namespace+'BU',
-				                     cmd, verbose=self.options.verbose,
-				                     dry=self.options.dry)
+		groups = [self.getRUGroup(), self.getEVMGroup()]
+		if self.config.useEvB: groups.reverse()
+		return self.sendCmdToGroups(groups + [self.getBUGroup()], cmd)
 	def sendCmdToBUEVMRU(self, cmd): ## ordering for enable
+		## The EvB's EVM goes with the RUs, after the pause
 		if self.options.verbose > 0: print separator
-		for n,bu in enumerate(self.config.BUs):
-			utils.sendSimpleCmdToApp(bu, self.config.namespace+'BU',
-				                     cmd, verbose=self.options.verbose,
-				                     dry=self.options.dry)
-		for n,evm in enumerate(self.config.EVM):
-			utils.sendSimpleCmdToApp(evm, self.config.namespace+'EVM',
-				                     cmd, verbose=self.options.verbose,
-				                     dry=self.options.dry)
+		first, last = [self.getBUGroup()], [self.getRUGroup()]
+		if self.config.useEvB: last.insert(0, self.getEVMGroup())
+		else:                  first.append(self.getEVMGroup())
+		results = self.sendCmdToGroups(first, cmd)
 		sleep(2, self.options.verbose, self.options.dry)
-		for n,ru in enumerate(self.config.RUs):
-			classname = 'RU'
-			if self.config.useEvB and n==0: classname = 'EVM'
-			utils.sendSimpleCmdToApp(ru, self.config.namespace+classname,
-				                     cmd, verbose=self.options.verbose,
-				                     dry=self.options.dry)
+		return results + self.sendCmdToGroups(last, cmd)
 	def sendCmdToFEROLs(self, cmd):
 		if self.options.verbose > 0: print separator
-		for frl in self.config.FEROLs:
-			utils.sendSimpleCmdToApp(frl, 'ferol::FerolController', cmd,
-				                     verbose=self.options.verbose,
-				                     dry=self.options.dry)
-			sleep(0.1, self.options.verbose, self.options.dry)
+		return self.sendCmdToGroups([[(frl, 'ferol::FerolController',
+			                           None, None)
+		                              for frl in self.config.FEROLs]], cmd)
 	def sendCmdToEFEDs(self, cmd):
 		if self.options.verbose > 0: print separator
+		group = []
 		for efed in self.config.eFEDs:
 			for instance,_,_ in efed.streams:
-				utils.sendSimpleCmdToApp(efed, 'd2s::FEDEmulator', cmd,
-					                     instance=instance, port=efed.port,
-					                     verbose=self.options.verbose,
-					                     dry=self.options.dry)
+				group.append((efed, 'd2s::FEDEmulator', instance, efed.port))
+		return self.sendCmdToGroups([group], cmd)
 	def sendCmdToGTPeFMM(self, cmd, invert=False):
 		try:
 			gtpe = self.symbolMap('GTPE0')
 			fmm  = self.symbolMap('FMM0')
-			if not invert:
-				utils.sendSimpleCmdToApp(gtpe, 'd2s::GTPeController',
-					                     str(cmd),
-					                     verbose=self.options.verbose,
-					                     dry=self.options.dry)
-				utils.sendSimpleCmdToApp(fmm, 'tts::FMMController',
-					                     str(cmd),
-					                     verbose=self.options.verbose,
-					                     dry=self.options.dry)
-				return
-			else:
-				utils.sendSimpleCmdToApp(fmm, 'tts::FMMController',
-					                     str(cmd),
-					                     verbose=self.options.verbose,
-					                     dry=self.options.dry)
-				utils.sendSimpleCmdToApp(gtpe, 'd2s::GTPeController',
-					                     str(cmd),
-					                     verbose=self.options.verbose,
-					                     dry=self.options.dry)
-				return
+			groups = [[(gtpe, 'd2s::GTPeController', None, None)],
+			          [(fmm,  'tts::FMMController',  None, None)]]
+			if invert: groups.reverse()
+			return self.sendCmdToGroups(groups, str(cmd))
 		except KeyError as e:
 			if not self.config.useGTPe:
 				printError("You're trying to send a command to a "
@@ -288,6 +459,15 @@ class daq2Control(object):
 
 
 
+	def ferolSizeParams(self, stream, size, rms, delay):
+		"""Event length, length rms, and delay parameters for one FEROL
+		stream, to be passed to utils.setParams"""
+		return {'Event_Length_bytes_FED%d' % stream       : ('unsignedInt',
+			                                                  int(size)),
+		        'Event_Length_Stdev_bytes_FED%d' % stream : ('unsignedInt',
+		                                                      int(rms)),
+		        'Event_Delay_ns_FED%d' % stream           : ('unsignedInt',
+		                                                      int(delay))}
 	def setSizeFEROLs(self, fragSize, fragSizeRMS, rate='max'):
 		if self.options.verbose > 0: print separator
 
@@ -301,21 +481,10 @@ class daq2Control(object):
 			for frl in self.config.FEROLs:
 				if self.config.useEvB and frl.index == 0:
 					## this sends to the EVM
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Length_bytes_FED0',
-						           'unsignedInt', 1024,
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Length_Stdev_bytes_FED0',
-						           'unsignedInt', 0,
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Delay_ns_FED0',
-						           'unsignedInt', int(delay),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
+					utils.setParams(frl, 'ferol::FerolController',
+						            self.ferolSizeParams(0, 1024, 0, delay),
+						            verbose=self.options.verbose,
+						            dry=self.options.dry)
 					continue
 
 				if self.options.sizeProfile == 'streams' and frl.enableStream0 and frl.enableStream1:
@@ -323,38 +492,19 @@ class daq2Control(object):
 				else:
 					divider = 1
 
+				params = {}
 				if frl.enableStream0:
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Length_bytes_FED0',
-						           'unsignedInt', int(fragSize)/divider,
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Length_Stdev_bytes_FED0',
-						           'unsignedInt', int(fragSizeRMS)/divider,
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Delay_ns_FED0',
-						           'unsignedInt', int(delay),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
+					params.update(self.ferolSizeParams(0,
+						                    int(fragSize)/divider,
+						                    int(fragSizeRMS)/divider, delay))
 				if frl.enableStream1:
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Length_bytes_FED1',
-						           'unsignedInt', int(fragSize)/divider,
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Length_Stdev_bytes_FED1',
-						           'unsignedInt', int(fragSizeRMS)/divider,
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Delay_ns_FED1',
-						           'unsignedInt', int(delay),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
+					params.update(self.ferolSizeParams(1,
+						                    int(fragSize)/divider,
+						                    int(fragSizeRMS)/divider, delay))
+				if len(params) == 0: continue
+				utils.setParams(frl, 'ferol::FerolController', params,
+					            verbose=self.options.verbose,
+					            dry=self.options.dry)
 		elif self.options.sizeProfile == 'file':
 			self.fedIDToSizeSigma = utils.readSizeFile(self.options.sizeFile)
 			if self.config.useGTPe: delay = 20
@@ -385,55 +535,23 @@ class daq2Control(object):
 				if self.config.useEvB and frl.index == 0:
 					## this sends to the EVM
 					delay = utils.getFerolDelay(1024, rate)
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Length_bytes_FED0',
-						           'unsignedInt', 1024,
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Length_Stdev_bytes_FED0',
-						           'unsignedInt', 0,
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Delay_ns_FED0',
-						           'unsignedInt', int(delay),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
+					utils.setParams(frl, 'ferol::FerolController',
+						            self.ferolSizeParams(0, 1024, 0, delay),
+						            verbose=self.options.verbose,
+						            dry=self.options.dry)
 					continue
 
+				params = {}
 				if frl.enableStream0:
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Length_bytes_FED0',
-						           'unsignedInt', int(size1),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Length_Stdev_bytes_FED0',
-						           'unsignedInt', int(rms1),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Delay_ns_FED0',
-						           'unsignedInt', int(delay1),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
+					params.update(self.ferolSizeParams(0, size1, rms1,
+						                               delay1))
 				if frl.enableStream1:
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Length_bytes_FED1',
-						           'unsignedInt', int(size2),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Length_Stdev_bytes_FED1',
-						           'unsignedInt', int(rms2),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Delay_ns_FED1',
-						           'unsignedInt', int(delay2),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
+					params.update(self.ferolSizeParams(1, size2, rms2,
+						                               delay2))
+				if len(params) == 0: continue
+				utils.setParams(frl, 'ferol::FerolController', params,
+					            verbose=self.options.verbose,
+					            dry=self.options.dry)
 		else:
 			if not self.options.profilePerFRL:
 				## same size for both streams of each FEROL!
@@ -451,36 +569,13 @@ class daq2Control(object):
 				for fragSize,delay,frl in itertools.izip(sizeProfile,
 					                                     delayProfile,
 					                                     self.config.FEROLs):
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Length_bytes_FED0',
-						           'unsignedInt', int(fragSize),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Length_Stdev_bytes_FED0',
-						           'unsignedInt', int(relRMS*fragSize),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Delay_ns_FED0',
-						           'unsignedInt', int(delay),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Length_bytes_FED1',
-						           'unsignedInt', int(fragSize),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Length_Stdev_bytes_FED1',
-						           'unsignedInt', int(relRMS*fragSize),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
-					utils.setParam(frl, 'ferol::FerolController',
-						           'Event_Delay_ns_FED1',
-						           'unsignedInt', int(delay),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
+					params = self.ferolSizeParams(0, fragSize,
+						                          relRMS*fragSize, delay)
+					params.update(self.ferolSizeParams(1, fragSize,
+						                               relRMS*fragSize, delay))
+					utils.setParams(frl, 'ferol::FerolController', params,
+						            verbose=self.options.verbose,
+						            dry=self.options.dry)
 			else: ## profile applied to the two FEROL streams
 				sizeProfile = utils.getSizeProfile(fragSize, 2,
 					                               self.options.sizeProfile)
@@ -492,40 +587,19 @@ class daq2Control(object):
 				if self.config.useGTPe: delayProfile = 2*[20]
 
 				for frl in self.config.FEROLs:
+					params = {}
 					if frl.enableStream0:
-						utils.setParam(frl,  'ferol::FerolController',
-							           'Event_Length_bytes_FED0',
-							           'unsignedInt', int(sizeProfile[0]),
-							           verbose=self.options.verbose,
-							           dry=self.options.dry)
-						utils.setParam(frl,  'ferol::FerolController',
-							           'Event_Length_Stdev_bytes_FED0',
-							           'unsignedInt',
-							           int(relRMS*sizeProfile[0]),
-							           verbose=self.options.verbose,
-							           dry=self.options.dry)
-						utils.setParam(frl,  'ferol::FerolController',
-							           'Event_Delay_ns_FED0',
-							           'unsignedInt', int(delayProfile[0]),
-							           verbose=self.options.verbose,
-							           dry=self.options.dry)
+						params.update(self.ferolSizeParams(0, sizeProfile[0],
+							                     relRMS*sizeProfile[0],
+							                     delayProfile[0]))
 					if frl.enableStream1:
-						utils.setParam(frl,  'ferol::FerolController',
-							           'Event_Length_bytes_FED1',
-							           'unsignedInt', int(sizeProfile[1]),
-							           verbose=self.options.verbose,
-							           dry=self.options.dry)
-						utils.setParam(frl,  'ferol::FerolController',
-							           'Event_Length_Stdev_bytes_FED1',
-							           'unsignedInt',
-							           int(relRMS*sizeProfile[1]),
-							           verbose=self.options.verbose,
-							           dry=self.options.dry)
-						utils.setParam(frl,  'ferol::FerolController',
-							           'Event_Delay_ns_FED1',
-							           'unsignedInt', int(delayProfile[0]),
-							           verbose=self.options.verbose,
-							           dry=self.options.dry)
+						params.update(self.ferolSizeParams(1, sizeProfile[1],
+							                     relRMS*sizeProfile[1],
+							                     delayProfile[0]))
+					if len(params) == 0: continue
+					utils.setParams(frl, 'ferol::FerolController', params,
+						            verbose=self.options.verbose,
+						            dry=self.options.dry)
 	def setSizeEFEDs(self, fragSize, fragSizeRMS):
 		if self.options.verbose > 0: print separator
 
@@ -535,16 +609,13 @@ class daq2Control(object):
 				## loop on eFED machines
 				for instance,fedid,_ in efed.streams:
 					## loop on applications for each eFED
-					utils.setParam(efed, 'd2s::FEDEmulator',
-						           'eventSize',
-						           'unsignedInt', int(fragSize),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
-					utils.setParam(efed, 'd2s::FEDEmulator',
-						           'eventSizeStdDev',
-						           'unsignedInt', int(fragSizeRMS),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
+					utils.setParams(efed, 'd2s::FEDEmulator',
+						            {'eventSize'       : ('unsignedInt',
+						                                  int(fragSize)),
+						             'eventSizeStdDev' : ('unsignedInt',
+						                                  int(fragSizeRMS))},
+						            verbose=self.options.verbose,
+						            dry=self.options.dry)
 		else: ## UNTESTED
 			raise RuntimeError('not implemented yet!')
 			sizeProfile = utils.getSizeProfile(fragSize,
@@ -553,16 +624,13 @@ class daq2Control(object):
 			relRMS = fragSizeRMS/fragSize
 
 			for fragSize,efed in zip(sizeProfile, self.config.eFEDs):
-				utils.setParam(efed, 'd2s::FEDEmulator',
-					           'eventSize', 'unsignedInt',
-					           int(fragSize),
-					           verbose=self.options.verbose,
-					           dry=self.options.dry)
-				utils.setParam(efed, 'd2s::FEDEmulator',
-					           'eventSizeStdDev', 'unsignedInt',
-					           int(relRMS*fragSize),
-					           verbose=self.options.verbose,
-					           dry=self.options.dry)
+				utils.setParams(efed, 'd2s::FEDEmulator',
+					            {'eventSize'       : ('unsignedInt',
+					                                  int(fragSize)),
+					             'eventSizeStdDev' : ('unsignedInt',
+					                                  int(relRMS*fragSize))},
+					            verbose=self.options.verbose,
+					            dry=self.options.dry)
 
 	def setRunNumber(self, number=0):
 		## Set Runnumber here:
@@ -658,14 +726,7 @@ class daq2Control(object):
 					file.write(configureCmd)
 		else:
 			print 'Producing configuration command files in',self._runDir
-			filenames = os.listdir(self.configDir)
-			for n,filename in enumerate(filenames):
-				utils.printProgress(n, len(filenames))
-				if not os.path.splitext(filename)[1] == '.xml':
-					continue
-
-				## TODO: Only do this for RUs that are not masked!
-				self.fillConfig(os.path.join(self.configDir,filename))
+			self.renderSplitConfigs()
 		if self.config.useInputEmulator and self.config.useEvB:
 			self.dropBUCaches()
 			sleep(5, self.options.verbose, self.options.dry)
@@ -675,19 +736,24 @@ class daq2Control(object):
 		running onlyPrepare=True will stop before configuring and enabling
 		"""
 		self.setCurrentSize(fragSize, fragSizeRMS, rate)
+		self.__failedHosts = []
+		self.__configSent  = []
+		self.__onlyPrepare = onlyPrepare
+
+		## Never start on top of an executive that is still shutting down
+		results = utils.stopHosts(self.config.hosts,
+			                      verbose=self.options.verbose-1,
+			                      dry=self.options.dry)
+		if not utils.printStopResults(results,
+			                          verbose=self.options.verbose-1):
+			self.retry('xdaq executives from a previous run still alive!')
+			return
 
-		## Start the xdaq processes from the launchers
-		if self.options.verbose > 0: print separator
-		if self.options.verbose > 0: print "Starting XDAQ processes"
-		for h in self.config.hosts:
-			if (self.options.maskHost is not None and
-				self.options.maskHost in h.host):
-				printWarningWithWait("Skipping %s" % h.host,
-					                  waittime=1, instance=self)
-				continue
-			utils.sendCmdToLauncher(h.host, h.lport, 'STARTXDAQ'+str(h.port),
-				                    verbose=self.options.verbose,
-				                    dry=self.options.dry)
+		## Start the xdaq processes from the launchers. Hosts that are down
+		## are reported by the availability check below.
+		unreachable = [r.host for r in results if r.outcome == 'unreachable']
+		self.startHosts([h for h in self.config.hosts
+			                          if not h in unreachable])
 		sleep(2, self.options.verbose, self.options.dry)
 
 		## Check availability of xdaq processes on relevant hosts
@@ -702,32 +768,9 @@ class daq2Control(object):
 				return
 
 		## Send the configuration file to each host
-		if self.options.verbose > 0: print separator
-		if self.options.verbose > 0: print "Configuring XDAQ processes"
-
-		configfilelist = []
-		for host in self.config.hosts:
-			filename = '%s/%s%d.xml.configure.cmd.xml'%(self._runDir,
-				                                            host.type,
-				                                            host.index)
-			configfilelist.append(filename)
-
-		if not self.splitConfig:
-			if not utils.sendToHostListInParallel2(
-				          self.config.hosts,
-	                      utils.sendCmdFileToExecutivePacked,
-				          (self._runDir+'/configure.cmd.xml',
-				           self.options.verbose, self.options.dry)):
-				self.retry("Failed to send command file to all hosts")
-				return
-		else:
-			if not utils.sendToHostListInParallel(
-				          self.config.hosts,
-	                      utils.sendCmdFileToExecutivePacked,
-	                      configfilelist,
-				          (self.options.verbose, self.options.dry)):
-				self.retry("Failed to send command file to all hosts")
-				return
+		if not self.sendConfiguration(self.config.hosts):
+			self.retry("Failed to send command file to all hosts")
+			return
 		sleep(2, self.options.verbose, self.options.dry)
 
 		## Set the fragment size, rms, and rate
@@ -740,6 +783,82 @@ class daq2Control(object):
 		self.configure()
 		self.enable()
 
+	def startHosts(self, hosts):
+		"""Starts the xdaq processes on hosts from their launchers"""
+		if self.options.verbose > 0: print separator
+		if self.options.verbose > 0: print "Starting XDAQ processes"
+		for h in hosts:
+			if (self.options.maskHost is not None and
+				self.options.maskHost in h.host):
+				printWarningWithWait("Skipping %s" % h.host,
+					                  waittime=1, instance=self)
+				continue
+			utils.sendCmdToLauncher(h.host, h.lport, 'STARTXDAQ'+str(h.port),
+				                    verbose=self.options.verbose,
+				                    dry=self.options.dry)
+	def sendConfiguration(self, hosts):
+		"""Sends the configure command file to the executives on hosts,
+		returns False if that failed for any of them"""
+		if self.options.verbose > 0: print separator
+		if self.options.verbose > 0: print "Configuring XDAQ processes"
+
+		if not self.splitConfig:
+			ok = utils.sendToHostListInParallel2(
+				          hosts,
+	                      utils.sendCmdFileToExecutivePacked,
+				          (self._runDir+'/configure.cmd.xml',
+				           self.options.verbose, self.options.dry))
+		else:
+			configfilelist = []
+			for host in hosts:
+				filename = '%s/%s%d.xml.configure.cmd.xml'%(self._runDir,
+					                                            host.type,
+					                                            host.index)
+				configfilelist.append(filename)
+			ok = utils.sendToHostListInParallel(
+				          hosts,
+	                      utils.sendCmdFileToExecutivePacked,
+	                      configfilelist,
+				          (self.options.verbose, self.options.dry))
+		if ok:
+			self.__configSent += [h for h in hosts
+			                         if not h in self.__configSent]
+		return ok
+	def haltHosts(self, hosts):
+		"""Sends 'Halt' to all checked applications on hosts that are not
+		'Halted' yet, sources before the event builder. Returns True if
+		they all get there."""
+		running = [r for r in utils.checkApplicationStates(hosts, 'Halted',
+			                                            dry=self.options.dry)
+		                                                       if not r.ok]
+		if len(running) == 0: return True
+		if self.options.verbose > 0: print separator
+		if self.options.verbose > 0: print "Halting"
+		sources = [(r.host, r.app, r.instance, None) for r in running
+		                             if not r.host.type in ['RU', 'BU']]
+		builder = [(r.host, r.app, r.instance, None) for r in running
+		                                 if r.host.type in ['RU', 'BU']]
+		self.sendCmdToGroups([sources, builder], 'Halt')
+		hosts = []
+		for r in running:
+			if not r.host in hosts: hosts.append(r.host)
+		return self.waitForState(hosts, 'Halted',
+			                     timeout=self.options.stateTimeout)
+	def waitForState(self, hosts, statename, timeout=0):
+		"""See utils.waitForState(). Remembers the hosts of all
+		applications that do not make it, for retry()."""
+		results = utils.waitForStateChecks(hosts, statename,
+			                               timeout=timeout,
+			                               verbose=self.options.verbose,
+			                               dry=self.options.dry)
+		self.addFailedHosts([r.host for r in results if not r.ok])
+		return utils.printStateChecks(results,
+			                          verbose=self.options.verbose-1)
+	def addFailedHosts(self, hosts):
+		for host in hosts:
+			if not host in self.__failedHosts:
+				self.__failedHosts.append(host)
+
 	def stop(self):
 		if self.options.verbose > 0: print separator
 		if self.options.verbose > 0: print "Stopping"
@@ -755,10 +874,9 @@ class daq2Control(object):
 		self.sendCmdToFEROLs( 'Stop')
 		if self.config.useGTPe:
 			self.sendCmdToGTPe('Stop')
-		sleep(3, self.options.verbose, self.options.dry)
-		self.checkStopped()
+		self.checkStopped(timeout=self.options.stateTimeout)
 		return
-	def checkStopped(self):
+	def checkStopped(self, timeout=0):
 		if self.options.verbose > 0: print separator
 		## Check everything is 'Configured' or 'Ready'
 		to_be_checked = [
@@ -772,9 +890,8 @@ class daq2Control(object):
 			     self.config.eFEDs + self.config.GTPe, 'Ready')]
 
 		for hostlist, state in to_be_checked:
-			if utils.checkStates(hostlist, state,
-				                 verbose=self.options.verbose,
-				                 dry=self.options.dry): continue
+			if self.waitForState(hostlist, state,
+				                 timeout=timeout): continue
 			printWarningWithWait("Failed to reach 'Configured' state.",
 				                 waittime=0, instance=self)
 			return False
@@ -813,13 +930,11 @@ class daq2Control(object):
 		## In case of mstreamio configurations:
 		if self.config.useMSIO:
 			if self.config.useIBV: ## Only do this for ibv!
-				pool = Pool(min(64,len(self.config.RUs)))
-
 				tasklist = [(ru, 'pt::ibv::Application', 0,
 					         'connect',
 					         self.options.verbose,
 					         self.options.dry) for ru in self.config.RUs]
-				pool.map(utils.sendSimpleCmdToAppPacked, tasklist)
+				utils.mapInParallel(utils.sendSimpleCmdToAppPacked, tasklist)
 			sleep(2, self.options.verbose, self.options.dry)
 			return
 
@@ -845,14 +960,9 @@ class daq2Control(object):
 			self.sendCmdToEVMRUBU('Configure')
 			self.sendCmdToEFEDs('Configure')
 			self.sendCmdToFEROLs('Configure')
-			sleep(10, self.options.verbose, self.options.dry)
-			if not self.checkConfigured():
-				printWarningWithWait("Not everything configured. Waiting "
-					                 "another 10s and checking again.",
-					                 waittime=10, instance=self)
-				if not self.checkConfigured():
-					self.retry('Failed to configure.')
-					return
+			if not self.checkConfigured(timeout=self.options.stateTimeout):
+				self.retry('Failed to configure.')
+				return
 			return
 
 		## In case of FEROLs:
@@ -880,20 +990,15 @@ class daq2Control(object):
 			if self.config.useGTPe:
 				self.sendCmdToGTPeFMM('Configure', invert=False)
 
-			sleep(10, self.options.verbose, self.options.dry)
-			if not self.checkConfigured():
-				printWarningWithWait("Not everything configured. Waiting "
-					                 "another 10s and checking again.",
-					                 waittime=10, instance=self)
-				if not self.checkConfigured():
-					self.retry('Failed to configure.')
-					return
+			if not self.checkConfigured(timeout=self.options.stateTimeout):
+				self.retry('Failed to configure.')
+				return
 			return
 
 		printWarningWithWait("daq2Control::Configure ==> Doing nothing.",
 			                 waittime=1, instance=self)
 		return
-	def checkConfigured(self):
+	def checkConfigured(self, timeout=0):
 		if self.options.verbose > 0: print separator
 		## Check everything is 'Configured' or 'Ready'
 		to_be_checked = [(self.config.FEROLs, 'Configured'),
@@ -905,9 +1010,8 @@ class daq2Control(object):
 
 		configured = True
 		for hostlist, state in to_be_checked:
-			if utils.checkStates(hostlist, state,
-				                 verbose=self.options.verbose,
-				                 dry=self.options.dry): continue
+			if self.waitForState(hostlist, state,
+				                 timeout=timeout): continue
 			printWarningWithWait('Configure failed for some machines.',
 				                  waittime=0, instance=self)
 			configured = False
@@ -930,7 +1034,8 @@ class daq2Control(object):
 
 			## Enable FEROLs
 			self.sendCmdToFEROLs('Enable')
-			sleep(10, self.options.verbose, self.options.dry)
+			self.waitForState(self.config.FEROLs, 'Enabled',
+				              timeout=self.options.stateTimeout)
 
 			## Enable FMM:
 			if self.config.useGTPe:
@@ -942,12 +1047,9 @@ class daq2Control(object):
 
 			self.sendCmdToEFEDs('Enable')
 
-			if not self.checkEnabled():
-				if self.options.verbose > 0: print "Waiting a bit longer..."
-				sleep(10, self.options.verbose, self.options.dry)
-				if not self.checkEnabled():
-					self.retry('Failed to enable all FEROLs and RUs.')
-					return
+			if not self.checkEnabled(timeout=self.options.stateTimeout):
+				self.retry('Failed to enable all FEROLs and RUs.')
+				return
 
 			## Enable GTPe:
 			if self.config.useGTPe:
@@ -994,7 +1096,7 @@ class daq2Control(object):
 		printWarningWithWait("daq2Control::Enable ==> Doing nothing.",
 			                 waittime=1, instance=self)
 		return
-	def checkEnabled(self):
+	def checkEnabled(self, timeout=0):
 		if self.options.verbose > 0: print separator
 
 		## Check Status of FEROLs and EVM/RUs:
@@ -1002,14 +1104,12 @@ class daq2Control(object):
 			hosts_to_check =  self.config.FEROLs[:]
 			hosts_to_check += self.config.RUs
 			hosts_to_check += self.config.BUs
-			if not utils.checkStates(hosts_to_check, 'Enabled',
-				                     verbose=self.options.verbose,
-				                     dry=self.options.dry):
+			if not self.waitForState(hosts_to_check, 'Enabled',
+				                     timeout=timeout):
 				return False
 		if not self.config.useEvB:
-			if not utils.checkStates(self.config.FEROLs, 'Enabled',
-				                     verbose=self.options.verbose,
-				                     dry=self.options.dry):
+			if not self.waitForState(self.config.FEROLs, 'Enabled',
+				                     timeout=timeout):
 				return False
 
 		if self.options.verbose > 0: print separator
@@ -1017,6 +1117,13 @@ class daq2Control(object):
 		if self.options.verbose > 0: print separator
 		return True
 	def retry(self, message):
+		## Failures during a partial recovery are handled by falling back
+		## to a full restart, see recoverHosts()
+		if self.__recovering:
+			printWarningWithWait(message, waittime=0, instance=self)
+			self.__recoveryFailed = True
+			return
+
 		if self.__RETRY_COUNTER < self.options.retries:
 			print " -- retry %d of %d" % (self.__RETRY_COUNTER+1,
 				                          self.options.retries)
@@ -1024,6 +1131,14 @@ class daq2Control(object):
 			printWarningWithWait(message+' ... retrying',
 				                 waittime=0,
 				                 instance=self)
+			failed, self.__failedHosts = self.__failedHosts, []
+			if (self.options.partialRetry and len(failed) > 0 and
+				len(failed) < len(self.config.hosts)):
+				if self.recoverHosts(failed): return
+				printWarningWithWait('Restarting only the failed xdaq '
+					                 'executives did not work, restarting '
+					                 'all of them', waittime=0,
+					                 instance=self)
 			utils.stopXDAQs(self.symbolMap,
 				            verbose=self.options.verbose,
 				            dry=self.options.dry)
@@ -1034,6 +1149,55 @@ class daq2Control(object):
 		else:
 			printError(message, instance=self)
 			raise RuntimeError(message)
+	def recoverHosts(self, hosts):
+		"""
+		Restarts only the xdaq executives on hosts, after bringing all
+		applications on the other configured hosts back to 'Halted', and
+		then sets the size, configures and enables everything again.
+		Returns False if that did not work, in which case a full restart
+		is needed.
+		"""
+		if self.options.verbose > 0: print separator
+		print "Restarting %d of %d xdaq executives: %s" % (len(hosts),
+			                         len(self.config.hosts),
+			                         ', '.join([h.name for h in hosts]))
+		self.__recovering, self.__recoveryFailed = True, False
+		try:
+			## Only executives that got their configuration have
+			## applications that need to be halted
+			others = [h for h in self.__configSent if not h in hosts]
+			if len(others) > 0 and not self.haltHosts(others): return False
+
+			results = utils.stopHosts(hosts, verbose=self.options.verbose-1,
+				                      dry=self.options.dry)
+			if not utils.printStopResults(results,
+				                          verbose=self.options.verbose-1):
+				return False
+			if 'unreachable' in [r.outcome for r in results]:
+				return False ## restarting will not help
+			self.__configSent = [h for h in self.__configSent
+			                                    if not h in hosts]
+			self.startHosts(hosts)
+			sleep(2, self.options.verbose, self.options.dry)
+			if not self.webPingXDAQ(hosts):
+				sleep(5, self.options.verbose, self.options.dry)
+				if not self.webPingXDAQ(hosts): return False
+
+			if not self.sendConfiguration([h for h in self.config.hosts
+				                          if not h in self.__configSent]):
+				return False
+			sleep(2, self.options.verbose, self.options.dry)
+			self.setSize(self.currentFragSize, self.currentFragSizeRMS,
+				         rate=self.currentRate)
+			sleep(2, self.options.verbose, self.options.dry)
+			if self.__onlyPrepare: return True
+
+			self.configure()
+			if self.__recoveryFailed: return False
+			self.enable()
+			return not self.__recoveryFailed
+		finally:
+			self.__recovering = False
 
 	def prepareOutputDir(self):
 		import glob
@@ -1071,6 +1235,9 @@ class daq2Control(object):
 				subprocess.check_call(['mv'] +
 					                  glob.glob(self._outputDir+'*.csv') +
 					                  [newdir])
+			if os.path.exists(self._outputDir+STORE_NAME):
+				subprocess.check_call(['mv', self._outputDir+STORE_NAME,
+					                   newdir])
 			if os.path.exists(self._outputDir+'infospaces'):
 				subprocess.check_call(['mv', self._outputDir+'infospaces',
 					                   newdir])
@@ -1081,21 +1248,29 @@ class daq2Control(object):
 			except OSError: pass ## dir exists already
 
 
-		## Prepare output file:
-		with open(self._outputDir+'/server.csv', 'a') as outfile:
-			outfile.write('## Testcase: %s\n' % self.config.testCase)
-			if self.options.useLogNormal:
-				outfile.write('## useLogNormal = True, RMS = %5.2f\n' %
-					           float(self.options.relRMS) )
-			outfile.write('## %s\n' %
-				               time.strftime('%a %b %d, %Y / %H:%M:%S'))
-			hashtag = utils.getGitHashTag()
-			outfile.write('## Git Hashtag: %s (%s)\n' %
-				               (hashtag[:7], hashtag))
-			outfile.write('\n##\n')
-			self.config.printHosts(out=outfile, prepend='## ')
-			outfile.write('\n\n')
-			outfile.close()
+		## Prepare results store:
+		from StringIO import StringIO
+		hostsummary = StringIO()
+		self.config.printHosts(out=hostsummary)
+		builder, protocol = self.config.getBuilderAndProtocol()
+		info = {'testcase'     : self.config.testCase,
+		        'builder'      : builder,
+		        'protocol'     : protocol,
+		        'useLogNormal' : bool(self.options.useLogNormal),
+		        'date'         : time.strftime('%a %b %d, %Y / %H:%M:%S'),
+		        'githash'      : utils.getGitHashTag(),
+		        'hostsummary'  : hostsummary.getvalue().splitlines()}
+		if self.options.useLogNormal:
+			info['relRMS'] = float(self.options.relRMS)
+
+		## Per-RU rates are stored along with the averages for the EvB
+		hosts = []
+		if self.config.useEvB:
+			hosts = [ru.name for ru in self.config.RUs[1:]]
+
+		if self.results is not None: self.results.close()
+		self.results = ResultsWriter(self._outputDir+STORE_NAME)
+		self.results.startRun(info, hosts=hosts)
 
 	def setSize(self, fragSize, fragSizeRMS=0, rate='max'):
 		if self.options.verbose > 0:
@@ -1169,8 +1344,6 @@ class daq2Control(object):
 
 		## In case of eFEROLs (also configure and enable in this case):
 		elif len(self.config.eFEROLs) > 0:
-			pool = Pool(min(64,len(self.config.eFEROLs)))
-
 			## Configure and enable pt::frl application on eFEROLs:
 			if self.options.verbose > 0: print separator
 			tasklist = [(efrl, 'pt::frl::Application', n,
@@ -1178,7 +1351,7 @@ class daq2Control(object):
 				         self.options.verbose,
 				         self.options.dry) for n,efrl in enumerate(
 				                                       self.config.eFEROLs)]
-			pool.map(utils.sendSimpleCmdToAppPacked, tasklist)
+			utils.mapInParallel(utils.sendSimpleCmdToAppPacked, tasklist)
 
 			if self.options.verbose > 0: print separator
 			for n,efrl in enumerate(self.config.eFEROLs):
@@ -1208,15 +1381,12 @@ class daq2Control(object):
 			if self.options.useLogNormal:
 				if self.options.verbose > 0: print separator
 				for n,efrl in enumerate(self.config.eFEROLs):
-					utils.setParam(efrl, 'evb::test::DummyFEROL',
-						           'fedSizeStdDev', 'unsignedInt',
-						           int(fragSizeRMS),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
-					utils.setParam(efrl, 'evb::test::DummyFEROL',
-						           'useLogNormal', 'boolean', 'true',
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
+					utils.setParams(efrl, 'evb::test::DummyFEROL',
+						            {'fedSizeStdDev' : ('unsignedInt',
+						                                int(fragSizeRMS)),
+						             'useLogNormal'  : ('boolean', 'true')},
+						            verbose=self.options.verbose,
+						            dry=self.options.dry)
 
 			## Set super-fragment size for BUs
 			if not self.config.useEvB:
@@ -1280,16 +1450,12 @@ class daq2Control(object):
 		## In case of gevb2g InputEmulator configurations:
 		elif self.config.useInputEmulator and not self.config.useEvB:
 			for n,ru in enumerate(self.config.RUs):
-				utils.setParam(ru, 'gevb2g::InputEmulator',
-					           'Mean', 'unsignedLong',
-					           fragSize,
-					           verbose=self.options.verbose,
-					           dry=self.options.dry)
-				utils.setParam(ru, 'gevb2g::InputEmulator',
-					           'StdDev', 'unsignedLong',
-					           int(fragSizeRMS),
-					           verbose=self.options.verbose,
-					           dry=self.options.dry)
+				utils.setParams(ru, 'gevb2g::InputEmulator',
+					            {'Mean'   : ('unsignedLong', fragSize),
+					             'StdDev' : ('unsignedLong',
+					                         int(fragSizeRMS))},
+					            verbose=self.options.verbose,
+					            dry=self.options.dry)
 			for n,bu in enumerate(self.config.BUs):
 				utils.setParam(bu, 'gevb2g::BU',
 					           'currentSize', 'unsignedLong',
@@ -1303,36 +1469,20 @@ class daq2Control(object):
 				if n==0:
 					classname = 'EVM'
 					## Set a separate, smaller size for the EVM
-					utils.setParam(ru, 'evb::%s'%classname,
-						           'dummyFedSize', 'unsignedInt',
-						           1024,
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
+					params = {'dummyFedSize' : ('unsignedInt', 1024)}
 				else:
-					utils.setParam(ru, 'evb::%s'%classname,
-						           'dummyFedSize', 'unsignedInt',
-						           int(fragSize),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
+					params = {'dummyFedSize' : ('unsignedInt',
+						                        int(fragSize))}
 					if fragSizeRMS>0:
-						utils.setParam(ru, 'evb::%s'%classname,
-							           'dummyFedSizeStdDev',
-							           'unsignedInt',
-							           int(fragSizeRMS),
-							           verbose=self.options.verbose,
-							           dry=self.options.dry)
-						utils.setParam(ru, 'evb::%s'%classname,
-							           'useLogNormal',
-							           'boolean',
-							           'true',
-							           verbose=self.options.verbose,
-							           dry=self.options.dry)
+						params['dummyFedSizeStdDev'] = ('unsignedInt',
+							                            int(fragSizeRMS))
+						params['useLogNormal'] = ('boolean', 'true')
 				if self.options.useRate != 'max':
-					utils.setParam(ru, 'evb::%s'%classname,
-						           'maxTriggerRate', 'unsignedInt',
-						           int(self.options.useRate),
-						           verbose=self.options.verbose,
-						           dry=self.options.dry)
+					params['maxTriggerRate'] = ('unsignedInt',
+						                        int(self.options.useRate))
+				utils.setParams(ru, 'evb::%s'%classname, params,
+					            verbose=self.options.verbose,
+					            dry=self.options.dry)
 	def changeSize(self, fragSize, fragSizeRMS=0, rate='max'):
 		## --stopRestart option or eFEROLs:
 		##   stop everything, set new size, start again
@@ -1436,97 +1586,129 @@ class daq2Control(object):
 
 		return
 
+	def getSizeRate(self, host, classname, sizeParam):
+		"""Get size and event rate from one application in a single
+		ParameterGet."""
+		values = utils.getParams(host, classname,
+			                     {sizeParam  : 'xsd:unsignedInt',
+			                      'eventRate' : 'xsd:unsignedInt'})
+		return values[sizeParam], values['eventRate']
 	def getSizeRateFromEVM(self):
 		"""Get the  event rate and super-fragment size from the EVM
 		and multiply them to get throughput.
 		Unit is Bytes/s.
 		"""
-		size = int(utils.getParam(self.config.RUs[0], 'evb::EVM',
-				                  'superFragmentSize', 'xsd:unsignedInt'))
-		rate = int(utils.getParam(self.config.RUs[0], 'evb::EVM',
-				                  'eventRate', 'xsd:unsignedInt'))
-		return size, rate
+		return self.getSizeRate(self.config.RUs[0], 'evb::EVM',
+			                    'superFragmentSize')
 
 	def getSizeRateFromRU(self):
 		"""Get the average event rate and super-fragment size from the RUs
 		and multiply them to get throughput.
 		Unit is Bytes/s.
 		"""
-		sizes, rates = [],[]
-		for ru in self.config.RUs[1:]: # first host in RUs list is EVM
-			sizes.append(int(utils.getParam(ru, 'evb::RU',
-				                            'superFragmentSize', 'xsd:unsignedInt')))
-			rates.append(int(utils.getParam(ru, 'evb::RU',
-				                            'eventRate', 'xsd:unsignedInt')))
-		av_size = reduce(lambda a,b:a+b, sizes)/len(sizes) ## in bytes
-		av_rate = reduce(lambda a,b:a+b, rates)/len(rates)
-		sigma_rate = sqrt(reduce(lambda a,b:a+b, map(lambda x:x*x, rates))/len(rates) - av_rate*av_rate)
-		return av_size, av_rate, sigma_rate
+		samples = [self.getSizeRate(ru, 'evb::RU', 'superFragmentSize')
+		                for ru in self.config.RUs[1:]] # first one is EVM
+		return averageSizeRate(samples)
 
 	def getSizeRateFromBU(self):
 		"""Get the average event rate and size from the BUs
 		and multiply them to get throughput.
 		Unit is Bytes/s.
 		"""
-		sizes, rates = [],[]
-		for bu in self.config.BUs:
-			sizes.append(int(utils.getParam(bu, 'evb::BU',
-				                            'eventSize', 'xsd:unsignedInt')))
-			rates.append(int(utils.getParam(bu, 'evb::BU',
-				                            'eventRate', 'xsd:unsignedInt')))
-		av_size = reduce(lambda a,b:a+b, sizes)/len(sizes) ## in bytes
-		av_rate = reduce(lambda a,b:a+b, rates)/len(rates)
-		return av_size, av_rate
-
-	def getResultsEvB(self, duration, interval=5):
+		samples = [self.getSizeRate(bu, 'evb::BU', 'eventSize')
+		                for bu in self.config.BUs]
+		return averageSizeRate(samples)[:2]
+
+	def sampleSizeRatesEvB(self):
+		"""
+		Query EVM, RUs, and BUs concurrently on the worker pool for one
+		sample. Returns the acquisition time (middle of the query window),
+		and the EVM, RU, and BU (size, rate) results.
+		"""
+		tasks  = [(self.config.RUs[0], 'evb::EVM', 'superFragmentSize')]
+		tasks += [(ru, 'evb::RU', 'superFragmentSize')
+		                                for ru in self.config.RUs[1:]]
+		tasks += [(bu, 'evb::BU', 'eventSize') for bu in self.config.BUs]
+		nrus = len(self.config.RUs)
+
+		starttime = time.time()
+		results = utils.mapInParallel(lambda task: self.getSizeRate(*task),
+			                          tasks)
+		timestamp = 0.5*(starttime + time.time())
+
+		return timestamp, results[0], results[1:nrus], results[nrus:]
+
+	def getResultsEvB(self, duration, interval=5, maxRelError=0,
+		              minSamples=MIN_RATE_SAMPLES):
 		"""
 		Python implementation of testRubuilder.pl script
-		This will get the parameter RATE from the BU after
-		an interval time for a total duration.
+		This will get the event rate from the RUs and BUs every
+		interval seconds for a total duration. Samples are taken on a
+		fixed time grid, querying all applications concurrently, and are
+		appended with their acquisition times and the rates of each RU as
+		one point to the results store (see daq2Results).
+		With maxRelError > 0, stops early once there are at least
+		minSamples and the mean rate is known to within that relative
+		error. Returns the mean rate at the RU in Hz (None for dry runs).
 		"""
-		if self.options.dry: return
+		if self.options.dry: return None
 		if self.config.useEvB:
 			sufragsize = (self.config.nStreams/len(self.config.RUs)
 						              * self.currentFragSize)
 			ratesamples = []
+			timestamps = []
+			rurates = []
 			bu_sizes = []
 			starttime = time.time()
 			if self.options.verbose>1:
 				stdout.write('Rate samples (ev/s @ RU (MB/s @ RU)):\n')
-			while(time.time() < starttime+duration):
-				time.sleep(interval)
-				ru_rate = int(utils.getParam(self.config.RUs[0],
-				                            'evb::EVM',
-				                            'eventRate',
-				                            'xsd:unsignedInt'))
-
-				ru_size, ru_rate, ru_rate_sigma = self.getSizeRateFromRU()
+			nsample, converged = 1, False
+			## Always take at least one sample, even for duration < interval
+			while nsample == 1 or nsample*interval <= duration:
+				waittime = starttime + nsample*interval - time.time()
+				if waittime > 0: time.sleep(waittime)
+
+				(timestamp, evm_sample,
+				 ru_samples, bu_samples) = self.sampleSizeRatesEvB()
+				ru_size, ru_rate, ru_rate_sigma = averageSizeRate(ru_samples)
 				ru_tp = ru_size*ru_rate/1e6
-				bu_size, bu_rate = self.getSizeRateFromBU()
+				bu_size, bu_rate, _ = averageSizeRate(bu_samples)
 				bu_sizes.append(bu_size)
 
 				ratesamples.append(ru_rate)
+				timestamps.append(timestamp)
+				rurates.append([rate for _,rate in ru_samples])
 				if self.options.verbose > 0:
 					if self.options.verbose>1:
 						stdout.write("%d (%7.2f) " % (ru_rate, ru_tp))
 						stdout.flush()
 					pass
+
+				## Stop once the mean rate has converged
+				error = relativeError(ratesamples)
+				if (maxRelError > 0 and len(ratesamples) >= minSamples and
+					error is not None and error < maxRelError):
+					converged = True
+					break
+
+				## Skip the grid points we missed if sampling took too long
+				nsample = max(nsample+1,
+					          int((time.time()-starttime)/interval)+1)
 			if self.options.verbose>1:
 				stdout.write("\n")
+			if self.options.verbose > 0 and converged:
+				print ('Mean rate converged to %.2g after %d samples '
+					   '(%.0f s)' % (error, len(ratesamples),
+					   	             time.time()-starttime))
 
 			bu_av_size = sum(bu_sizes)/len(bu_sizes) # Event size
 
-			with open(self._outputDir+'/server.csv', 'a') as outfile:
-				if self.options.verbose > 0:
-					print 'Saving output to', self._outputDir+'server.csv'
-				outfile.write("%d, "%sufragsize)
-				outfile.write("%d: "%ru_size)
-				for n,rate in enumerate(ratesamples):
-					if n < (len(ratesamples)-1):
-						outfile.write('%d, '%rate)
-					if n == len(ratesamples)-1:
-						outfile.write('%d'%rate)
-				outfile.write('\n')
+			if self.options.verbose > 0:
+				print 'Saving output to', self.results.directory
+			self.results.appendPoint(sufragsize, ratesamples,
+				                     size_ru=ru_size, timestamps=timestamps,
+				                     hostrates=rurates)
+			return float(sum(ratesamples))/len(ratesamples)
 
 		else:
 			printError("getResultsEvB() only works when running with "
@@ -1557,8 +1739,8 @@ class daq2Control(object):
 		subprocess.check_call(['curl', '-o', target, url])
 	def getResults(self):
 		"""
-		Download results for each BU, concatenate them, and store them
-		in server.csv. Only works for the gevb2g!
+		Download results for each BU and add their measurement points to
+		the results store (see daq2Results). Only works for the gevb2g!
 		"""
 		if self.options.dry: return
 
@@ -1581,14 +1763,15 @@ class daq2Control(object):
 				self.downloadMeasurements(url, outputfile)
 				outputfiles.append(outputfile)
 
-			## Concatenate output files
-			with open(self._outputDir+'/server.csv', 'a') as outfile:
-				if self.options.verbose > 0:
-					print 'Saving output to', self._outputDir+'server.csv'
-				for fname in outputfiles:
-					with open(fname, 'r') as infile:
-						outfile.write(infile.read())
-						outfile.write('\n')
+			## Add the measurements of all BUs to the results store
+			if self.options.verbose > 0:
+				print 'Saving output to', self.results.directory
+			for fname in outputfiles:
+				for _, points in readLegacyCSV(fname):
+					for size, size_ru, rates, timestamps in points:
+						self.results.appendPoint(size, rates,
+							                     size_ru=size_ru,
+							                     timestamps=timestamps)
 
 			## For mstreamIO get the client measurements
 			outputfiles = []
@@ -1624,13 +1807,10 @@ class daq2Control(object):
 			                                   dry=self.options.dry)
 		sufragsize = (self.config.nStreams/len(self.config.RUs)
 			                                   * self.currentFragSize)
-		with open(self._outputDir+'/server.csv', 'a') as outfile:
-			if self.options.verbose > 0:
-				print 'Saving output to', self._outputDir+'server.csv'
-			outfile.write(str(sufragsize))
-			outfile.write(', ')
-			outfile.write(str(throughput))
-			outfile.write('\n')
+		if self.options.dry: return
+		if self.options.verbose > 0:
+			print 'Saving output to', self.results.directory
+		self.results.appendPoint(sufragsize, [throughput])
 
 	def saveFEROLInfoSpaces(self):
 		if self.options.verbose > 0:
@@ -1655,21 +1835,33 @@ class daq2Control(object):
 		# bifi_fed0 = items["BIFI_FED0"] ##.split("&")[0]
 		# print bifi_fed0
 
-	def webPingXDAQ(self):
+	def webPingXDAQ(self, hosts=None):
+		"""Probes all hosts concurrently, reports all the ones that are not
+		reachable and returns False if there are any"""
+		if hosts is None: hosts = self.config.hosts
 		print separator
 		print "Checking availability of relevant hosts"
-		for host in self.config.hosts:
-			stdout.write(" ... checking %25s:%-5d \t\t ... " %
-				                                  (host.host, host.port))
-			stdout.flush()
-			if (self.options.dry or
-				utils.tryWebPing(host.host, host.port) == 0):
-				stdout.write("OK\n")
-				stdout.flush()
-			else:
-				stdout.write("FAILED\n")
-				stdout.flush()
-				return False
+		failed = []
+		if not self.options.dry:
+			failed = utils.probeHosts(hosts,
+				                      mode=self.options.probeMode,
+				                      timeout=self.options.probeTimeout)
+		self.addFailedHosts([host for host, reason in failed])
+		reasons = dict([((host.host, host.port), reason)
+			                            for host, reason in failed])
+		for host in hosts:
+			reason = reasons.get((host.host, host.port))
+			stdout.write(" ... checking %25s:%-5d \t\t ... %s\n" % (
+				                  host.host, host.port,
+				                  'OK' if reason is None else 'FAILED'))
+		stdout.flush()
+		if len(failed) > 0:
+			printError('%d host(s) not reachable:\n%s' % (len(failed),
+				       '\n'.join(['   %-20s %25s:%-5d %s' % (host.name,
+				                    host.host, host.port, reason)
+				                   for host, reason in failed])),
+				       instance=self)
+			return False
 		return True
 	def dropBUCaches(self):
 		if self.options.verbose > 0:
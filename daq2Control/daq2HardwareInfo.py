@@ -1,7 +1,15 @@
+import os, hashlib
+import cPickle as pickle
 from itertools import cycle
 from pprint import pprint
 from daq2Utils import printError
 
+## The tokenized cabling files are pickled to this directory (next to the
+## 40GE cabling file), keyed by the content of both files. Bump the
+## version when the record format changes.
+SNAPSHOT_DIR = '.hwinfocache'
+SNAPSHOT_VERSION = 1
+
 def addDictionaries(original, to_be_added):
 	"""
 	Adds two dictionaries of key -> list such that
@@ -64,7 +72,7 @@ class daq2HardwareInfo(object):
 		         ibcabling="2015-05-05-infiniband-ports.csv",
 		         geswitchmask=[], ibswitchmask=[],
 		         fedwhitelist=[], ruwhitelist=[], buwhitelist=[],
-		         verbose=0):
+		         verbose=0, useSnapshot=True):
 		super(daq2HardwareInfo, self).__init__()
 		self.verbose = verbose
 		self.ibswitchmask = ibswitchmask
@@ -74,11 +82,19 @@ class daq2HardwareInfo(object):
 		self.ferol_cabling     = {} ## ferol to corresponding frlpc
 		self.missingFEROLs     = [] ## ferols with unknown frlpc
 		self.ge_host_cabling   = {} ## hostname to ge switch
+		## Indexes for fast lookups, filled while reading
+		self.ge_switch_devices = {} ## ge switch to set of conn. devices
+		self.ge_switch_rus     = {} ## ge switch to list of RUs
+		self.ge_switch_frlpcs  = {} ## ge switch to list of frlpcs
+		self.fedid_ferol       = {} ## fedid to FEROL
+		self.subsystem_ferols  = {} ## subsystem name to list of FEROLs
+		self.crate_ferols      = {} ## crate to list of FEROLs
 
 		self.ib_switch_cabling = {} ## ib switch to port, list of conn. dev.
 		self.ru_inventory      = {} ## ib switch to list of RUs
 		self.bu_inventory      = {} ## ib switch to list of BUs
 		self.ib_host_cabling   = {} ## hostname to ib switch, port
+		self.allBUs            = [] ## all BUs, ordered by ib switch
 
 		self.FRLPCs = []
 		self.FEROLs = []
@@ -88,16 +104,60 @@ class daq2HardwareInfo(object):
 		self.ruwhitelist = ruwhitelist
 		self.buwhitelist = buwhitelist
 
-		self.read40GECabling(gecabling)
-		self.readIBCabling(ibcabling)
+		records = None
+		if useSnapshot:
+			snapshot = self.snapshotFile(gecabling, ibcabling)
+			records = self.loadSnapshot(snapshot)
+		if records is None:
+			records = (self.parse40GECabling(gecabling),
+				       self.parseIBCabling(ibcabling))
+			if useSnapshot: self.saveSnapshot(snapshot, records)
+
+		gerecords, ibrecords = records
+		self.fill40GECabling(gerecords)
+		self.fillIBCabling(*ibrecords)
+
+	def snapshotFile(self, gecabling, ibcabling):
+		sha = hashlib.sha1()
+		sha.update(str(SNAPSHOT_VERSION))
+		for filename in [gecabling, ibcabling]:
+			with open(filename, 'rb') as infile:
+				sha.update(infile.read())
+		return os.path.join(os.path.dirname(os.path.abspath(gecabling)),
+			                SNAPSHOT_DIR, sha.hexdigest()+'.pkl')
+	def loadSnapshot(self, filename):
+		"""Returns the records stored in a snapshot, or None"""
+		try:
+			with open(filename, 'rb') as infile:
+				records = pickle.load(infile)
+		except Exception: ## missing, truncated or stale snapshot
+			return None
+		if self.verbose>5: print 'Read cabling records from', filename
+		return records
+	def saveSnapshot(self, filename, records):
+		tmpfile = '%s.%d.tmp' % (filename, os.getpid())
+		try:
+			if not os.path.isdir(os.path.dirname(filename)):
+				os.makedirs(os.path.dirname(filename))
+			with open(tmpfile, 'wb') as outfile:
+				pickle.dump(records, outfile, pickle.HIGHEST_PROTOCOL)
+			os.rename(tmpfile, filename)
+		except (IOError, OSError) as e:
+			## not fatal, we'll just parse the csv files again next time
+			if self.verbose>0:
+				print 'Could not write cabling snapshot:', e
 
 	def read40GECabling(self, filename):
+		self.fill40GECabling(self.parse40GECabling(filename))
+		return True
+	def parse40GECabling(self, filename):
 		"""
-		Fill dictionaries for:
-		   ethswitch -> list of devices (rus, FEROLs)
-		   frlpc -> list of FEROLs
+		Tokenizes the 40GE cabling file into a list of records:
+		   ('missing', switch, device)
+		   ('ru', switch, hostname)
+		   ('ferol', switch, name, crate, slot, fedid1, fedid2, frlpc)
 		"""
-
+		records = []
 		with open(filename, 'r') as infile:
 			for line in infile:
 				if line.strip().startswith('#') or len(line.strip()) == 0:
@@ -105,27 +165,13 @@ class daq2HardwareInfo(object):
 
 				switch,device = line.strip().split(';')
 
-				## Apply mask
-				if self.geswitchmask and not switch in self.geswitchmask:
-					continue
-
-				if not switch in self.ge_switch_cabling:
-					self.ge_switch_cabling[switch] = []
-
 				if not 'frlpc' in device and not device.startswith('ru'):
-					self.missingFEROLs.append((switch, device))
-					if self.verbose>15:
-						print "Missing frlpc for:",switch, device
+					records.append(('missing', switch, device))
 					continue
 
 				spdevice = device.split(',')
 				if len(spdevice) == 1 and device.startswith('ru-'):
-					## Apply ru mask:
-					if (self.ruwhitelist and not device in self.ruwhitelist):
-						continue
-
-					self.ge_switch_cabling[switch].append(device)
-					self.ge_host_cabling[device] = switch
+					records.append(('ru', switch, device))
 					continue
 				elif len(spdevice) == 4: ## no fedids
 					name, crate, slop, frlpc = spdevice
@@ -143,48 +189,87 @@ class daq2HardwareInfo(object):
 						fedid1 = fedid1.lstrip('FEDs ')
 					else:
 						fedid1 = fedid1.lstrip('FED ')
-				ferol = FEROL(frlpc, int(slot), (fedid1, fedid2),
-					          name, crate, switch)
+				records.append(('ferol', switch, name, crate, int(slot),
+					            fedid1, fedid2, frlpc))
+		return records
+	def fill40GECabling(self, records):
+		"""
+		Fill dictionaries for:
+		   ethswitch -> list of devices (rus, FEROLs)
+		   frlpc -> list of FEROLs
+		"""
+		for record in records:
+			kind, switch = record[0], record[1]
+
+			## Apply mask
+			if self.geswitchmask and not switch in self.geswitchmask:
+				continue
 
-				## Apply fed mask:
-				if (self.fedwhitelist and
-					not fedid1 in self.fedwhitelist and
-					not fedid2 in self.fedwhitelist):
+			if not switch in self.ge_switch_cabling:
+				self.ge_switch_cabling[switch] = []
+				self.ge_switch_devices[switch] = set()
+				self.ge_switch_rus[switch]     = []
+				self.ge_switch_frlpcs[switch]  = []
+
+			if kind == 'missing':
+				device = record[2]
+				self.missingFEROLs.append((switch, device))
+				if self.verbose>15:
+					print "Missing frlpc for:",switch, device
+				continue
+
+			if kind == 'ru':
+				device = record[2]
+				## Apply ru mask:
+				if (self.ruwhitelist and not device in self.ruwhitelist):
 					continue
 
-				self.FEROLs.append(ferol)
-				if fedid1:
-					self.fedid_cabling[fedid1] = frlpc
-				if fedid2:
-					self.fedid_cabling[fedid2] = frlpc
-
-				if not frlpc in self.ge_switch_cabling[switch]:
-					self.ge_switch_cabling[switch].append(frlpc)
-				if not frlpc in self.frlpc_cabling:
-					self.frlpc_cabling[frlpc] = []
-				self.ge_host_cabling[frlpc] = switch
-				self.frlpc_cabling[frlpc].append(ferol)
-				self.ferol_cabling[ferol] = frlpc
+				self.ge_switch_cabling[switch].append(device)
+				self.ge_switch_devices[switch].add(device)
+				self.ge_switch_rus[switch].append(device)
+				self.ge_host_cabling[device] = switch
+				continue
+
+			_, _, name, crate, slot, fedid1, fedid2, frlpc = record
+			ferol = FEROL(frlpc, slot, (fedid1, fedid2),
+				          name, crate, switch)
+
+			## Apply fed mask:
+			if (self.fedwhitelist and
+				not fedid1 in self.fedwhitelist and
+				not fedid2 in self.fedwhitelist):
+				continue
+
+			self.FEROLs.append(ferol)
+			if fedid1:
+				self.fedid_cabling[fedid1] = frlpc
+				self.fedid_ferol[fedid1] = ferol
+			if fedid2:
+				self.fedid_cabling[fedid2] = frlpc
+				self.fedid_ferol[fedid2] = ferol
+			self.subsystem_ferols.setdefault(name, []).append(ferol)
+			self.crate_ferols.setdefault(crate, []).append(ferol)
+
+			if not frlpc in self.ge_switch_devices[switch]:
+				self.ge_switch_cabling[switch].append(frlpc)
+				self.ge_switch_devices[switch].add(frlpc)
+				if frlpc.startswith('frlpc-'):
+					self.ge_switch_frlpcs[switch].append(frlpc)
+			if not frlpc in self.frlpc_cabling:
+				self.frlpc_cabling[frlpc] = []
+			self.ge_host_cabling[frlpc] = switch
+			self.frlpc_cabling[frlpc].append(ferol)
+			self.ferol_cabling[ferol] = frlpc
 		return True
 	def readIBCabling(self, filename):
+		self.fillIBCabling(*self.parseIBCabling(filename))
+	def parseIBCabling(self, filename):
 		"""
-		Reads a file with lines formatted like:
-		switch,port,peerDevice,peerPort,blacklist,comment
-		or
-		switch,port,peerDevice
-		or
-		switch,port
-
-		And returns dictionaries formatted like:
-		switch : {port: (peerDevice, peerPort)},
-		...
-
-		hostname : {(switch, port)}
-
-		Also return two dictionaries for RU's and BU's formatted like:
-		switch : [list of connected RU/BU machines]
+		Tokenizes the IB cabling file into a list of
+		(switch, port, peerDevice, peerPort, blacklist) records.
+		Returns the records and False if a line failed to parse.
 		"""
-
+		records = []
 		with open(filename, 'r') as infile:
 			for line in infile:
 				if line.strip().startswith('#') or len(line.strip()) == 0:
@@ -194,42 +279,59 @@ class daq2HardwareInfo(object):
 				                 _.strip() for _ in line.split(',')]
 				except ValueError:
 					print("Failure to parse: "+line);
-					return
-
-				## mask switches
-				if self.ibswitchmask and not switch in self.ibswitchmask:
-					continue
-
-				## mask machines:
-				if self.buwhitelist and not device in self.buwhitelist:
-					if device.startswith('bu-'): continue
-				if self.ruwhitelist and not device in self.ruwhitelist:
-					if device.startswith('ru-'): continue
+					return records, False
 
 				if port is not '': port = int(port)
 				if dport is not '': dport = int(dport)
 				if blisted is not '': blisted = bool(int(blisted))
-				# print switch,port,device,dport,blisted,comment
+				records.append((switch, port, device, dport, blisted))
+		return records, True
+	def fillIBCabling(self, records, complete=True):
+		"""
+		Fills dictionaries formatted like:
+		switch : {port: (peerDevice, peerPort)},
+		...
+
+		hostname : {(switch, port)}
+
+		And two dictionaries for RU's and BU's formatted like:
+		switch : [list of connected RU/BU machines]
+		"""
+		for switch,port,device,dport,blisted in records:
+			## mask switches
+			if self.ibswitchmask and not switch in self.ibswitchmask:
+				continue
+
+			## mask machines:
+			if self.buwhitelist and not device in self.buwhitelist:
+				if device.startswith('bu-'): continue
+			if self.ruwhitelist and not device in self.ruwhitelist:
+				if device.startswith('ru-'): continue
 
-				if not switch in self.ib_switch_cabling.keys():
-					self.ib_switch_cabling[switch] = {}
-				self.ib_switch_cabling[switch][port] = (device,dport)
+			if not switch in self.ib_switch_cabling:
+				self.ib_switch_cabling[switch] = {}
+			self.ib_switch_cabling[switch][port] = (device,dport)
 
-				if device is None or blisted: continue
-				if device.startswith('ru'):
-					if not switch in self.ru_inventory.keys():
-						self.ru_inventory[switch] = []
-					self.ru_inventory[switch].append(device)
+			if device is None or blisted: continue
+			if device.startswith('ru'):
+				if not switch in self.ru_inventory:
+					self.ru_inventory[switch] = []
+				self.ru_inventory[switch].append(device)
 
-				if device.startswith('bu'):
-					if not switch in self.bu_inventory.keys():
-						self.bu_inventory[switch] = []
-					self.bu_inventory[switch].append(device)
+			if device.startswith('bu'):
+				if not switch in self.bu_inventory:
+					self.bu_inventory[switch] = []
+				self.bu_inventory[switch].append(device)
+
+		## the original reader stopped before this on a malformed line
+		if not complete: return
 
 		## Get also the inverted dictionary, hostname to switch, port
 		for switch, ports in self.ib_switch_cabling.iteritems():
 			for port, (hostname,_) in ports.iteritems():
 				self.ib_host_cabling[hostname] = (switch, port)
+		self.allBUs = [bu for bulist in self.bu_inventory.values()
+		                  for bu in bulist]
 
 	def getFRLBunches(self, frlpc, bunchBy=4, canonical=False):
 		"""
@@ -250,21 +352,17 @@ class daq2HardwareInfo(object):
 			if len(bunch) > 0:
 				yield bunch
 	def getAllRUs(self, switch):
-		return [ru for ru in self.ge_switch_cabling[switch]
-		                            if ru.startswith('ru-')]
+		return list(self.ge_switch_rus[switch])
 	def getRUs(self, switch):
 		"""
 		Return a RU on the same ETH switch as the frlpc,
 		as long as there are any
 		"""
-		allrus = [ru for ru in self.ge_switch_cabling[switch]
-		                            if ru.startswith('ru-')]
-		for ru in cycle(allrus):
+		for ru in cycle(list(self.ge_switch_rus[switch])):
 			yield ru
 	def getAllBUs(self, switch=None):
 		if not switch:
-			return [bu for bulist in self.bu_inventory.values()
-			           for bu in bulist]
+			return list(self.allBUs)
 		else:
 			try:
 				return [bu for bu in self.bu_inventory[switch]]
@@ -286,12 +384,13 @@ class daq2HardwareInfo(object):
 				bunch = []
 				counter = 0
 	def getListOfFRLPCs(self, ethswitch, minFRLs=0, minFEDIDs=0):
+		if minFRLs <= 0:
+			return list(self.ge_switch_frlpcs[ethswitch])
 		result = []
-		for device in self.ge_switch_cabling[ethswitch]:
-			if device.startswith('frlpc-'):
-				if len(self.getFEROLs(device,haveFEDIDs=minFEDIDs)) <minFRLs:
-					continue
-				result.append(device)
+		for frlpc in self.ge_switch_frlpcs[ethswitch]:
+			if len(self.getFEROLs(frlpc,haveFEDIDs=minFEDIDs)) < minFRLs:
+				continue
+			result.append(frlpc)
 		return result
 	def getFEROLs(self, frlpc, haveFEDIDs=0):
 		allFEROLs = self.frlpc_cabling[frlpc]
@@ -301,6 +400,19 @@ class daq2HardwareInfo(object):
 			return [f for f in allFEROLs if f.fedIds[1]]
 		else:
 			return allFEROLs
+	def getFEROLForFED(self, fedid):
+		"""Returns the FEROL reading out fedid, or None"""
+		return self.fedid_ferol.get(str(fedid))
+	def getFEROLsInSubsystem(self, system):
+		return list(self.subsystem_ferols.get(system, []))
+	def getFEROLsInCrate(self, crate):
+		return list(self.crate_ferols.get(crate, []))
+	def getGESwitch(self, hostname):
+		"""Returns the 40GE switch a RU or frlpc is connected to"""
+		return self.ge_host_cabling[hostname]
+	def getIBSwitchAndPort(self, hostname):
+		"""Returns the IB switch and port a RU or BU is connected to"""
+		return self.ib_host_cabling[hostname]
 
 def getMachines(inventory,splitBy=-1,verbose=False):
 	"""
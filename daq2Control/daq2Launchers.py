@@ -1,19 +1,111 @@
 #! /usr/bin/env python
 
-import os, time, subprocess
+import os, time, socket, subprocess
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 from daq2SymbolMap import daq2SymbolMap
-from daq2Utils import printError, sendCmdToLauncher, sleep
+from daq2Utils import printError
+import daq2SOAP as soap
+
+LAUNCHER_FANOUT = 32          ## hosts handled concurrently
+LAUNCHER_TIMEOUT = 30         ## seconds to wait for a launcher to start/stop
+LAUNCHER_POLL_INTERVAL = 0.5  ## seconds between polls of the launcher port
+LAUNCHER_QUERY_TIMEOUT = 2    ## seconds for a single launcher command
+
+## Outcome for one host: ok is True if the action was confirmed, reply
+## is the last answer of the launcher (or the error), elapsed in seconds
+LauncherResult = namedtuple('LauncherResult', ['host', 'ok', 'reply',
+	                                           'elapsed'])
+
+def queryLauncher(host, port, cmd, timeout=LAUNCHER_QUERY_TIMEOUT):
+	"""Sends a command to a launcher, returns the reply or None if the
+	launcher does not answer"""
+	try:
+		return soap.sendLauncherCommand(host, port, cmd,
+			                            timeout=timeout).strip()
+	except socket.error:
+		return None
+
+def pollLauncher(host, port, running=True, timeout=LAUNCHER_TIMEOUT,
+	             interval=LAUNCHER_POLL_INTERVAL):
+	"""
+	Polls the launcher port with GETXDAQSTATUS until the launcher answers
+	(running=True) or stops answering (running=False), at most for timeout
+	seconds. Returns (success, last reply).
+	"""
+	deadline = time.time() + timeout
+	while True:
+		reply = queryLauncher(host, port, 'GETXDAQSTATUS')
+		if (reply is not None) == running:
+			return True, reply
+		if time.time() > deadline:
+			return False, reply
+		time.sleep(interval)
+
+def forEachLauncher(symbolMap, func, options):
+	"""Calls func(host) for all SOAP hosts in the symbolmap on a bounded
+	thread pool, returns the list of results in the same order"""
+	hosts = symbolMap.allHosts
+	if len(hosts) == 0: return []
+	fanout = getattr(options, 'fanout', LAUNCHER_FANOUT)
+	pool = ThreadPool(max(1, min(fanout, len(hosts))))
+	try:
+		return pool.map(func, hosts)
+	finally:
+		pool.close()
+		pool.join()
+
+def printLauncherSummary(results, action, options):
+	"""Prints the failed hosts, returns True if all succeeded"""
+	failed = [result for result in results if not result.ok]
+	if options.verbose > 0 or failed:
+		print '%s: %d of %d launchers OK' % (action, len(results)-len(failed),
+			                                  len(results))
+	if failed:
+		printError('%s failed for %d launcher(s):' % (action, len(failed)))
+		for result in failed:
+			print '  %-20s %25s:%-5d %s' % (result.host.name, result.host.host,
+				                             result.host.lport,
+				                             result.reply or 'no answer')
+	return len(failed) == 0
 
 def stopXDAQLaunchers(symbolMap, options):
-	"""Kills the xdaqLauncher process on all the SOAP hosts defined in the symbolmap"""
-	for host in symbolMap.allHosts:
-		if options.verbose > 1: print "Stopping xdaqLauncher for %-20s on %s:%d" % (host.name, host.host, host.port)
-		sendCmdToLauncher(host.host, host.lport, 'STOPLAUNCHER')
+	"""Kills the xdaqLauncher process on all the SOAP hosts defined in the
+	symbolmap, and waits until they are gone"""
+	timeout = getattr(options, 'timeout', LAUNCHER_TIMEOUT)
+	def stopLauncher(host):
+		starttime = time.time()
+		if options.verbose > 1:
+			print "Stopping xdaqLauncher for %-20s on %s:%d" % (
+				                           host.name, host.host, host.lport)
+		reply = queryLauncher(host.host, host.lport, 'STOPLAUNCHER')
+		if reply is None:
+			return LauncherResult(host, True, 'not running',
+				                  time.time()-starttime)
+		stopped, _ = pollLauncher(host.host, host.lport, running=False,
+			                      timeout=timeout)
+		return LauncherResult(host, stopped,
+			                  reply if stopped else 'still answering',
+			                  time.time()-starttime)
+	results = forEachLauncher(symbolMap, stopLauncher, options)
+	printLauncherSummary(results, 'Stopping', options)
+	return results
 
 def getXDAQLauncherStatus(symbolMap, options):
-	"""Kills the xdaqLauncher process on all the SOAP hosts defined in the symbolmap"""
-	for host in symbolMap.allHosts:
-		sendCmdToLauncher(host.host, host.lport, 'GETXDAQSTATUS')
+	"""Prints the XDAQ status from all launchers on the SOAP hosts defined
+	in the symbolmap"""
+	def getStatus(host):
+		starttime = time.time()
+		reply = queryLauncher(host.host, host.lport, 'GETXDAQSTATUS')
+		return LauncherResult(host, reply is not None, reply,
+			                  time.time()-starttime)
+	results = forEachLauncher(symbolMap, getStatus, options)
+	for result in results:
+		if result.ok:
+			print '%s %s: %s' % (result.host.host, result.host.lport,
+				                 result.reply)
+	printLauncherSummary(results, 'Status', options)
+	return results
 
 def startXDAQLauncher(host, port, logfile, options):
 	"""Start a single xdaqLauncher process on host:port"""
@@ -42,13 +134,34 @@ def startXDAQLauncher(host, port, logfile, options):
 	return subprocess.call(cmd, stderr=logfile, stdout=logfile, shell=True)
 
 def startXDAQLaunchers(logfile, symbolMap, options):
-	"""Starts an xdaqLauncher process on all the SOAP hosts defined in the symbolmap"""
-	for host in symbolMap.allHosts:
-		message = "Starting xdaqLauncher for %-20s on %s:%d(LAUNCHER):%d(SOAP)" % (host.name, host.host, host.lport, host.port)
+	"""
+	Starts an xdaqLauncher process on all the SOAP hosts defined in the
+	symbolmap, at most options.fanout at a time, and waits until each of
+	them answers on its port. Launchers that are running already are left
+	alone.
+	"""
+	timeout = getattr(options, 'timeout', LAUNCHER_TIMEOUT)
+	def startLauncher(host):
+		starttime = time.time()
+		reply = queryLauncher(host.host, host.lport, 'GETXDAQSTATUS')
+		if reply is not None:
+			return LauncherResult(host, True, 'already running',
+				                  time.time()-starttime)
+
+		message = ("Starting xdaqLauncher for %-20s on "
+			       "%s:%d(LAUNCHER):%d(SOAP)" % (host.name, host.host,
+			       	                             host.lport, host.port))
 		logfile.write(message + '\n')
+		logfile.flush()
 		if options.verbose > 0: print message
 		startXDAQLauncher(host.host,host.lport,logfile, options)
-		sleep(0.2)
+
+		started, reply = pollLauncher(host.host, host.lport, running=True,
+			                          timeout=timeout)
+		return LauncherResult(host, started, reply, time.time()-starttime)
+	results = forEachLauncher(symbolMap, startLauncher, options)
+	printLauncherSummary(results, 'Starting', options)
+	return results
 
 if __name__ == "__main__":
 	from optparse import OptionParser
@@ -74,17 +187,27 @@ if __name__ == "__main__":
 		              action="store", type='string', dest="symbolMap",
 		              help=("Use this symbolmap for controlling the "
 		              	    "launchers, [default: take from environment]"))
+	parser.add_option("-f", "--fanout", default=LAUNCHER_FANOUT,
+		              action="store", type='int', dest="fanout",
+		              help=("Number of hosts to start/stop/query "
+		              	    "concurrently, [default: %default]"))
+	parser.add_option("-t", "--timeout", default=LAUNCHER_TIMEOUT,
+		              action="store", type='float', dest="timeout",
+		              help=("Seconds to wait for each launcher to answer "
+		              	    "after starting it, or to go away after "
+		              	    "stopping it, [default: %default]"))
 
 	(options, args) = parser.parse_args()
 
 	sm = daq2SymbolMap(symbolMapFile=options.symbolMap)
 
+	def allOK(results):
+		return 0 if all([result.ok for result in results]) else 1
+
 	if options.stop:
-		stopXDAQLaunchers(sm, options)
-		exit(0)
+		exit(allOK(stopXDAQLaunchers(sm, options)))
 	if options.status:
-		getXDAQLauncherStatus(sm, options)
-		exit(0)
+		exit(allOK(getXDAQLauncherStatus(sm, options)))
 	if options.start:
 		with open(options.logFile, 'w') as logfile:
 			length = 120
@@ -96,10 +219,10 @@ if __name__ == "__main__":
 			logfile.write('\n')
 			logfile.write(length*'#' + '\n')
 			logfile.write(length*'#' + '\n')
-			startXDAQLaunchers(logfile, sm, options)
+			results = startXDAQLaunchers(logfile, sm, options)
 			logfile.write(length*'#' + '\n')
 			logfile.write(length*'#' + '\n')
 			logfile.write('\n')
-		exit(0)
+		exit(allOK(results))
 	parser.print_help()
 	exit(-1)
@@ -4,6 +4,7 @@ import sys
 import subprocess
 import re
 import time
+import hashlib
 from copy import deepcopy
 from pprint import pprint
 
@@ -16,6 +17,7 @@ from xml.parsers.expat import ExpatError
 from daq2Utils import printError, printProgress
 from daq2FEDConfiguration import daq2ProdFEDConfiguration, FRLNode, RUNode
 from daq2Configurator import elementFromFile, addFragmentFromFile
+from daq2Configurator import fragmentCacheStats, StreamingXMLWriter
 from daq2Configurator import RU_STARTING_TID, BU_STARTING_TID
 from daq2Configurator import FEROL_OPERATION_MODES
 
@@ -23,6 +25,32 @@ def truncate(mylist, multiple=8):
 	delim = len(mylist)-len(mylist)%multiple
 	return mylist[:delim]
 
+## Written next to the configs, one line per output: 'digest filename'
+MANIFEST_NAME = 'manifest.txt'
+## Configurator settings that change the content of the outputs
+DIGEST_SETTINGS = ('evbns', 'ptprot', 'operation_mode', 'nbus',
+	               'enablePauseFrame', 'disablePauseFrame', 'setCWND',
+	               'setCorrelatedSeed', 'dropAtRU', 'useGTPe', 'useEFEDs',
+	               'useFMMForDAQ2', 'RUSendPoolSize', 'RUSendQPSize',
+	               'RUComplQPSize', 'BURecvPoolSize', 'BURecvQPSize',
+	               'BUComplQPSize', 'RUIBVConfig', 'BUIBVConfig',
+	               'EVMIBVConfig', 'setDynamicIBVConfig', 'maxMessageSize')
+
+def ferolDigestKey(ferol):
+	return (ferol.index, ferol.frlpc, ferol.slotNumber, tuple(ferol.fedIds),
+		    ferol.sourceIp, ferol.nstreams, ferol.ruindex)
+def ruDigestKey(ru):
+	return (ru.index, ru.hostname,
+		    tuple([ferolDigestKey(f) for f in ru.frls]))
+def sourceDigest(filenames):
+	"""SHA1 of the names and content of a list of files"""
+	sha = hashlib.sha1()
+	for filename in filenames:
+		sha.update(filename)
+		with open(filename, 'rb') as infile:
+			sha.update(infile.read())
+	return sha.hexdigest()
+
 ######################################################################
 from daq2Configurator import daq2Configurator
 class daq2ProdConfigurator(daq2Configurator):
@@ -52,17 +80,77 @@ class daq2ProdConfigurator(daq2Configurator):
 		self.allRUs = []
 		self.allFEROLs = []
 
+		## Incremental mode: only rewrite outputs whose inputs changed
+		self.incremental = False
+		self.manifest = {}    ## filename -> digest of the previous run
+		self.newManifest = {} ## filename -> digest of this run
+		self.baseDigest = ''
+		self.nskipped = 0
+
+	def loadManifest(self):
+		manifest = {}
+		manifestfile = os.path.join(self.outPutDir, MANIFEST_NAME)
+		try:
+			with open(manifestfile, 'r') as mfile:
+				for line in mfile:
+					if line.startswith('#') or len(line.strip()) == 0: continue
+					digest, filename = line.split()
+					manifest[filename] = digest
+		except IOError:
+			pass ## first run
+		return manifest
+	def writeManifest(self):
+		with open(os.path.join(self.outPutDir, MANIFEST_NAME), 'w') as mfile:
+			mfile.write('## digest filename\n')
+			for filename in sorted(self.newManifest.keys()):
+				mfile.write('%s %s\n' % (self.newManifest[filename], filename))
+	def computeBaseDigest(self):
+		"""Digest of the settings, the fragments and the code that are
+		common to all outputs"""
+		fragments = []
+		for dirpath, _, filenames in os.walk(self.fragmentdir):
+			fragments += [os.path.join(dirpath, f) for f in filenames
+			                                     if f.endswith('.xml')]
+		modules = [os.path.splitext(m.__file__)[0]+'.py' for m in
+		           (sys.modules[daq2Configurator.__module__],
+		            sys.modules[__name__])]
+		settings = tuple([getattr(self, name, None) for name in
+			                                            DIGEST_SETTINGS])
+		sha = hashlib.sha1()
+		sha.update(repr(settings))
+		sha.update(sourceDigest(sorted(fragments)))
+		sha.update(sourceDigest(modules))
+		return sha.hexdigest()
+	def needsUpdate(self, outputname, *inputs):
+		"""
+		Records the digest of outputname from its inputs, and returns False
+		if the output can be kept from the previous run
+		"""
+		digest = hashlib.sha1(self.baseDigest+repr(inputs)).hexdigest()
+		self.newManifest[outputname] = digest
+		if not self.incremental: return True
+		if (self.manifest.get(outputname) == digest and
+			os.path.exists(os.path.join(self.outPutDir, outputname))):
+			self.nskipped += 1
+			return False
+		return True
+
 
 	def makeFEROLConfig(self, ferol):
+		outputname = 'FEROLCONTROLLER%d.xml' % ferol.index
+		isevm = (ferol.ruindex==self.allRUs[0].index)
+		if not self.needsUpdate(outputname, ferolDigestKey(ferol), isevm):
+			return
 		self.makeSkeleton()
 		self.config.append(self.makeFerolController(ferol))
-		isevm = (ferol.ruindex==self.allRUs[0].index)
 		self.addRUContextWithGEEndpoint(ferol.ruindex, isEVM=isevm)
-		outputname = 'FEROLCONTROLLER%d.xml' % ferol.index
 		self.writeConfig(os.path.join(self.outPutDir,outputname))
 	def makeEVMConfig(self, ru):
-		self.makeSkeleton()
+		outputname = 'RU%d.xml' % ru.index
 		ru_instances = [r.index for r in self.allRUs[1:]]
+		if not self.needsUpdate(outputname, ruDigestKey(ru), ru_instances):
+			return
+		self.makeSkeleton()
 		self.addI2OProtocol(rus_to_add=ru_instances,
 			                evminst=self.allRUs[0].index)
 
@@ -74,9 +162,12 @@ class daq2ProdConfigurator(daq2Configurator):
 		for index in xrange(self.nbus):
 			self.addBUContextWithIBEndpoint(index)
 
-		outputname = 'RU%d.xml' % ru.index
 		self.writeConfig(os.path.join(self.outPutDir,outputname))
 	def makeRUConfig(self, ru):
+		outputname = 'RU%d.xml' % ru.index
+		if not self.needsUpdate(outputname, ruDigestKey(ru),
+			                    self.allRUs[0].index):
+			return
 		self.makeSkeleton()
 		self.addI2OProtocol(rus_to_add=[ru.index],
 			                evminst=self.allRUs[0].index)
@@ -85,36 +176,50 @@ class daq2ProdConfigurator(daq2Configurator):
 		self.addRUContextWithIBEndpoint(self.allRUs[0].index, isEVM=True)
 		for index in xrange(self.nbus):
 			self.addBUContextWithIBEndpoint(index)
-		outputname = 'RU%d.xml' % ru.index
 		self.writeConfig(os.path.join(self.outPutDir,outputname))
 	def makeBUConfig(self, buindex):
+		outputname = 'BU%d.xml' % buindex
+		if not self.needsUpdate(outputname, buindex, self.allRUs[0].index):
+			return
 		self.makeSkeleton()
 		## no RU, only one BU
 		self.addI2OProtocol(rus_to_add=[], bus_to_add=[buindex],
 			                evminst=self.allRUs[0].index)
 		self.config.append(self.makeBU(buindex))
 		self.addRUContextWithIBEndpoint(self.allRUs[0].index, isEVM=True)
-		outputname = 'BU%d.xml' % buindex
 		self.writeConfig(os.path.join(self.outPutDir,outputname))
 	def makeFullConfig(self):
+		"""
+		Writes full.xml context by context, so that the full partition is
+		never held in memory
+		"""
+		outputname = 'full.xml'
+		if not self.needsUpdate(outputname,
+			                    [ferolDigestKey(f) for f in self.allFEROLs],
+			                    [ruDigestKey(r) for r in self.allRUs]):
+			return
 		self.makeSkeleton()
 		ru_instances = [r.index for r in self.allRUs[1:]]
 		self.addI2OProtocol(rus_to_add=ru_instances)
 
+		writer = StreamingXMLWriter(os.path.join(self.outPutDir,outputname),
+			                        self.config)
+		for element in list(self.config):
+			writer.write(element)
+
 		for ferol in self.allFEROLs:
-			self.config.append(self.makeFerolController(ferol))
+			writer.write(self.makeFerolController(ferol))
 
 		## add the EVM
 		for ru in self.allRUs:
 			isevm = False
 			if ru.index == 0: isevm = True
-			self.config.append(self.makeRU(ru, isEVM=isevm))
+			writer.write(self.makeRU(ru, isEVM=isevm))
 
 		for index in xrange(self.nbus):
-			self.config.append(self.makeBU(index))
+			writer.write(self.makeBU(index))
 
-		outputname = 'full.xml'
-		self.writeConfig(os.path.join(self.outPutDir,outputname))
+		writer.close()
 
 	def assignFEROLsToRUs(self, rus_gen, ferols, nRUs):
 		ferols_to_use = [f for f in ferols if f.nstreams > 0]
@@ -267,6 +372,11 @@ class daq2ProdConfigurator(daq2Configurator):
 
 		if self.dry: return
 
+		self.baseDigest = self.computeBaseDigest()
+		self.manifest = self.loadManifest()
+		self.newManifest = {}
+		self.nskipped = 0
+
 		for n,ferol in enumerate(self.allFEROLs):
 			printProgress(n,len(self.allFEROLs),customstr='FEROLs: ')
 			self.makeFEROLConfig(ferol)
@@ -286,9 +396,26 @@ class daq2ProdConfigurator(daq2Configurator):
 
 		self.makeFullConfig()
 
+		## Remove outputs of the previous run that are no longer produced
+		for filename in self.manifest.keys():
+			if filename in self.newManifest: continue
+			try:
+				os.remove(os.path.join(self.outPutDir, filename))
+			except OSError:
+				pass
+		self.writeManifest()
+
 		if self.verbose>0:
 			print 70*'-'
 			print ' Wrote configs to %s' % self.outPutDir
+			if self.incremental:
+				print (' Regenerated %d of %d files' % (
+					   len(self.newManifest)-self.nskipped,
+					   len(self.newManifest)))
+			if self.verbose>1:
+				stats = fragmentCacheStats()
+				print (' Fragment cache: %d parsed, %d reused' % (
+					                       stats['misses'], stats['hits']))
 			print 70*'-'
 
 	def printSetup(self, filename):
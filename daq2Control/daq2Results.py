@@ -0,0 +1,448 @@
+#! /usr/bin/env python
+import os, re, json, struct
+
+######################################################################
+## Columnar store for scan results, replacing the free-form server.csv
+##
+## A store is a directory (results/ inside the output directory) with:
+##   meta.json    - schema version, column layout, run metadata
+##                  (test case, builder, date, git hash, hosts, ...)
+##                  and the labels of the per-host values
+##   <column>.bin - one file of fixed-width little-endian values per
+##                  column, one value (or one per host) per row
+##
+## Every row is one rate sample, the rows of one measurement point
+## share the same 'point' index. Columns are only ever appended to;
+## readers use the number of complete rows across all columns, so an
+## interrupted scan still leaves a readable store.
+##
+## Writing needs only the standard library, reading needs numpy.
+######################################################################
+
+STORE_NAME = 'results'
+META_NAME = 'meta.json'
+SCHEMA_VERSION = 1
+
+## (name, numpy dtype, struct format character, value if unknown)
+COLUMNS = [('run',       '<i4', 'i', None),
+           ('point',     '<i4', 'i', None),
+           ('timestamp', '<f8', 'd', float('nan')),
+           ('size',      '<i8', 'q', None),
+           ('size_ru',   '<i8', 'q', -1),
+           ('rate',      '<f8', 'd', None)]
+## one value per host in meta['hosts'], for each row
+HOST_COLUMN = ('host_rate', '<f8', 'd', float('nan'))
+
+def columnFile(directory, name):
+	return os.path.join(directory, name+'.bin')
+def isResultsStore(location):
+	return os.path.isfile(os.path.join(location, META_NAME))
+def findResultsStore(location):
+	"""
+	Returns the results store for a store directory, an output directory,
+	or a server.csv file in an output directory. None if there is none.
+	"""
+	location = location.rstrip('/')
+	if os.path.isfile(location):
+		location = os.path.dirname(location)
+	if isResultsStore(location):
+		return location
+	if isResultsStore(os.path.join(location, STORE_NAME)):
+		return os.path.join(location, STORE_NAME)
+	return None
+
+def readMetadata(directory):
+	with open(os.path.join(directory, META_NAME), 'r') as infile:
+		meta = json.load(infile)
+	if meta.get('version', 0) > SCHEMA_VERSION:
+		raise RuntimeError('Results store %s has schema version %d, can only '
+			               'read up to %d' % (directory, meta['version'],
+			               	                  SCHEMA_VERSION))
+	return meta
+def writeMetadata(directory, meta):
+	filename = os.path.join(directory, META_NAME)
+	tmpfile = '%s.%d.tmp' % (filename, os.getpid())
+	with open(tmpfile, 'w') as outfile:
+		json.dump(meta, outfile, indent=1, sort_keys=True)
+	os.rename(tmpfile, filename)
+
+######################################################################
+class ResultsWriter(object):
+	"""
+	Appends rate samples to a results store, creating it if needed.
+	Call startRun() with the run metadata first, then appendPoint() for
+	each measurement point. Column files are kept open and flushed after
+	every point.
+	"""
+	def __init__(self, directory):
+		self.directory = directory
+		if isResultsStore(directory):
+			self.meta = readMetadata(directory)
+		else:
+			if not os.path.isdir(directory): os.makedirs(directory)
+			self.meta = {'version' : SCHEMA_VERSION,
+			             'columns' : [(name, dtype) for
+			                          name,dtype,_,_ in COLUMNS],
+			             'hosts'   : [],
+			             'runs'    : []}
+		self.run = None
+		self.npoints = self.countPoints()
+		self._files = {}
+
+	def countPoints(self):
+		"""Number of points stored so far, from the last point index"""
+		filename = columnFile(self.directory, 'point')
+		if not os.path.exists(filename) or os.path.getsize(filename) < 4:
+			return 0
+		with open(filename, 'rb') as infile:
+			infile.seek(-(os.path.getsize(filename) % 4) - 4, os.SEEK_END)
+			return struct.unpack('<i', infile.read(4))[0] + 1
+
+	def startRun(self, info, hosts=[]):
+		"""
+		Adds a run with the metadata in info (a dictionary) and returns
+		its index. hosts are the labels for the per-host values, they
+		have to be the same for all runs in the store.
+		"""
+		hosts = list(hosts)
+		if hosts:
+			if not self.meta['hosts']:
+				self.meta['hosts'] = hosts
+				self.meta['columns'].append(HOST_COLUMN[:2])
+				## no per-host values for the rows stored so far
+				name, dtype, fmt, missing = HOST_COLUMN
+				filename = columnFile(self.directory, 'rate')
+				if os.path.exists(filename):
+					nrows = os.path.getsize(filename) // struct.calcsize('<d')
+					self.appendColumn(name, fmt, [missing]*nrows*len(hosts))
+			elif self.meta['hosts'] != hosts:
+				raise ValueError('Hosts %s do not match the ones in the '
+					             'results store %s' % (hosts, self.directory))
+		self.meta['runs'].append(dict(info))
+		writeMetadata(self.directory, self.meta)
+		self.run = len(self.meta['runs'])-1
+		return self.run
+
+	def appendColumn(self, name, fmt, values):
+		if not name in self._files:
+			self._files[name] = open(columnFile(self.directory, name), 'ab')
+		self._files[name].write(struct.pack('<%d%s' % (len(values), fmt),
+			                                *values))
+
+	def appendPoint(self, size, rates, size_ru=None, timestamps=None,
+		            hostrates=None):
+		"""
+		Stores the rate samples of one measurement point. timestamps has
+		one entry per sample, hostrates one list of per-host values per
+		sample.
+		"""
+		if self.run is None:
+			raise RuntimeError('Need to call startRun() before appendPoint()')
+		nsamples = len(rates)
+		if nsamples == 0: return
+		values = {'run'       : [self.run]*nsamples,
+		          'point'     : [self.npoints]*nsamples,
+		          'timestamp' : timestamps,
+		          'size'      : [size]*nsamples,
+		          'size_ru'   : None if size_ru is None else [size_ru]*nsamples,
+		          'rate'      : rates}
+
+		for name, _, fmt, missing in COLUMNS:
+			column = values[name]
+			if column is None: column = [missing]*nsamples
+			if len(column) != nsamples:
+				raise ValueError('Got %d values for %s, expected %d' % (
+					                          len(column), name, nsamples))
+			self.appendColumn(name, fmt, column)
+
+		nhosts = len(self.meta['hosts'])
+		if nhosts:
+			name, _, fmt, missing = HOST_COLUMN
+			flat = []
+			for n in range(nsamples):
+				if hostrates is None or len(hostrates[n]) != nhosts:
+					flat += [missing]*nhosts
+				else:
+					flat += list(hostrates[n])
+			self.appendColumn(name, fmt, flat)
+
+		for outfile in self._files.values():
+			outfile.flush()
+		self.npoints += 1
+
+	def close(self):
+		for outfile in self._files.values():
+			outfile.close()
+		self._files = {}
+
+######################################################################
+## Reading (needs numpy)
+def readColumns(directory):
+	"""
+	Returns the metadata and a dictionary of column name to a read-only
+	memory mapped array, all of them cut to the same number of rows.
+	Per-host columns have one row per sample and one column per host.
+	"""
+	import numpy as np
+	meta = readMetadata(directory)
+	nhosts = len(meta['hosts'])
+
+	layout = []
+	for name, dtype in meta['columns']:
+		width = nhosts if name == HOST_COLUMN[0] else 1
+		filename = columnFile(directory, name)
+		size = os.path.getsize(filename) if os.path.exists(filename) else 0
+		layout.append((name, np.dtype(str(dtype)), width, filename, size))
+	nrows = min([size // (dtype.itemsize*width)
+		                   for _, dtype, width, _, size in layout])
+
+	columns = {}
+	for name, dtype, width, filename, _ in layout:
+		shape = (nrows, width) if name == HOST_COLUMN[0] else (nrows,)
+		if nrows == 0:
+			columns[name] = np.zeros(shape, dtype=dtype)
+		else:
+			columns[name] = np.memmap(filename, dtype=dtype, mode='r',
+				                      shape=shape)
+	return meta, columns
+
+def mergeSamples(sizes, lengths, values):
+	"""
+	Takes the sizes and number of samples of a sequence of measurement
+	points, and all their samples concatenated. Returns a sorted array of
+	the distinct sizes, and a list with an array of samples for each of
+	them. Points with a repeated size are added up sample by sample,
+	after truncating them to the shortest one.
+	"""
+	import numpy as np
+	if len(sizes) == 0:
+		return np.array([], dtype=np.int64), []
+	lengths = np.asarray(lengths)
+
+	## Group the points by size and find the shortest of each size
+	unique, group = np.unique(np.asarray(sizes), return_inverse=True)
+	order = np.argsort(group, kind='mergesort')
+	starts = np.searchsorted(group[order], np.arange(len(unique)))
+	shortest = np.minimum.reduceat(lengths[order], starts)
+
+	## Position of each value within its point, and in the merged points
+	elempoint = np.repeat(np.arange(len(lengths)), lengths)
+	position = (np.arange(len(values)) -
+		        (np.cumsum(lengths)-lengths)[elempoint])
+	elemgroup = group[elempoint]
+	keep = position < shortest[elemgroup]
+	offsets = np.cumsum(shortest) - shortest
+	index = offsets[elemgroup[keep]] + position[keep]
+
+	## Add up repeated sizes
+	merged = np.bincount(index, weights=values[keep],
+		                 minlength=int(shortest.sum()))
+	merged = np.rint(merged).astype(np.int64)
+	return unique, np.split(merged, offsets[1:])
+
+def readRateSamples(directory, sizeFromRU=False):
+	"""
+	Same as for a server.csv file: returns the sorted distinct sizes and
+	a list of arrays with the (integer) rate samples for each of them.
+	"""
+	import numpy as np
+	meta, columns = readColumns(directory)
+	point = columns['point']
+	if len(point) == 0:
+		return mergeSamples([], [], [])
+
+	starts = np.flatnonzero(np.concatenate(([True], point[1:] != point[:-1])))
+	lengths = np.diff(np.append(starts, len(point)))
+	sizes = columns['size'][starts]
+	if sizeFromRU:
+		size_ru = columns['size_ru'][starts]
+		sizes = np.where(size_ru >= 0, size_ru, sizes)
+
+	## rates are truncated to integers, as when reading the csv files
+	values = np.asarray(columns['rate']).astype(np.int64)
+	return mergeSamples(sizes, lengths, values)
+
+def readPoints(directory):
+	"""
+	Returns a list of (size, size_ru, rates) for each measurement point,
+	in the order they were taken. rates are memory mapped arrays.
+	"""
+	import numpy as np
+	meta, columns = readColumns(directory)
+	point = columns['point']
+	if len(point) == 0: return []
+
+	starts = np.flatnonzero(np.concatenate(([True], point[1:] != point[:-1])))
+	ends = np.append(starts[1:], len(point))
+	return [(int(columns['size'][start]), int(columns['size_ru'][start]),
+		     columns['rate'][start:end]) for start, end in zip(starts, ends)]
+
+def rewriteStore(directory, target, func):
+	"""
+	Copies the results store in directory to a new store in target,
+	passing the rate samples of each point through func. func takes a
+	list of rates and returns a list of the same length with the new
+	values, or None for the samples to drop. Returns target.
+	"""
+	import numpy as np
+	meta, columns = readColumns(directory)
+	if isResultsStore(target):
+		raise RuntimeError('Results store %s exists already' % target)
+	hosts = meta['hosts']
+
+	point = columns['point']
+	starts = np.flatnonzero(np.concatenate(([True], point[1:] != point[:-1])))
+	ends = np.append(starts[1:], len(point))
+	if len(point) == 0: starts = []
+
+	writer = ResultsWriter(target)
+	try:
+		run = -1
+		for start, end in zip(starts, ends):
+			## Start the runs up to the one of this point
+			while run < columns['run'][start]:
+				run = writer.startRun(meta['runs'][run+1], hosts=hosts)
+
+			rates = func(columns['rate'][start:end].tolist())
+			keep = [n for n,rate in enumerate(rates) if rate is not None]
+			hostrates = None
+			if hosts:
+				hostrates = [columns[HOST_COLUMN[0]][start+n].tolist()
+				                                            for n in keep]
+			writer.appendPoint(int(columns['size'][start]),
+				               [rates[n] for n in keep],
+				               size_ru=int(columns['size_ru'][start]),
+				               timestamps=[float(columns['timestamp'][start+n])
+				                                             for n in keep],
+				               hostrates=hostrates)
+		while run < len(meta['runs'])-1:
+			run = writer.startRun(meta['runs'][run+1], hosts=hosts)
+	finally:
+		writer.close()
+	return target
+
+######################################################################
+## Legacy server.csv files
+LEGACY_HEADERS = [
+	('testcase', re.compile(r'## Testcase: (.*)$')),
+	('lognormal', re.compile(r'## useLogNormal = (\w*), RMS =\s*([\d.]*)$')),
+	('githash', re.compile(r'## Git Hashtag: \w* \((\w*)\)$')),
+	('builder', re.compile(r'## (\w*) configuration with (\w*)/(\w*)$')),
+	('date', re.compile(r'## (\w{3} \w{3} \d+, \d{4} / [\d:]+)$')),
+	('timestamps', re.compile(r'## timestamps: (.*)$')),
+	]
+
+def readLegacyCSV(filename):
+	"""
+	Parses a server.csv file into a list of runs, each a pair of the run
+	metadata and a list of (size, size_ru, rates, timestamps) points.
+	"""
+	runs = []
+	info, points, timestamps = None, [], None
+	with open(filename, 'r') as infile:
+		for line in infile:
+			stripped = line.strip()
+			if len(stripped) == 0: continue
+
+			if stripped.startswith('#'):
+				key, match = None, None
+				for key, regex in LEGACY_HEADERS:
+					match = regex.match(stripped)
+					if match: break
+
+				if key == 'testcase' and match or info is None:
+					info, points = {'hostsummary' : []}, []
+					runs.append((info, points))
+				if not match:
+					text = stripped.lstrip('#')
+					if text.startswith(' '): text = text[1:]
+					if text: info['hostsummary'].append(text)
+				elif key == 'testcase':
+					info['testcase'] = match.group(1)
+				elif key == 'lognormal':
+					info['useLogNormal'] = (match.group(1) == 'True')
+					info['relRMS'] = float(match.group(2))
+				elif key == 'githash':
+					info['githash'] = match.group(1)
+				elif key == 'builder':
+					info['testcase'] = info.get('testcase', match.group(1))
+					info['builder'] = match.group(2)
+					info['protocol'] = match.group(3)
+					info['hostsummary'].append(stripped[3:])
+				elif key == 'date':
+					info['date'] = match.group(1)
+				elif key == 'timestamps':
+					timestamps = [float(_) for _ in match.group(1).split(',')]
+				continue
+
+			if info is None:
+				info, points = {'hostsummary' : []}, []
+				runs.append((info, points))
+
+			try:
+				# sufragsize, sizeru: rate1, rate2, rate3, ...
+				header, body = line.split(':')
+				size, size_ru = tuple([int(_) for _ in header.split(',')])
+			except ValueError:
+				# size, rate1, rate2, rate3, ...
+				size, body = line.split(',',1)
+				size, size_ru = int(size), None
+			if len(body.strip()) == 0: continue
+
+			rates = [float(_) for _ in body.split(',')]
+			if timestamps is not None and len(timestamps) != len(rates):
+				timestamps = None
+			points.append((size, size_ru, rates, timestamps))
+			timestamps = None
+	return runs
+
+def convertLegacyCSV(filename, directory=None, verbose=0):
+	"""
+	Converts a server.csv file into a results store, by default in
+	results/ next to it. Returns the store directory.
+	"""
+	if directory is None:
+		directory = os.path.join(os.path.dirname(os.path.abspath(filename)),
+			                     STORE_NAME)
+	if isResultsStore(directory):
+		raise RuntimeError('Results store %s exists already' % directory)
+
+	writer = ResultsWriter(directory)
+	try:
+		for info, points in readLegacyCSV(filename):
+			info['convertedFrom'] = os.path.abspath(filename)
+			writer.startRun(info)
+			for size, size_ru, rates, timestamps in points:
+				writer.appendPoint(size, rates, size_ru=size_ru,
+					               timestamps=timestamps)
+	finally:
+		writer.close()
+	if verbose > 0:
+		print 'Converted %s (%d points) to %s' % (filename, writer.npoints,
+			                                      directory)
+	return directory
+
+######################################################################
+if __name__ == "__main__":
+	from optparse import OptionParser
+	usage = """[%prog] [options] server.csv [server.csv ...]
+
+Converts server.csv files into results stores, written to a results/
+directory next to each of them.
+"""
+	parser = OptionParser(usage=usage)
+	parser.add_option("-o", "--output", default='', action="store",
+		              type="string", dest="output",
+		              help=("Output directory for the results store, only "
+		                    "for a single input file [default: next to the "
+		                    "input file]"))
+	(options, args) = parser.parse_args()
+
+	if len(args) == 0 or (options.output and len(args) > 1):
+		parser.print_help()
+		exit(-1)
+
+	for filename in args:
+		convertLegacyCSV(filename, directory=options.output or None,
+			             verbose=1)
+	exit(0)
@@ -0,0 +1,251 @@
+import os, re, errno, socket, threading, httplib
+
+######################################################################
+## In-process SOAP client for the xdaq executives.
+## Replaces the curl/perl wrappers in scripts/ by keeping one pool of
+## persistent (keep-alive) HTTP connections per host:port.
+######################################################################
+
+DEFAULT_TIMEOUT = 60 ## seconds, for connect and for the reply
+
+SOAPEnvelope = '''<SOAP-ENV:Envelope
+   SOAP-ENV:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"
+   xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/"
+   xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+   xmlns:xsd="http://www.w3.org/2001/XMLSchema"
+   xmlns:SOAP-ENC="http://schemas.xmlsoap.org/soap/encoding/">
+      <SOAP-ENV:Header>
+      </SOAP-ENV:Header>
+      <SOAP-ENV:Body>
+         %s
+      </SOAP-ENV:Body>
+</SOAP-ENV:Envelope>
+'''
+
+SOAP_HEADERS = {'Content-Type'        : 'text/xml',
+                'Content-Description' : 'SOAP Message'}
+
+######################################################################
+class SOAPConnectionPool(object):
+	"""
+	Keeps idle HTTP connections per (host, port) and hands them out
+	again for the next request. Thread-safe. Connections are dropped
+	after a fork, so that child processes never share sockets with
+	their parent.
+	"""
+	def __init__(self, timeout=DEFAULT_TIMEOUT, maxidle=4):
+		self.timeout = timeout
+		self.maxidle = maxidle
+		self._lock = threading.Lock()
+		self._idle = {}
+		self._pid = os.getpid()
+
+	def _checkPid(self):
+		if self._pid != os.getpid():
+			self._idle = {}
+			self._pid = os.getpid()
+
+	def acquire(self, host, port):
+		"""Returns (connection, reused)"""
+		self._lock.acquire()
+		try:
+			self._checkPid()
+			idle = self._idle.get((host, int(port)), [])
+			if len(idle) > 0:
+				return idle.pop(), True
+		finally:
+			self._lock.release()
+		return httplib.HTTPConnection(host, int(port),
+			                          timeout=self.timeout), False
+
+	def release(self, host, port, connection):
+		self._lock.acquire()
+		try:
+			self._checkPid()
+			idle = self._idle.setdefault((host, int(port)), [])
+			if len(idle) < self.maxidle:
+				idle.append(connection)
+				return
+		finally:
+			self._lock.release()
+		connection.close()
+
+	def closeAll(self):
+		self._lock.acquire()
+		try:
+			for idle in self._idle.values():
+				for connection in idle:
+					connection.close()
+			self._idle = {}
+		finally:
+			self._lock.release()
+
+_pool = SOAPConnectionPool()
+
+def getConnectionPool():
+	return _pool
+
+######################################################################
+def isStale(error):
+	"""
+	True if error means that the server had closed a kept-alive
+	connection before the request, i.e. nothing of a reply was read and
+	the request can safely be sent again. Never true for a timeout.
+	"""
+	if isinstance(error, httplib.BadStatusLine):
+		## The line read, or (depending on the python version) its repr or
+		## a note if the server closed the connection without a reply
+		return (not error.line or error.line == "''" or
+			    error.line.startswith('No status line received'))
+	if isinstance(error, socket.timeout):
+		return False
+	return (isinstance(error, socket.error) and
+		    getattr(error, 'errno', None) in (errno.ECONNRESET, errno.EPIPE))
+
+def post(host, port, body, headers, timeout=None, pool=None):
+	"""
+	Posts body to http://host:port/ with the given extra headers (a dict)
+	and returns the reply as a string. timeout applies to this request
+	only, also on a reused connection (default: the timeout of the pool).
+	A reused connection that turns out to be stale is replaced by a fresh
+	one, any other failure is never retried, as the commands are not
+	idempotent. Raises socket.error or httplib.HTTPException if the
+	executive cannot be reached.
+	"""
+	if pool is None: pool = _pool
+	if timeout is None: timeout = pool.timeout
+	allheaders = dict(SOAP_HEADERS)
+	allheaders.update(headers)
+	allheaders['Content-Length'] = str(len(body))
+
+	while True:
+		connection, reused = pool.acquire(host, port)
+		connection.timeout = timeout
+		if connection.sock is not None:
+			connection.sock.settimeout(timeout)
+		try:
+			connection.request('POST', '/', body, allheaders)
+			response = connection.getresponse()
+		except (socket.error, httplib.HTTPException), e:
+			connection.close()
+			if reused and isStale(e): continue
+			raise
+		try:
+			reply = response.read()
+		except (socket.error, httplib.HTTPException):
+			connection.close()
+			raise
+		if response.will_close:
+			connection.close()
+		else:
+			pool.release(host, port, connection)
+		return reply
+
+def actionHeader(classname=None, instance=None, lid=None):
+	if lid is not None:
+		return {'SOAPAction' : 'urn:xdaq-application:lid=%d' % int(lid)}
+	return {'SOAPAction' : 'urn:xdaq-application:class=%s,instance=%d' % (
+		                                             classname, int(instance))}
+
+######################################################################
+## Message bodies
+def simpleCommandBody(cmdName):
+	return SOAPEnvelope % ('<xdaq:%s xmlns:xdaq="urn:xdaq-soap:3.0"/>' %
+		                                                            cmdName)
+
+def xsdType(paramType):
+	if ':' in paramType: return paramType
+	return 'xsd:' + paramType
+
+def parameterSetBody(classname, params):
+	"""params is a list of (name, type, value) tuples"""
+	body  = '<xdaq:ParameterSet xmlns:xdaq="urn:xdaq-soap:3.0">'
+	body += ('<p:properties xmlns:p="urn:xdaq-application:%s" '
+		     'xsi:type="soapenc:Struct">' % classname)
+	for name, paramType, value in params:
+		body += '<p:%s xsi:type="%s">%s</p:%s>' % (name, xsdType(paramType),
+			                                       value, name)
+	body += '</p:properties>'
+	body += '</xdaq:ParameterSet>'
+	return SOAPEnvelope % body
+
+def parameterGetBody(classname, params):
+	"""params is a list of (name, type) tuples"""
+	body  = '<xdaq:ParameterGet xmlns:xdaq="urn:xdaq-soap:3.0">'
+	body += ('<p:properties xmlns:p="urn:xdaq-application:%s" '
+		     'xsi:type="soapenc:Struct">' % classname)
+	for name, paramType in params:
+		body += '<p:%s xsi:type="%s"/>' % (name, xsdType(paramType))
+	body += '</p:properties>'
+	body += '</xdaq:ParameterGet>'
+	return SOAPEnvelope % body
+
+######################################################################
+## Reply parsing
+def parseCommandReply(reply, cmdName):
+	"""
+	Returns the text content of the <cmdName>Response element, '' for an
+	empty response, or None if there is no such response in the reply.
+	"""
+	match = re.search(r'<(\w+):%sResponse\s[^>]*>(.*)</\1:%sResponse>' % (
+		                              cmdName, cmdName), reply, re.DOTALL)
+	if match: return match.group(2)
+	if re.search(r'<[\w:]*%sResponse[\s/>]' % cmdName, reply):
+		return ''
+	return None
+
+def parseParameterGetReply(reply):
+	"""
+	Returns a dictionary of property name to value string for all
+	properties contained in a ParameterGetResponse.
+	"""
+	values = {}
+	match = re.search(r'<(\w+:)?properties[^>]*>(.*)</\1?properties>',
+		              reply, re.DOTALL)
+	if not match: return values
+	for prefix, name, value in re.findall(
+		                r'<(\w+:)?(\w+)[^>]*?(?:/>|>(.*?)</\1?\2>)',
+		                match.group(2), re.DOTALL):
+		values[name] = value
+	return values
+
+######################################################################
+## Commands
+def sendSimpleCommand(host, port, classname, instance, cmdName,
+	                  timeout=None):
+	"""
+	Sends a simple xdaq command and returns the content of the response,
+	'' for an empty response, or None on failure.
+	"""
+	reply = post(host, port, simpleCommandBody(cmdName),
+		         actionHeader(classname, instance), timeout=timeout)
+	return parseCommandReply(reply, cmdName)
+
+def parameterSet(host, port, classname, instance, params, timeout=None):
+	"""
+	Sets a list of (name, type, value) properties in one ParameterSet
+	message. Returns True if the executive acknowledged it.
+	"""
+	reply = post(host, port, parameterSetBody(classname, params),
+		         actionHeader(classname, instance), timeout=timeout)
+	return 'ParameterSetResponse' in reply
+
+def parameterGet(host, port, classname, instance, params, timeout=None):
+	"""
+	Queries a list of (name, type) properties in one ParameterGet message.
+	Returns the raw reply and a dictionary of name to value strings.
+	"""
+	reply = post(host, port, parameterGetBody(classname, params),
+		         actionHeader(classname, instance), timeout=timeout)
+	return reply, parseParameterGetReply(reply)
+
+def sendLauncherCommand(host, port, cmd, timeout=None):
+	"""Sends a one-line command to an xdaqLauncher and returns the reply"""
+	if timeout is None: timeout = DEFAULT_TIMEOUT
+	sock = socket.create_connection((host, int(port)), timeout)
+	try:
+		sock.sendall(cmd + '\n')
+		reply = sock.makefile('r').readline()
+	finally:
+		sock.close()
+	return reply
@@ -1,6 +1,12 @@
-import re, os, time
+import re, os, time, hashlib
 from daq2Utils import printError
 
+## Host/port placeholders as they appear in the config templates,
+## e.g. RU12_SOAP_HOST_NAME or FEROLCONTROLLER3_FRL_PORT
+UNRESOLVED_PATTERN = re.compile(r'(?<![A-Za-z0-9_])([A-Z]+[0-9]+_(?:SOAP|I2O|'
+	                            r'FRL|LAUNCHER)_(?:HOST_NAME|PORT))'
+	                            r'(?![A-Za-z0-9_])')
+
 ######################################################################
 class daq2SymbolMap(object):
 	'''
@@ -27,6 +33,8 @@ class daq2SymbolMap(object):
 		else: self._symbolMapFile = symbolMapFile
 
 		self._symbolMap, self._hostMap, self.allHosts = self.fillSymbolMap(self._symbolMapFile)
+		self._templatePattern = None
+		self._digest = None
 
 	def __call__(self, key):
 		try:
@@ -83,12 +91,46 @@ class daq2SymbolMap(object):
 			output += '%-35s%-35s\n' % (key, self._symbolMap[key])
 		return output
 
-	def fillTemplate(self, filename):
+	def digest(self):
+		"""SHA1 hex digest of the symbol map content (incl. derived ports)"""
+		if self._digest is None:
+			sha = hashlib.sha1()
+			for key in sorted(self._symbolMap.keys()):
+				sha.update('%s %s\n' % (key, self._symbolMap[key]))
+			self._digest = sha.hexdigest()
+		return self._digest
+	def templatePattern(self):
+		"""
+		Returns a compiled regex matching any key of the symbol map as a
+		complete token (i.e. RU1_SOAP_PORT will not match inside of
+		RU11_SOAP_PORT). Longer keys are tried first.
+		"""
+		if self._templatePattern is None:
+			keys = sorted(self._symbolMap.keys(), key=len, reverse=True)
+			self._templatePattern = re.compile(
+				r'(?<![A-Za-z0-9_])(%s)(?![A-Za-z0-9_])' %
+				'|'.join([re.escape(str(k)) for k in keys]))
+		return self._templatePattern
+	def findUnresolved(self, text):
+		"""Returns a sorted list of placeholders left unfilled in text"""
+		return sorted(set(UNRESOLVED_PATTERN.findall(text)))
+	def fillString(self, template, verbose=True):
+		"""
+		Replaces all symbol map keys in template with their values in a
+		single pass. Placeholders that are not in the symbol map are
+		reported.
+		"""
+		symbolMap = self._symbolMap
+		filled = self.templatePattern().sub(
+			                  lambda m: str(symbolMap[m.group(1)]), template)
+		unresolved = self.findUnresolved(filled)
+		if verbose and len(unresolved) > 0:
+			printError('Unresolved placeholders in template: %s' %
+				       ', '.join(unresolved), self)
+		return filled
+	def fillTemplate(self, filename, verbose=True):
 		with open(filename, 'r') as ifile:
 			template = ifile.read()
-			filled = template
-			for key in self._symbolMap.keys():
-				filled = filled.replace(str(key), str(self._symbolMap[key]))
-		return filled
+		return self.fillString(template, verbose=verbose)
 
 
@@ -1,22 +1,12 @@
 #! /usr/bin/env python
-import os, subprocess, shlex, re, time
+import os, subprocess, shlex, re, time, socket, httplib, urllib2
+from collections import namedtuple
 from sys import stdout
 
-separator = 70*'-'
-SOAPEnvelope = '''<SOAP-ENV:Envelope
-   SOAP-ENV:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"
-   xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/"
-   xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
-   xmlns:xsd="http://www.w3.org/2001/XMLSchema"
-   xmlns:SOAP-ENC="http://schemas.xmlsoap.org/soap/encoding/">
-      <SOAP-ENV:Header>
-      </SOAP-ENV:Header>
-      <SOAP-ENV:Body>
-         %s
-      </SOAP-ENV:Body>
-</SOAP-ENV:Envelope>
-'''
+import daq2SOAP as soap
+from daq2SOAP import SOAPEnvelope
 
+separator = 70*'-'
 SIZE_LIMIT_TABLE = {
      # max size, scan until
 	 1 : (64000, 32768),  # merging by  1
@@ -183,34 +173,27 @@ def testBuilding(d2c, minevents=1000, waittime=15, verbose=1, dry=False):
 	return True
 
 def sendSOAPMessage(host, port, message, command):
-	"""Sends a SOAP message via curl, where message could be
+	"""Sends a SOAP message to host:port, where message could be
 		'SOAPAction: urn:xdaq-application:lid=0'
 		or
 		'Content-Location: urn:xdaq-application:class=CLASSNAME,
 		                                        instance=INSTANCE'
 		and command could be a file:
 		configure.cmd.xml
-		or a simple command like:
-		'Configure'
+		or a full SOAP message, like:
+		SOAPEnvelope % '<xdaq:Configure .../>'
 	"""
-	cmd = ("curl --stderr /dev/null -H \"Content-Type: text/xml\" "
-	       "-H \"Content-Description: SOAP Message\" "
-	       "-H \"%s\" http://%s:%d -d %s")
-
-	# 'SOAPAction: urn:xdaq-application:lid=0' ## ??
-
-	if 'SOAPAction' in message:
-		## Want to send a command file, i.e. need to prepend a \@
-		## before the filename
-		command = '\@'+command
-	elif 'Content-Location' in message:
-		## Want to send a simple command, need to wrap it in escaped quotes
-		command = '\"'+command+'\"'
+	headername, headervalue = [x.strip() for x in message.split(':', 1)]
 
-	cmd = cmd % (message, host, port, command)
+	if 'SOAPAction' in headername:
+		## Want to send a command file
+		with open(command, 'r') as cmdfile:
+			command = cmdfile.read()
 
-	call = subprocess.Popen(shlex.split(cmd), stdout=subprocess.PIPE)
-	out,err = call.communicate()
+	try:
+		out = soap.post(host, port, command, {headername : headervalue})
+	except (socket.error, httplib.HTTPException):
+		out = ''
 
 	if 'Response' in out:
 		print 'OK'
@@ -256,7 +239,7 @@ def sendCmdFileToExecutive(host, port, cmdfile, verbose=0, dry=False):
 			                                                   host, port))
 	return 0
 def sendCmdFileToApp(host, port, classname, instance, cmdFile,
-                     verbose=0, dry=False): ## UNTESTED
+                     verbose=0, dry=False):
 	"""Sends a SOAP message contained in cmdfile to the application
 with classname and instance on host:port"""
 	if dry:
@@ -266,13 +249,8 @@ with classname and instance on host:port"""
 		return
 
 	message = 'SOAPAction: urn:xdaq-application:class=%s,instance=%d' % (
-		                                             classname, instance)
-	command = '`cat %s`' % cmdfile
-	return sendSOAPMessage(host, port, message, command)
-
-	if not dry:
-		return subprocess.check_call(['sendCmdFileToApp', host, str(port),
-			                           classname, str(instance), cmdFile])
+		                                        classname, int(instance))
+	return sendSOAPMessage(host, port, message, cmdFile)
 def sendCmdToApp(host, port, classname, instance, command,
 	             verbose=0, dry=False):
 	"""Sends a simple command via SOAP to the application with classname
@@ -290,105 +268,367 @@ def writeItem(host, port, classname, instance, item, data, offset=0, device='fer
 	body = ('<xdaq:WriteItem xmlns:xdaq="urn:xdaq-soap:3.0" offset="%s"  '
 		    'device="%s" item="%s" data="%s"/>' % (str(offset), device, item, str(data)))
 	cmd = SOAPEnvelope % body
-	cmd = cmd.replace('\"','\\\"') ## escape the quotes when passing as arg
 	return sendCmdToApp(host, port, classname, str(instance), cmd,
 	                    verbose=verbose, dry=dry)
-def tryWebPing(host, port, verbose=0, dry=False):
+## Liveness probes of the xdaq executives:
+##   'tcp'  - the SOAP port accepts connections
+##   'head' - the executive answers an HTTP HEAD request (any status)
+##   'get'  - the executive serves its main page without an error
+PROBE_MODES = ['tcp', 'head', 'get']
+PROBE_MODE = 'head'
+PROBE_TIMEOUT = 0.5 ## seconds, for connecting and for the reply
+PROBE_PATH = '/urn:xdaq-application:lid=3'
+
+def probeHost(host, port, mode=PROBE_MODE, timeout=PROBE_TIMEOUT):
+	"""Returns None if the executive at host:port is alive, or the reason
+why it is not"""
+	if not mode in PROBE_MODES:
+		raise ValueError('Unknown probe mode %s' % mode)
+	try:
+		if mode == 'tcp':
+			socket.create_connection((host, int(port)), timeout).close()
+			return None
+
+		connection = httplib.HTTPConnection(host, int(port), timeout=timeout)
+		try:
+			connection.request(mode.upper(), PROBE_PATH)
+			response = connection.getresponse()
+			response.read()
+		finally:
+			connection.close()
+		if mode == 'get' and response.status >= 400:
+			return 'HTTP %d %s' % (response.status, response.reason)
+		return None
+	except (socket.error, httplib.HTTPException), e:
+		return str(e) or e.__class__.__name__
+
+def probeHosts(hostlist, mode=PROBE_MODE, timeout=PROBE_TIMEOUT):
+	"""Probes all hosts concurrently on the worker pool. Returns the list
+of (host, reason) for the ones that are not alive, in the order of hostlist.
+Must not be called from within a pool task."""
+	reasons = mapInParallel(lambda h: probeHost(h.host, h.port,
+		                                        mode=mode, timeout=timeout),
+	                        hostlist)
+	return [(h, reason) for h, reason in zip(hostlist, reasons)
+	                                        if reason is not None]
+
+def tryWebPing(host, port, verbose=0, dry=False, mode=PROBE_MODE,
+	           timeout=PROBE_TIMEOUT):
+	"""Probes a single executive, returns 0 if it is alive, 1 otherwise"""
 	if dry:
 		print '%-18s %25s:%-5d' % ('webPing', host, port)
 		return 0
-	cmd = ("wget -o /dev/null -O /dev/null --timeout=30 "
-	       "http://%s:%d/urn:xdaq-application:lid=3" % (host,int(port)))
 	if verbose>0: print 'Checking %25s:%-5d' % (host,int(port))
-	return subprocess.call(shlex.split(cmd))
+	return 0 if probeHost(host, port, mode=mode, timeout=timeout) is None else 1
 
-def checkApplicationState(host, classname, statename, instance=None, dry=False):
+APPLICATIONS_TO_CHECK = {
+	'FEROLCONTROLLER' : ['ferol::FerolController'],
+	'FEROL'           : ['Client', 'evb::test::DummyFEROL'],
+	'RU'              : ['evb::EVM', 'evb::RU', 'gevb2g::RU'],
+	'BU'              : ['evb::BU', 'gevb2g::BU'],
+	'EFED'            : ['d2s::FEDEmulator'],
+	'GTPE'            : ['d2s::GTPeController'],
+	'FMM'             : ['tts::FMMController']}
+STATE_CHECK_TIMEOUT = 10 ## seconds per request
+
+class StateCheck(namedtuple('StateCheck', ['host', 'app', 'instance',
+	                                       'expected', 'actual',
+	                                       'latency'])):
+	"""Result of checking one application for an expected state"""
+	@property
+	def ok(self):
+		return self.actual == self.expected
+
+def getApplicationState(host, classname, instance=None,
+	                    timeout=STATE_CHECK_TIMEOUT):
+	"""Returns the stateName of an application, or 'NO REPLY' if it cannot
+be reached"""
 	if instance == None:
 		instance = getInstance(host, classname)
 
 	## Special case until stateName is added to the application infospace
 	## in the FerolController
-	if dry: return True
 	if host.type == 'FEROLCONTROLLER':
 		url = 'http://%s:%d/urn:xdaq-application:lid=109' % (
 			                            host.host, host.port)
-		items = loadMonitoringItemsFromURL(url)
-		state = items['stateName']
-		if not state == statename:
-			stdout.write('\n')
-			printError('Application %s, instance %d, on host %s:%-d, did '
-				       'not return state "%s", instead was "%s".' %(
-				       	classname, instance, host.host, host.port,
-				       	statename, state))
-			return False
-		return True
+		try:
+			items = loadMonitoringItemsFromURL(url, timeout=timeout)
+			return items['stateName']
+		except (urllib2.URLError, socket.error, httplib.HTTPException,
+			    KeyError):
+			return 'NO REPLY'
 
 	## Normal case
-	state = getParam(host, classname, 'stateName', 'xsd:string')
-	state = state.strip('\n') ## remove trailing newlines
-	if not state == statename:
+	try:
+		reply, values = soap.parameterGet(host.host, host.port, classname,
+			                              instance,
+			                              [('stateName', 'xsd:string')],
+			                              timeout=timeout)
+	except (socket.error, httplib.HTTPException):
+		return 'NO REPLY'
+	return values.get('stateName', 'NO REPLY').strip('\n')
+
+def checkApplicationStatePacked(packedargs):
+	(host, classname, instance, statename, timeout) = packedargs
+	starttime = time.time()
+	state = getApplicationState(host, classname, instance, timeout=timeout)
+	return StateCheck(host, classname, instance, statename, state,
+		              time.time() - starttime)
+def stateCheckTasks(hosts, statename, timeout=STATE_CHECK_TIMEOUT):
+	tasklist = []
+	for host in hosts:
+		for app,inst in host.applications:
+			if not app in APPLICATIONS_TO_CHECK[host.type]: continue
+			tasklist.append((host, app, inst, statename, timeout))
+	return tasklist
+def runStateChecks(tasklist, dry=False):
+	if dry:
+		return [StateCheck(h, app, inst, state, state, 0.)
+		                     for h,app,inst,state,_ in tasklist]
+	return mapInParallel(checkApplicationStatePacked, tasklist)
+def checkApplicationStates(hosts, statename, timeout=STATE_CHECK_TIMEOUT,
+	                       dry=False):
+	"""Queries the state of a fixed list of applications on hosts in
+parallel and returns a list of StateCheck results, in the order of
+hosts and applications"""
+	return runStateChecks(stateCheckTasks(hosts, statename, timeout),
+		                  dry=dry)
+
+def checkApplicationState(host, classname, statename, instance=None, dry=False):
+	if instance == None:
+		instance = getInstance(host, classname)
+	if dry: return True
+
+	result = checkApplicationStatePacked((host, classname, instance,
+		                                  statename, STATE_CHECK_TIMEOUT))
+	if not result.ok:
 		stdout.write('\n')
 		printError('Application %s, instance %d, on host %s:%-d, did not '
 			       'return state "%s", instead was "%s".' % (
 			       	classname, instance, host.host, host.port,
-			       	statename, state))
+			       	statename, result.actual))
 		return False
 	return True
 
+def printStateChecks(results, verbose=0):
+	"""Prints the outcome of a list of StateCheck results, returns True if
+all of them were in the expected state"""
+	checkedtrue = True
+	for result in results:
+		host = result.host
+		if verbose > 0:
+			stdout.write('Checking whether application %s(%d) on '
+				         '%s:%d is in state "%s" ... ' % (
+				         result.app, result.instance, host.host, host.port,
+				         result.expected))
+		if not result.ok:
+			checkedtrue = False
+			stdout.write('\n')
+			printError('Application %s, instance %d, on host %s:%-d, did '
+				       'not return state "%s", instead was "%s".' % (
+				       	result.app, result.instance, host.host, host.port,
+				       	result.expected, result.actual))
+			if verbose > 0: stdout.write(' FAILED\n')
+			continue
+		if verbose > 0: stdout.write(' OK (%.0f ms)\n' % (
+			                                       1e3*result.latency))
+	return checkedtrue
+
 def checkStates(hosts, statename, verbose=0, dry=False):
 	"""Checks a fixed list of applications on hosts to be in statename"""
-	applications_to_check = {
-		'FEROLCONTROLLER' : ['ferol::FerolController'],
-		'FEROL'           : ['Client', 'evb::test::DummyFEROL'],
-		'RU'              : ['evb::EVM', 'evb::RU', 'gevb2g::RU'],
-		'BU'              : ['evb::BU', 'gevb2g::BU'],
-		'EFED'            : ['d2s::FEDEmulator'],
-		'GTPE'            : ['d2s::GTPeController'],
-		'FMM'             : ['tts::FMMController']}
-	checkedtrue = True
-	for host in hosts:
-		for app,inst in host.applications:
-			if not app in applications_to_check[host.type]: continue
+	return printStateChecks(checkApplicationStates(hosts, statename,
+		                                           dry=dry),
+	                        verbose=verbose)
 
-			if verbose > 0:
-				stdout.write('Checking whether application %s(%d) on '
-					         '%s:%d is in state "%s" ... ' % (
-					         app, inst, host.host, host.port, statename))
-			if not checkApplicationState(host, app, statename, instance=inst,
-				                         dry=dry):
-				checkedtrue = False
-				if verbose > 0: stdout.write(' FAILED\n')
-			if verbose > 0: stdout.write(' OK\n')
-	return checkedtrue
+def waitForStateChecks(hosts, statename, timeout=30, pollinterval=0.5,
+	                   verbose=0, dry=False):
+	"""Polls a fixed list of applications on hosts in parallel until all of
+them are in statename, any of them goes to 'Failed', or timeout seconds
+have passed (timeout=0 checks only once). Returns the last StateCheck
+result of each application."""
+	tasklist = stateCheckTasks(hosts, statename,
+		                       timeout=min(STATE_CHECK_TIMEOUT,
+		                       	           max(timeout, pollinterval)))
+	deadline = time.time() + timeout
+	done = []
+	while True:
+		results = runStateChecks(tasklist, dry=dry)
+		failed  = [r for r in results if r.actual == 'Failed']
+		pending = [r for r in results if not r.ok]
+		done   += [r for r in results if r.ok]
+		if len(failed) > 0 or len(pending) == 0:
+			break
+		if time.time() + pollinterval > deadline:
+			break
+		time.sleep(pollinterval)
+		## Only poll the ones that are not there yet
+		tasklist = [(r.host, r.app, r.instance, statename, tasklist[0][4])
+		                                                 for r in pending]
 
-def stopXDAQPacked(packedargs):
-	(host, verbose, dry) = packedargs
-	stopXDAQ(host, verbose, dry)
-def stopXDAQ(host, verbose=0, dry=False):
+	if verbose > 0 and len(pending) == 0:
+		stdout.write('All %d applications in state "%s" after %.1f s\n' % (
+			    len(done), statename, time.time() - deadline + timeout))
+	return done + pending
+def waitForState(hosts, statename, timeout=30, pollinterval=0.5,
+	             verbose=0, dry=False):
+	"""Waits for a fixed list of applications on hosts to reach statename,
+see waitForStateChecks(). Returns True as soon as all of them are there,
+False if any goes to 'Failed' or they do not all make it within timeout."""
+	return printStateChecks(waitForStateChecks(hosts, statename,
+		                                       timeout=timeout,
+		                                       pollinterval=pollinterval,
+		                                       verbose=verbose, dry=dry),
+	                        verbose=verbose-1)
+
+## Stopping the xdaq executives
+STOP_TIMEOUT = 10          ## seconds for the executives to exit after STOPXDAQ
+KILL_TIMEOUT = 5           ## seconds for the stragglers to exit after a kill
+STOP_POLL_INTERVAL = 0.25  ## seconds between checks of the SOAP ports
+SSH_PORT = 22
+
+## Outcome of stopping one executive: 'not running', 'stopped' (after
+## STOPXDAQ), 'killed' (over ssh), 'ALIVE' if it could not be stopped, or
+## 'unreachable' if neither its SOAP port nor ssh answer (host down).
+## elapsed is the time until its SOAP port was seen closed.
+StopResult = namedtuple('StopResult', ['host', 'outcome', 'elapsed'])
+
+def connectState(hostname, port, timeout=PROBE_TIMEOUT):
+	"""Returns 'open', 'closed' (refused or no route) or 'timeout' for a
+TCP connection to hostname:port"""
+	try:
+		socket.create_connection((hostname, int(port)), timeout).close()
+		return 'open'
+	except socket.timeout:
+		return 'timeout'
+	except socket.error:
+		return 'closed'
+def isXDAQRunning(host):
+	"""True unless the SOAP port of host refuses connections. A timeout
+counts as running, so that a hanging executive is not taken for stopped."""
+	return connectState(host.host, host.port) != 'closed'
+def isUnreachable(host):
+	"""True if neither the SOAP port nor ssh of host answer at all, as for
+a host that is powered off"""
+	return (connectState(host.host, host.port) == 'timeout' and
+		    connectState(host.host, SSH_PORT) == 'timeout')
+def waitForPortsClosed(hostlist, deadline, verbose=0):
+	"""
+	Polls the SOAP ports of all hosts concurrently until they are closed
+	or the deadline passes. Returns a dictionary of host to the time it
+	was seen closed, and the list of hosts that are still open.
+	"""
+	closed = {}
+	pending = list(hostlist)
+	while len(pending) > 0:
+		running = mapInParallel(isXDAQRunning, pending)
+		now = time.time()
+		for h, isrunning in zip(pending, running):
+			if not isrunning: closed[h] = now
+		pending = [h for h, isrunning in zip(pending, running) if isrunning]
+		if len(pending) == 0 or now > deadline: break
+		time.sleep(STOP_POLL_INTERVAL)
+	return closed, pending
+def killXDAQ(host, verbose=0):
+	"""Kills the xdaq executive on the SOAP port of host over ssh"""
+	cmd = ['ssh', '-x', '-o', 'BatchMode yes', '-o', 'ConnectTimeout 5',
+	       host.host, "pkill -9 -f 'xdaq.exe .*-p %d$'" % int(host.port)]
+	if verbose > 1: print ' '.join(cmd)
+	try:
+		return subprocess.call(cmd)
+	except OSError, e:
+		printError('Failed to kill xdaq on %s:%d: %s' % (host.host,
+			                                            int(host.port), e))
+def stopHosts(hostlist, verbose=0, dry=False, timeout=STOP_TIMEOUT,
+	          killTimeout=KILL_TIMEOUT):
+	"""
+	Stops the xdaq executives on all hosts and makes sure they are gone:
+	sends 'STOPXDAQ' to the launchers of all running executives at once,
+	waits up to timeout seconds for their SOAP ports to close, kills the
+	remaining ones over ssh, and waits up to killTimeout seconds again.
+	Returns a list of StopResult, in the order of hostlist.
+	"""
 	if dry:
-		if verbose > 0: print 'Stopping %25s:%-5d' % (host.host, host.lport)
-		return
+		for h in hostlist:
+			if verbose > 0: print 'Stopping %25s:%-5d' % (h.host, h.lport)
+		return [StopResult(h, 'not running', 0.) for h in hostlist]
 
-	iterations = 0
-	while tryWebPing(host.host, host.port) == 0:
-		sendCmdToLauncher(host.host, host.lport, 'STOPXDAQ',
-			              verbose=verbose, dry=dry)
-		iterations += 1
-		if iterations > 1 and iterations < 3:
-			print " repeating %s:%-d" % (host.host, host.port)
-		if iterations > 2:
-			break
+	starttime = time.time()
+	outcomes, closed = {}, {}
+	def initialState(h):
+		if not isXDAQRunning(h): return 'not running'
+		if isUnreachable(h): return 'unreachable'
+		return 'running'
+	states = mapInParallel(initialState, hostlist)
+	running = [h for h, state in zip(hostlist, states) if state == 'running']
+	for h, state in zip(hostlist, states):
+		if state != 'running':
+			outcomes[h], closed[h] = state, starttime
 
-def stopXDAQs(symbolMap, verbose=0, dry=False):
-	"""Sends a 'STOPXDAQ' cmd to all SOAP hosts defined in the symbolmap
-that respond to a tryWebPing call"""
+	def sendStop(h):
+		try:
+			reply = soap.sendLauncherCommand(h.host, h.lport, 'STOPXDAQ',
+				                             timeout=timeout)
+			if verbose > 1: stdout.write('%s %s: %s' % (h.host, h.lport, reply))
+		except socket.error, e:
+			if verbose > 0:
+				print 'Failed to connect to launcher %s:%d: %s' % (h.host,
+					                                           h.lport, e)
+	mapInParallel(sendStop, running)
+	stopped, stragglers = waitForPortsClosed(running, starttime+timeout)
+	for h in stopped: outcomes[h] = 'stopped'
+	closed.update(stopped)
+
+	if len(stragglers) > 0:
+		if verbose > 0:
+			print 'Killing %d xdaq executive(s) that did not stop' % (
+				                                              len(stragglers))
+		mapInParallel(lambda h: killXDAQ(h, verbose=verbose), stragglers)
+		killed, stragglers = waitForPortsClosed(stragglers,
+			                                    time.time()+killTimeout)
+		for h in killed: outcomes[h] = 'killed'
+		closed.update(killed)
+	## Hosts that went down in the meantime
+	for h, unreachable in zip(stragglers,
+		                      mapInParallel(isUnreachable, stragglers)):
+		outcomes[h] = 'unreachable' if unreachable else 'ALIVE'
+
+	return [StopResult(h, outcomes[h], closed.get(h, time.time())-starttime)
+	                                                        for h in hostlist]
+def printStopResults(results, verbose=0):
+	"""Prints a summary, and a table of all executives that needed to be
+	killed, are unreachable or are still alive (of all of them with
+	verbose > 1). Returns True if all executives are gone; unreachable
+	hosts are left to the availability check."""
+	counts = {}
+	for result in results:
+		counts[result.outcome] = counts.get(result.outcome, 0) + 1
+	problems = [r for r in results if r.outcome in ('killed', 'unreachable',
+		                                            'ALIVE')]
+	if verbose > 0 or len(problems) > 0:
+		print 'Stopped XDAQs: %s' % ', '.join(['%d %s' % (counts[o], o) for o
+			           in ['stopped', 'not running', 'killed', 'unreachable',
+			               'ALIVE'] if o in counts])
+	for result in (results if verbose > 1 else problems):
+		print '  %-20s %25s:%-5d %-12s %5.1f s' % (result.host.name,
+			        result.host.host, result.host.port, result.outcome,
+			        result.elapsed)
+	if counts.get('ALIVE', 0) > 0:
+		printError('%d xdaq executive(s) could not be stopped!' %
+			                                              counts['ALIVE'])
+		return False
+	return True
+def stopXDAQ(host, verbose=0, dry=False):
+	return stopHosts([host], verbose=verbose, dry=dry)[0]
+def stopXDAQs(symbolMap, verbose=0, dry=False, timeout=STOP_TIMEOUT):
+	"""Stops the xdaq executives on all SOAP hosts defined in the
+symbolmap, see stopHosts(). Returns the list of StopResult."""
 	if verbose > 0: print separator
 	if verbose > 0: print "Stopping XDAQs"
 	pauseGTPe(symbolMap, verbose=verbose, dry=dry)
-	from multiprocessing import Pool
-	pool = Pool(min(64,len(symbolMap.allHosts)))
-	pool.map(stopXDAQPacked,
-		     [(h, verbose, dry) for h in symbolMap.allHosts])
+	results = stopHosts(symbolMap.allHosts, verbose=verbose, dry=dry,
+		                timeout=timeout)
+	printStopResults(results, verbose=verbose)
+	return results
 def pauseGTPe(symbolMap, verbose=0, dry=False):
 	if dry: return
 	try:
@@ -417,7 +657,7 @@ def getInstance(host,classname):
 			                   (classname, host.host, host.port))
 	return instance
 
-## Wrappers for existing perl scripts
+## SOAP wrappers (formerly forking the perl scripts, now using daq2SOAP)
 def sendSimpleCmdToAppPacked(packedargs):
 	(host, classname, instance, cmdName, verbose, dry) = packedargs
 	return sendSimpleCmdToApp(host, classname, cmdName, port=None,
@@ -426,9 +666,9 @@ def sendSimpleCmdToAppPacked(packedargs):
 def sendSimpleCmdToApp(host, classname, cmdName,
 	                   port=None, instance=None,
 	                   verbose=0, dry=False):
+	hostname = host.host
 	if port == None:
 		port = host.port
-		hostname = host.host
 
 	if instance == None:
 		instance = getInstance(host, classname)
@@ -438,19 +678,77 @@ def sendSimpleCmdToApp(host, classname, cmdName,
 			  'sendSimpleCmdToApp', hostname, port,
 			                        classname, instance, cmdName)
 	if not dry:
-		return subprocess.check_call(['sendSimpleCmdToApp', hostname,
-			                          str(port), classname, str(instance),
-			                          cmdName])
+		try:
+			reply = soap.sendSimpleCommand(hostname, port, classname,
+				                           instance, cmdName)
+		except (socket.error, httplib.HTTPException), e:
+			## single write per message, as this may run in parallel
+			stdout.write('%s%s %s: ERROR\n%s\n' % (classname, instance,
+				                                    cmdName, e))
+			return 1
+		if reply is None:
+			stdout.write('%s%s %s: ERROR\n' % (classname, instance, cmdName))
+			return 1
+		if len(reply) == 0: reply = 'EMPTY SOAP MESSAGE'
+		stdout.write('%s%s %s: %s\n' % (classname, instance, cmdName, reply))
+		return 0
+CommandResult = namedtuple('CommandResult', ['host', 'app', 'instance',
+	                                         'command', 'returncode',
+	                                         'latency'])
+def sendSimpleCmdToAppTimedPacked(packedargs):
+	(host, classname, instance, port, cmdName, verbose, dry) = packedargs
+	starttime = time.time()
+	try:
+		returncode = sendSimpleCmdToApp(host, classname, cmdName,
+			                            port=port, instance=instance,
+			                            verbose=verbose, dry=dry)
+	except RuntimeError:
+		returncode = 1
+	if returncode is None: returncode = 0 ## dry
+	return CommandResult(host, classname, instance, cmdName, returncode,
+		                 time.time() - starttime)
+def sendSimpleCmdToGroups(groups, cmdName, verbose=0, dry=False):
+	"""
+	Sends cmdName to a list of groups of applications, given as lists of
+	(host, classname, instance, port) tuples (instance and port can be
+	None). All applications in a group are addressed in parallel, and
+	the next group is only started once the previous one has completed.
+	Returns a list of CommandResult for all applications.
+	"""
+	results = []
+	for group in groups:
+		if len(group) == 0: continue
+		tasklist = [(host, classname, instance, port, cmdName, verbose, dry)
+		                            for host,classname,instance,port in group]
+		results += mapInParallel(sendSimpleCmdToAppTimedPacked, tasklist)
+
+	failed = [r for r in results if r.returncode != 0]
+	for r in failed:
+		printError('Sending %s to %s(%s) on %s:%d failed.' % (
+			       cmdName, r.app, r.instance, r.host.host, r.host.port))
+	if verbose > 1 and len(results) > 0 and not dry:
+		slowest = max(results, key=lambda r: r.latency)
+		print ('%s sent to %d applications in %d groups, %d failed, slowest '
+			   '%s:%d (%.0f ms)' % (cmdName, len(results),
+			   	len([g for g in groups if len(g) > 0]), len(failed),
+			   	slowest.host.host, slowest.host.port, 1e3*slowest.latency))
+	return results
 def sendCmdToLauncher(host, port, cmd, verbose=0, dry=False):
 	if verbose > 1 and dry:
 		print '%-18s %25s:%-5d %-15s'%('sendCmdToLauncher', host, port, cmd)
 	if not dry:
-		return subprocess.call(['sendCmdToLauncher', host, str(port), cmd])
+		try:
+			reply = soap.sendLauncherCommand(host, port, cmd)
+		except socket.error, e:
+			print 'Failed to connect: %s' % e
+			return 1
+		stdout.write('%s %s: %s' % (host, port, reply))
+		return 0
 def setParam(host, classname, paramName, paramType, paramValue,
 	         port=None, instance=None, verbose=0, dry=False):
+	hostname = host.host
 	if port == None:
 		port = host.port
-		hostname = host.host
 
 	if instance == None:
 		instance = getInstance(host, classname)
@@ -460,14 +758,56 @@ def setParam(host, classname, paramName, paramType, paramValue,
 			           'setParam', hostname, port, classname, instance,
 			           paramName, paramType, paramValue)
 	if not dry:
-		return subprocess.check_call(['setParam', hostname, str(port), classname,
-			                          str(instance), paramName, paramType,
-			                          str(paramValue)])
+		stdout.write('%s %s %s=%s : ' % (classname, instance,
+			                             paramName, paramValue))
+		try:
+			ok = soap.parameterSet(hostname, port, classname, instance,
+				                   [(paramName, paramType, paramValue)])
+		except (socket.error, httplib.HTTPException):
+			ok = False
+		if not ok:
+			print 'ERROR'
+			raise RuntimeError('setParam %s on %s:%s failed' % (
+				                             paramName, hostname, port))
+		print 'OK'
+		return 0
+def setParams(host, classname, params,
+	          port=None, instance=None, verbose=0, dry=False):
+	"""Sets several parameters of one application in a single ParameterSet
+message, where params is a dictionary of {name: (type, value)}"""
+	hostname = host.host
+	if port == None:
+		port = host.port
+
+	if instance == None:
+		instance = getInstance(host, classname)
+
+	paramlist = [(name, ptype, value) for name,(ptype, value) in
+	                                              sorted(params.items())]
+	if verbose > 1 and dry:
+		for paramName, paramType, paramValue in paramlist:
+			print '%-18s %25s:%-5d %25s %1s\t%-25s %12s %6s' % (
+				           'setParams', hostname, port, classname, instance,
+				           paramName, paramType, paramValue)
+	if not dry:
+		stdout.write('%s %s %s : ' % (classname, instance,
+			         ' '.join(['%s=%s' % (n,v) for n,_,v in paramlist])))
+		try:
+			ok = soap.parameterSet(hostname, port, classname, instance,
+				                   paramlist)
+		except (socket.error, httplib.HTTPException):
+			ok = False
+		if not ok:
+			print 'ERROR'
+			raise RuntimeError('setParams %s on %s:%s failed' % (
+				   ', '.join([n for n,_,_ in paramlist]), hostname, port))
+		print 'OK'
+		return 0
 def getParam(host, classname, paramName, paramType,
 	         port=None, instance=None, verbose=0, dry=False):
+	hostname = host.host
 	if port == None:
 		port = host.port
-		hostname = host.host
 
 	if instance == None:
 		instance = getInstance(host, classname)
@@ -477,11 +817,66 @@ def getParam(host, classname, paramName, paramType,
 			            'getParam', hostname, port, classname, instance,
 			            paramName, paramType)
 	if not dry:
-		call = subprocess.Popen(['getParam', hostname, str(port), classname,
-			                     str(instance), paramName, paramType],
-			                     stdout=subprocess.PIPE)
-		out,err = call.communicate()
-		return out
+		try:
+			reply, values = soap.parameterGet(hostname, port, classname,
+				                              instance,
+				                              [(paramName, paramType)])
+		except (socket.error, httplib.HTTPException):
+			return 'ERROR COMMAND=ParameterGet REPLY=NONE'
+		try:
+			return values[paramName]
+		except KeyError:
+			return 'ERROR COMMAND=ParameterGet REPLY=%s' % reply
+
+XSD_CONVERTERS = {'unsignedInt'   : int,
+                  'unsignedLong'  : int,
+                  'unsignedShort' : int,
+                  'int'           : int,
+                  'long'          : int,
+                  'short'         : int,
+                  'double'        : float,
+                  'float'         : float,
+                  'boolean'       : lambda x: x.strip() in ('true', '1'),
+                  'string'        : str}
+def convertXSDValue(value, paramType):
+	converter = XSD_CONVERTERS.get(paramType.split(':')[-1], str)
+	return converter(value)
+def getParams(host, classname, params,
+	          port=None, instance=None, verbose=0, dry=False):
+	"""Queries several parameters of one application in a single
+ParameterGet message, where params is a dictionary of {name: type}.
+Returns a dictionary of {name: value} with values converted according to
+their xsd type."""
+	hostname = host.host
+	if port == None:
+		port = host.port
+
+	if instance == None:
+		instance = getInstance(host, classname)
+
+	paramlist = sorted(params.items())
+	if verbose > 1 and dry:
+		for paramName, paramType in paramlist:
+			print '%-18s %25s:%-5d %25s %1s\t%-25s %12s' % (
+				            'getParams', hostname, port, classname, instance,
+				            paramName, paramType)
+	if dry: return None
+
+	try:
+		reply, values = soap.parameterGet(hostname, port, classname,
+			                              instance, paramlist)
+	except (socket.error, httplib.HTTPException), e:
+		raise RuntimeError('getParams on %s:%s failed: %s' % (
+			                                       hostname, port, e))
+	result = {}
+	for paramName, paramType in paramlist:
+		try:
+			result[paramName] = convertXSDValue(values[paramName], paramType)
+		except (KeyError, ValueError):
+			raise RuntimeError('getParams: no valid %s from %s(%s) on %s:%s.'
+				               ' Reply was:\n%s' % (paramName, classname,
+				               	instance, hostname, port, reply))
+	return result
 
 def getIfStatThroughput(host, duration, delay=5, verbose=0, interface='p2p1',
 	                    dry=False):
@@ -584,14 +979,39 @@ def printWarningWithWait(message, waitfunc=sleep, waittime=10,
 		else: waitfunc(waittime)
 	print errordelim
 
+## Shared worker pool for fanning out (I/O bound) commands to many hosts
+WORKER_POOL_SIZE = 64
+_workerPool = None
+def getWorkerPool():
+	"""Returns the long-lived thread pool shared by all parallel helpers,
+creating it on first use"""
+	global _workerPool
+	if _workerPool is None:
+		from multiprocessing.pool import ThreadPool
+		_workerPool = ThreadPool(WORKER_POOL_SIZE)
+	return _workerPool
+def shutdownWorkerPool():
+	"""Closes the shared thread pool and waits for its threads to finish"""
+	global _workerPool
+	if _workerPool is None: return
+	_workerPool.close()
+	_workerPool.join()
+	_workerPool = None
+	soap.getConnectionPool().closeAll()
+import atexit
+atexit.register(shutdownWorkerPool)
+
+def mapInParallel(func, tasklist):
+	"""Maps func over tasklist on the shared worker pool, returns the list
+of results in order. Must not be called from within a pool task."""
+	if len(tasklist) == 0: return []
+	return getWorkerPool().map(func, tasklist)
+
 def sendToHostListInParallel2(hostlist, func, commonargs):
 	tasklist = [(host.host, host.port,)+tuple(commonargs)
 	                                   for host in hostlist]
-
-	from multiprocessing import Pool
-	pool = Pool(min(len(hostlist),64))
 	try:
-		pool.map(func, tasklist)
+		mapInParallel(func, tasklist)
 		return True
 	except RuntimeError:
 		return False
@@ -603,11 +1023,8 @@ def sendToHostListInParallel(hostlist, func, individualargs, commonargs):
 	hostarglist = zip(hostlist, individualargs)
 	tasklist = [(host.host, host.port, iarg)+tuple(commonargs)
 	                                   for host,iarg in hostarglist]
-
-	from multiprocessing import Pool
-	pool = Pool(min(len(hostlist),64))
 	try:
-		pool.map(func, tasklist)
+		mapInParallel(func, tasklist)
 		return True
 	except RuntimeError:
 		return False
@@ -688,9 +1105,11 @@ def parseMonitoringJsonFile(jsonFile):
 
 ## Returns a dictionary with FEROL monitoring items.
 ## It is read from a json url
-def loadMonitoringItemsFromURL(url):
-	import urllib2
-	opener = urllib2.urlopen(url + "/infospaces")
+def loadMonitoringItemsFromURL(url, timeout=None):
+	if timeout is None:
+		opener = urllib2.urlopen(url + "/infospaces")
+	else:
+		opener = urllib2.urlopen(url + "/infospaces", timeout=timeout)
 	items = parseMonitoringJsonFile(opener)
 	opener.close()
 	return items
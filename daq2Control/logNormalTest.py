@@ -40,6 +40,31 @@ except ImportError,ex:
         y = 1.0 - (((((a5*t + a4)*t) + a3)*t + a2)*t + a1)*t*math.exp(-x*x)
         return sign*y # erf(-x) = -erf(x)
 
+def erfArray(x):
+    """ erf for numpy arrays, using scipy if available and the same
+    A&S formula as above otherwise """
+    import numpy as np
+    try:
+        from scipy.special import erf as scipyErf
+        return scipyErf(x)
+    except ImportError:
+        pass
+
+    x = np.asarray(x, dtype=float)
+    sign = np.where(x >= 0, 1., -1.)
+    x = np.abs(x)
+
+    a1 =  0.254829592
+    a2 = -0.284496736
+    a3 =  1.421413741
+    a4 = -1.453152027
+    a5 =  1.061405429
+    p  =  0.3275911
+
+    t = 1.0/(1.0 + p*x)
+    y = 1.0 - (((((a5*t + a4)*t) + a3)*t + a2)*t + a1)*t*np.exp(-x*x)
+    return sign*y
+
 #----------------------------------------------------------------------
 
 # indefinite integral of x * lognormal(normalMean,normalSigma)
@@ -133,6 +158,36 @@ def averageFractionSize(mean, sigma, lowerLimit, upperLimit):
            integBulk  + \
            fracAbove * upperLimit
 
+#----------------------------------------------------------------------
+def averageFractionSizeArray(mean, sigma, lowerLimit, upperLimit):
+    """ same as averageFractionSize but for numpy arrays (or anything
+    that broadcasts) of means and sigmas, returns an array """
+    import numpy as np
+
+    mean = np.asarray(mean, dtype=float)
+    sigma = np.asarray(sigma, dtype=float)
+
+    # convert from mean/sigma to normalMean / normalSigma
+    normalMean = np.log(mean**2 / np.sqrt(sigma**2 + mean**2))
+    normalSigma = np.sqrt(np.log(1 + sigma**2 / mean**2))
+
+    logLower, logUpper = log(lowerLimit), log(upperLimit)
+    scale = sqrt(2)*normalSigma
+
+    # fraction of events below and above limits
+    fracBelow = 0.5 * (1 + erfArray((logLower - normalMean)/scale))
+    fracAbove = 0.5 * (1 - erfArray((logUpper - normalMean)/scale))
+
+    # integral of x times p(x) between the lower and upper limit
+    shifted = normalMean + normalSigma**2
+    integBulk = np.exp(normalMean + normalSigma**2/2.) / 2. * \
+                (erfArray((shifted - logLower)/scale) -
+                 erfArray((shifted - logUpper)/scale))
+
+    return fracBelow * lowerLimit + \
+           integBulk  + \
+           fracAbove * upperLimit
+
 #----------------------------------------------------------------------
 
 def averageFractionSizeSampling(mean, sigma, lowerLimit, upperLimit, numSamples = 1000000):
@@ -200,87 +255,154 @@ def averageFractionSizeSamplingWithRounding(mean, sigma, lowerLimit, upperLimit,
 
     return sumValues / float(numGenerated)
 
+#----------------------------------------------------------------------
 
+def averageFractionSizeSamplingArray(mean, sigma, lowerLimit, upperLimit,
+                                     numSamples = 1000000, wordsize = None,
+                                     chunkSize = 1000000, seed = None):
+    """ vectorized version of averageFractionSizeSampling (and of
+        averageFractionSizeSamplingWithRounding if wordsize is given).
+        Draws the samples in chunks of at most chunkSize values, so the
+        memory used does not depend on numSamples. Give a seed (or a
+        numpy RandomState) to get reproducible results """
+    import numpy as np
+
+    if isinstance(seed, np.random.RandomState):
+        generator = seed
+    else:
+        generator = np.random.RandomState(seed)
 
-# #----------------------------------------------------------------------
-# # main (test program)
-# #----------------------------------------------------------------------
-# import sys
-# ARGV = sys.argv[1:]
-
-# if len(ARGV) == 0:
-#     doPlot = True
-#     lowerLimit, upperLimit = 32, 262000
-
-#     # for testing
-#     # lowerLimit, upperLimit = 1e-9, 1e9
-
-#     # mean = 40256 ; sigma = mean ; numSamples = 50000000
-#     # mean = 40256 ; sigma = 2 * mean ; numSamples = 10000000
-
-#     # mean = 256   ; sigma = mean ; numSamples = 1000000
-#     # mean = 256   ; sigma = 2 * mean ; numSamples = 1000000
-
-#     mean = 60256 ; sigma = mean ; numSamples = 50000000
-#     # mean = 60256 ; sigma = 2 * mean ; numSamples = 50000000
-
-#     #--------------------
-#     # test results:
-#     #--------------------
-#     # mean   sigma        number of samples   analytical     sampling        sampling/analytical - 1
-#     #                                                        (without
-#     #                                                         rounding)
-#     #
-#     # 40256  mean                50'000'000   39918.2824564  39907.7074523     -0.03 %
-#     # 40256  2 * mean            10'000'000   36768.3382446  36784.7727597     +0.04 %
-#     # 256    2 * mean             1'000'000   258.095868254  257.901741485     -0.08 %
-#     # 256    256                  1'000'000   256.141548247  256.126371356   -5.9e-3 %
-#     # 60256  mean                50'000'000   58730.8488662  58716.5144495     -0.02 %
-#     # 60256  2 * mean            50'000'000   51737.8826898  51736.6273017   -2.4e-3 %
-
-# else:
-#     # numbers specified on command line
-#     if len(ARGV) != 2:
-#         print >> sys.stderr,"must specify none or exactly two command line arguments (mean and sigma)"
-#         sys.exit(1)
-
-#     mean,sigma = [ float(x) for x in ARGV ]
-#     numSamples = None
-
-#     doPlot = False
-
-# print "analytical average fragment size for mean=",mean,"sigma=",sigma,"is",averageFractionSize(mean,sigma, lowerLimit, upperLimit)
+    # convert from mean/sigma to normalMean / normalSigma
+    normalMean, normalSigma = calcNormalMeanAndSigma(mean, sigma)
 
+    sumValues = 0.
+    numGenerated = 0
 
-# if numSamples != None:
-#     print "sampling average fragment size for mean=",mean,"sigma=",sigma,"is",averageFractionSizeSampling(mean,sigma, lowerLimit, upperLimit, numSamples = numSamples)
-#     print "rounded sampling average fragment size for mean=",mean,"sigma=",sigma,"is",averageFractionSizeSamplingWithRounding(mean,sigma, lowerLimit, upperLimit, numSamples = numSamples)
+    while numGenerated < numSamples:
+        size = min(chunkSize, numSamples - numGenerated)
+        values = generator.lognormal(normalMean, normalSigma, size)
 
-# #----------------------------------------
+        # round to nearest word size
+        if wordsize is not None:
+            values = np.round(values / float(wordsize)) * wordsize
 
-# if doPlot:
-#     #----------------------------------------
-#     # plot the different cases
-#     #----------------------------------------
-#     import pylab
-#     means = pylab.linspace(256,70000,1000 + 1)
+        # cap at lower and upper bound
+        np.clip(values, lowerLimit, upperLimit, out = values)
 
-#     allTitles = []
+        sumValues += values.sum()
+        numGenerated += size
 
-#     for sigmaFunc, title in (
-#         (lambda mean: 0.01 * mean, 'sigma = 0.01 * mean'),
-#         (lambda mean: 0.5 * mean,  'sigma = 0.5 * mean'),
-#         (lambda mean: mean,        'sigma = mean'),
-#         (lambda mean: 2 * mean,    'sigma = 2 * mean'),
-#         ):
+    return sumValues / float(numGenerated)
 
-#         pylab.plot(means, [ averageFractionSize(mean,sigmaFunc(mean), lowerLimit, upperLimit) / float(mean) for mean in means] ,linewidth = 2)
+#----------------------------------------------------------------------
 
-#         allTitles.append(title)
+# cases of the validation table below: mean, sigma, number of samples
+VALIDATION_CASES = [
+    (40256,   40256, 50000000),
+    (40256, 2*40256, 10000000),
+    (256,     2*256,  1000000),
+    (256,       256,  1000000),
+    (60256,   60256, 50000000),
+    (60256, 2*60256, 50000000),
+    ]
+
+def printValidationTable(lowerLimit = 32, upperLimit = 262000, seed = 1,
+                         cases = VALIDATION_CASES):
+    """ compares the analytical average fragment size with the sampled
+    one (with and without rounding) for the cases listed below """
+    import numpy as np
+    generator = np.random.RandomState(seed)
+
+    print "%6s %7s %12s %14s %14s %10s %14s" % (
+        'mean', 'sigma', 'samples', 'analytical', 'sampling', 'diff.',
+        'rounded')
+    for mean, sigma, numSamples in cases:
+        analytical = averageFractionSize(mean, sigma, lowerLimit, upperLimit)
+        sampled = averageFractionSizeSamplingArray(mean, sigma, lowerLimit,
+                                                   upperLimit, numSamples,
+                                                   seed = generator)
+        rounded = averageFractionSizeSamplingArray(mean, sigma, lowerLimit,
+                                                   upperLimit, numSamples,
+                                                   wordsize = 4,
+                                                   seed = generator)
+        print "%6d %7d %12d %14.7f %14.7f %+9.4f%% %14.7f" % (
+            mean, sigma, numSamples, analytical, sampled,
+            100. * (sampled / analytical - 1), rounded)
 
+#----------------------------------------------------------------------
+# main (test program)
+#----------------------------------------------------------------------
+if __name__ == "__main__":
+    from optparse import OptionParser
+    usage = """[%prog] [options] [mean sigma]
+
+Without arguments, prints the validation table below (the sampling is
+vectorized, so this takes seconds). With a mean and sigma, prints the
+analytical and sampled average fragment size for them.
+"""
+    parser = OptionParser(usage = usage)
+    parser.add_option("-s", "--seed", default = 1, action = "store",
+                      type = "int", dest = "seed",
+                      help = "Random seed for the sampling [default: %default]")
+    parser.add_option("-n", "--numSamples", default = 10000000,
+                      action = "store", type = "int", dest = "numSamples",
+                      help = ("Number of samples for a single mean and sigma "
+                              "[default: %default]"))
+    parser.add_option("--plot", default = False, action = "store_true",
+                      dest = "plot",
+                      help = "Plot the truncation effect vs the mean")
+    (options, args) = parser.parse_args()
+
+    lowerLimit, upperLimit = 32, 262000
+
+    if len(args) == 2:
+        mean, sigma = [ float(x) for x in args ]
+        printValidationTable(lowerLimit, upperLimit, seed = options.seed,
+                             cases = [(mean, sigma, options.numSamples)])
+    elif len(args) == 0 and not options.plot:
+        printValidationTable(lowerLimit, upperLimit, seed = options.seed)
+    elif len(args) != 0:
+        parser.print_help()
+        exit(-1)
+
+    if options.plot:
+        #----------------------------------------
+        # plot the different cases
+        #----------------------------------------
+        import pylab
+        means = pylab.linspace(256,70000,1000 + 1)
+
+        allTitles = []
+
+        for sigmaFactor, title in (
+            (0.01, 'sigma = 0.01 * mean'),
+            (0.5,  'sigma = 0.5 * mean'),
+            (1.,   'sigma = mean'),
+            (2.,   'sigma = 2 * mean'),
+            ):
+
+            pylab.plot(means, averageFractionSizeArray(means,
+                              sigmaFactor * means, lowerLimit, upperLimit) /
+                              means, linewidth = 2)
+
+            allTitles.append(title)
+
+        pylab.xlabel('mean parameter given to generator')
+        pylab.ylabel('average fragment size after truncation divided by mean')
+        pylab.grid()
+        pylab.legend(allTitles)
+        pylab.show()
 
-#     pylab.xlabel('mean parameter given to generator')
-#     pylab.ylabel('average fragment size after truncation divided by mean')
-#     pylab.grid()
-#     pylab.legend(allTitles)
-#     pylab.show()
+#----------------------------------------------------------------------
+# test results (from the original, unvectorized sampling):
+#----------------------------------------------------------------------
+# mean   sigma        number of samples   analytical     sampling        sampling/analytical - 1
+#                                                        (without
+#                                                         rounding)
+#
+# 40256  mean                50'000'000   39918.2824564  39907.7074523     -0.03 %
+# 40256  2 * mean            10'000'000   36768.3382446  36784.7727597     +0.04 %
+# 256    2 * mean             1'000'000   258.095868254  257.901741485     -0.08 %
+# 256    256                  1'000'000   256.141548247  256.126371356   -5.9e-3 %
+# 60256  mean                50'000'000   58730.8488662  58716.5144495     -0.02 %
+# 60256  2 * mean            50'000'000   51737.8826898  51736.6273017   -2.4e-3 %
@@ -58,6 +58,10 @@ if __name__ == "__main__":
 		               action="store_true", dest="dry",
 		               help=("Just print the assignments without writing "
 		               	     "out anything"))
+	parser.add_option("--incremental", default=False,
+		               action="store_true", dest="incremental",
+		               help=("Only rewrite the configs whose inputs changed "
+		               	     "since the last run (see config/manifest.txt)"))
 	(opt, args) = parser.parse_args()
 
 	geswitchmask=opt.maskGE.split(',') if len(opt.maskGE) else []
@@ -108,6 +112,7 @@ if __name__ == "__main__":
 			                          opt.useIBV else 'ibv')
 
 	configurator.dropAtRU = opt.dropAtRU
+	configurator.incremental = opt.incremental
 
 	fedbuilders = daq2HWInfo.ge_switch_cabling.keys()
 	configurator.makeConfigs(fedbuilders)
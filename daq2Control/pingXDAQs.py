@@ -5,9 +5,27 @@ from daq2SymbolMap import daq2SymbolMap
 if __name__ == "__main__":
 	from optparse import OptionParser
 	parser = OptionParser()
+	parser.add_option("-m", "--mode", default=utils.PROBE_MODE,
+		              action="store", type="choice",
+		              choices=utils.PROBE_MODES, dest="mode",
+		              help=("Probe with a TCP connect ('tcp'), an HTTP "
+		                    "HEAD ('head') or a full page ('get') "
+		                    "[default: %default]"))
+	parser.add_option("-t", "--timeout", default=utils.PROBE_TIMEOUT,
+		              action="store", type="float", dest="timeout",
+		              help="Timeout in seconds [default: %default]")
 	(options, args) = parser.parse_args()
 
 	d2SM = daq2SymbolMap()
 
+	failed = utils.probeHosts(d2SM.allHosts, mode=options.mode,
+		                      timeout=options.timeout)
+	reasons = dict([(h.name, reason) for h, reason in failed])
 	for h in d2SM.allHosts:
-		utils.tryWebPing(h.host, h.port, verbose=1)
+		print '%-20s %25s:%-5d %s' % (h.name, h.host, h.port,
+			                          reasons.get(h.name, 'OK'))
+	if len(failed) > 0:
+		print '%d of %d hosts not reachable' % (len(failed),
+			                                    len(d2SM.allHosts))
+		exit(1)
+	exit(0)
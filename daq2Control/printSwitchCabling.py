@@ -23,11 +23,9 @@ if __name__ == "__main__":
 		list_of_hosts.append((port, tag, sm(key).strip('.cms')))
 
 	for switch in hwInfo.ib_switch_cabling.keys():
-		switch_hosts = [host for host,_ in
-		                        hwInfo.ib_switch_cabling[switch].values()]
 		print switch
 		for port,tag,host in list_of_hosts:
-			if host in switch_hosts:
+			if hwInfo.ib_host_cabling[host][0] == switch:
 				print '    %2d: %-17s %14s' % (port, tag, host)
 
 	list_of_hosts = []
@@ -40,11 +38,9 @@ if __name__ == "__main__":
 		list_of_hosts.append((tag, sm(key).strip('.cms')))
 
 	for switch in hwInfo.ge_switch_cabling.keys():
-		switch_hosts = [host for host in
-		                        hwInfo.ge_switch_cabling[switch]]
 		print switch
 		for tag,host in list_of_hosts:
-			if host in switch_hosts:
+			if host in hwInfo.ge_switch_devices[switch]:
 				print '      : %-17s %14s' % (tag, host)
 	print 80*'-'
 
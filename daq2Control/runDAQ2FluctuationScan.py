@@ -39,6 +39,7 @@ if __name__ == "__main__":
 	if not options.dropAtRU and not testBuilding(d2c, 1000, options.testTime, verbose=options.verbose, dry=options.dry):
 		if options.verbose > 0: print 'Test failed, built less than 1000 events!'
 		utils.stopXDAQs(d2c.symbolMap, verbose=options.verbose, dry=options.dry)
+		d2c.shutdown()
 		exit(-1)
 	if options.verbose > 0: print 'Test successful (built more than 1000 events in each BU), continuing...'
 
@@ -63,6 +64,7 @@ if __name__ == "__main__":
 		print 70*'-'
 
 	utils.stopXDAQs(d2c.symbolMap, verbose=options.verbose, dry=options.dry)
+	d2c.shutdown()
 
 	print 80*'#'
 	print '## EVERYTHING DONE'
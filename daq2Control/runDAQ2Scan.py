@@ -29,6 +29,35 @@ def getListOfSizes(maxSize, minSize=256, short=False, stepSize=256):
 
 	return steps
 
+KNEE_RATE = 100             ## kHz, refine first where the rate crosses it
+ADAPTIVE_REL_ERROR = 0.005  ## default --maxRelError for adaptive scans
+
+def nextAdaptiveSize(measured, stepSize=256, kneeRate=KNEE_RATE):
+	"""
+	Takes a dictionary of fragment size to measured rate (in Hz) and
+	returns the next size to measure: the middle, rounded to stepSize, of
+	the interval between two neighbouring sizes across which the rate
+	crosses kneeRate (in kHz), or else across which the throughput changes
+	the most. Returns None if no interval can be split any further.
+	"""
+	sizes = sorted(measured.keys())
+	if len(sizes) < 2: return None
+	throughputs = [size*measured[size] for size in sizes]
+	maxthroughput = float(max(throughputs)) or 1.
+
+	best, bestscore = None, -1.
+	for n in xrange(len(sizes)-1):
+		lower, upper = sizes[n], sizes[n+1]
+		middle = int(round((lower+upper)/2./stepSize))*stepSize
+		if middle <= lower or middle >= upper: continue
+		score = abs(throughputs[n+1]-throughputs[n])/maxthroughput
+		if ((measured[lower]-1e3*kneeRate) *
+			(measured[upper]-1e3*kneeRate) < 0):
+			score += 1.
+		if score > bestscore:
+			best, bestscore = middle, score
+	return best
+
 def addScanningOptions(parser):
 	parser.add_option("--maxSize", default=17000, action="store", type="int",
 		               dest="maxSize",
@@ -57,6 +86,78 @@ def addScanningOptions(parser):
 		               help=("Stop XDAQ processes after each step and "
 		               	     "restart instead of changing the size on the "
 		               	     "fly. [default: %default]"))
+	parser.add_option("--adaptive", default=False, action="store_true",
+		               dest="adaptive",
+		               help=("Measure a coarse grid of sizes first (the "
+		               	     "--short list, or --sizes), then add sizes "
+		               	     "where the rate crosses --kneeRate or the "
+		               	     "throughput changes the most. Only with the "
+		               	     "EvB."))
+	parser.add_option("--refineSteps", default=8, action="store",
+		               type="int", dest="refineSteps",
+		               help=("Number of sizes added to the coarse grid in "
+		               	     "an adaptive scan, [default: %default]"))
+	parser.add_option("--kneeRate", default=KNEE_RATE, action="store",
+		               type="float", dest="kneeRate",
+		               help=("Rate in kHz around which an adaptive scan "
+		               	     "is refined first, [default: %default]"))
+	parser.add_option("--maxRelError", default=0, action="store",
+		               type="float", dest="maxRelError",
+		               help=("Stop each step early, once the relative "
+		               	     "error of the mean rate is below this. Only "
+		               	     "with the EvB. [default: %default, i.e. run "
+		               	     "for the full --duration, or "
+		               	     + str(ADAPTIVE_REL_ERROR) +
+		               	     " with --adaptive]"))
+
+def measureStep(d2c, options, step):
+	"""Changes the size to step, builds events for the duration of the
+	step, and returns the measured mean rate in Hz if it is known"""
+	d2c.reset() ## reset retry counter
+	d2c.changeSize(step,
+		           float(options.relRMS)*step,
+		           rate=options.useRate)
+
+	## Test whether the GTPe did start up properly (does not make sense
+	## when changing size on the fly):
+	if d2c.config.useGTPe and options.stopRestart:
+		if not testBuilding(d2c, minevents=5000, waittime=5,
+			                verbose=0, dry=options.dry):
+			d2c.retry('GTPe does not seem to be running, will stop and '
+				      'restart.')
+	## Also do a test when running with EvB/inputemulator:
+	if (d2c.config.useEvB and
+		options.stopRestart):
+		if not testBuilding(d2c, minevents=100, waittime=10,
+			                verbose=0, dry=options.dry):
+			d2c.retry('EvB does not seem to be running, will stop and '
+				      'restart.')
+
+	if options.verbose > 0:
+		print separator
+		print ("Building events at fragment size %d for %d seconds... "
+			   "%s" % (step, options.duration,
+			   	       d2c.config.configfile))
+	rate = None
+	if options.useIfstat:
+		## NOT REALLY TESTED YET
+		## Get throughput directly from RU using ifstat script
+		d2c.getResultsFromIfstat(options.duration)
+	elif d2c.config.useEvB:
+		rate = d2c.getResultsEvB(options.duration, interval=5,
+			                     maxRelError=options.maxRelError)
+	else:
+		## Wait for the full duration and get results at the end
+		sleep(options.duration, options.verbose, options.dry)
+		## For eFEROLs, or when stopping and restarting after each step,
+		## get results after each step
+		if len(d2c.config.eFEROLs) > 0 or options.stopRestart:
+			d2c.getResults()
+	if options.verbose > 0: print "Done"
+
+	# Dump FEROL infospace
+	if options.storeInfoSpaces: d2c.saveFEROLInfoSpaces()
+	return rate
 
 def runScan(options, args):
 	if options.useRate == 0: options.useRate = 'max'
@@ -87,11 +188,21 @@ def runScan(options, args):
 	d2c = daq2Control(configfile, options)
 	d2c.setup()
 
+	## Adaptive scans need the rate of each step, only known for the EvB
+	if not hasattr(options, 'adaptive'): options.adaptive = False
+	if not hasattr(options, 'maxRelError'): options.maxRelError = 0
+	if options.adaptive and (options.useIfstat or not d2c.config.useEvB):
+		printWarningWithWait('Adaptive scans only work with the EvB, '
+			                 'scanning the coarse grid only.',
+			                 waittime=2, instance=d2c)
+	if options.adaptive and options.maxRelError == 0:
+		options.maxRelError = ADAPTIVE_REL_ERROR
+
 	#####################################
 	## Get the scanning steps
 	if not options.sizes:
 		steps = getListOfSizes(options.maxSize, minSize=options.minSize,
-		                       short=options.short,
+		                       short=(options.short or options.adaptive),
 		                       stepSize=options.stepSize)
 	else:
 		steps = [int(x) for x in options.sizes.split(',')]
@@ -155,6 +266,7 @@ WARNING: Your maximum size for scanning doesn't seem to
 			utils.stopXDAQs(d2c.symbolMap,
 				            verbose=options.verbose,
 				            dry=options.dry)
+			d2c.shutdown()
 			exit(0)
 	## Everything ok
 	if options.verbose > 0:
@@ -163,49 +275,22 @@ WARNING: Your maximum size for scanning doesn't seem to
 
 	#####################################
 	## Start the scanning
+	measured = {}
 	for step in steps:
-		d2c.reset() ## reset retry counter
-		d2c.changeSize(step,
-			           float(options.relRMS)*step,
-			           rate=options.useRate)
-
-		## Test whether the GTPe did start up properly (does not make sense
-		## when changing size on the fly):
-		if d2c.config.useGTPe and options.stopRestart:
-			if not testBuilding(d2c, minevents=5000, waittime=5,
-				                verbose=0, dry=options.dry):
-				d2c.retry('GTPe does not seem to be running, will stop and '
-					      'restart.')
-		## Also do a test when running with EvB/inputemulator:
-		if (d2c.config.useEvB and
-			options.stopRestart):
-			if not testBuilding(d2c, minevents=100, waittime=10,
-				                verbose=0, dry=options.dry):
-				d2c.retry('EvB does not seem to be running, will stop and '
-					      'restart.')
-
-		if options.verbose > 0:
-			print separator
-			print ("Building events at fragment size %d for %d seconds... "
-				   "%s" % (step, options.duration,
-				   	       d2c.config.configfile))
-		if options.useIfstat:
-			## NOT REALLY TESTED YET
-			## Get throughput directly from RU using ifstat script
-			d2c.getResultsFromIfstat(options.duration)
-		elif d2c.config.useEvB:
-			d2c.getResultsEvB(options.duration, interval=5)
-		else:
-			## Wait for the full duration and get results at the end
-			sleep(options.duration, options.verbose, options.dry)
-			## For eFEROLs, or when stopping and restarting after each step,
-			## get results after each step
-			if len(d2c.config.eFEROLs) > 0 or options.stopRestart:
-				d2c.getResults()
-		if options.verbose > 0: print "Done"
+		measured[step] = measureStep(d2c, options, step)
 
-		# Dump FEROL infospace
-		if options.storeInfoSpaces: d2c.saveFEROLInfoSpaces()
+	## Add sizes where the throughput curve changes most
+	if options.adaptive:
+		for n in xrange(options.refineSteps):
+			if None in measured.values(): break
+			step = nextAdaptiveSize(measured, stepSize=options.stepSize,
+				                    kneeRate=options.kneeRate)
+			if step is None: break
+			if options.verbose > 0:
+				print separator
+				print ("Refining scan (%d of %d) at fragment size %d" % (
+					                          n+1, options.refineSteps, step))
+			measured[step] = measureStep(d2c, options, step)
 
 	## For FEROLs, and when changing the size on the fly,
 	## get results at the very end
@@ -217,6 +302,7 @@ WARNING: Your maximum size for scanning doesn't seem to
 	#####################################
 	## Pause GTPe and stop everything
 	utils.stopXDAQs(d2c.symbolMap, verbose=options.verbose, dry=options.dry)
+	d2c.shutdown()
 	print separator
 	print ' DONE '
 	print separator
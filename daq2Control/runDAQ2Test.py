@@ -26,6 +26,7 @@ def runTest(configfile, fragSize, options, relRMS=0.0):
 		utils.stopXDAQs(d2c.symbolMap,
 			            verbose=options.verbose,
 		                dry=options.dry)
+		d2c.shutdown()
 		exit(-1)
 	if options.verbose > 0:
 		print ('Test successful (built more than 1000 events '
@@ -47,6 +48,7 @@ def runTest(configfile, fragSize, options, relRMS=0.0):
 	if options.waitBeforeStop: raw_input("Press Enter to stop the XDAQs...")
 
 	utils.stopXDAQs(d2c.symbolMap, verbose=options.verbose, dry=options.dry)
+	d2c.shutdown()
 	print separator
 	print ' DONE '
 	print separator
@@ -82,6 +84,30 @@ def addOptions(parser):
 	parser.add_option("--retries", default=10, action="store", type="int",
 		              dest="retries",
 		              help="Number of retries when things go wrong.")
+	parser.add_option("--noPartialRetry", default=True, action="store_false",
+		              dest="partialRetry",
+		              help="On a retry, always restart all xdaq executives\
+		                    instead of only the ones that failed a probe or\
+		                    a state check")
+	parser.add_option("--stateTimeout", default=30, action="store",
+		              type="float", dest="stateTimeout",
+		              help="Maximum time in seconds to wait for all\
+		                    applications to reach a state after a state\
+		                    transition, [default: %default s]")
+	parser.add_option("--noConfigCache", default=True, action="store_false",
+		              dest="useConfigCache",
+		              help="Always re-render split config files instead of\
+		                    reusing them from the config cache")
+	parser.add_option("--probeMode", default=utils.PROBE_MODE, action="store",
+		              type="choice", choices=utils.PROBE_MODES,
+		              dest="probeMode",
+		              help="How to check that the xdaq executives are alive:\
+		                    'tcp' (connect), 'head' (HTTP HEAD) or 'get'\
+		                    (full page), [default: %default]")
+	parser.add_option("--probeTimeout", default=utils.PROBE_TIMEOUT,
+		              action="store", type="float", dest="probeTimeout",
+		              help="Timeout in seconds for checking that an xdaq\
+		                    executive is alive, [default: %default s]")
 
 	parser.add_option("--sizeFile", default='fedFragmentSizes.csv',
 		              action="store", type='string', dest="sizeFile",
@@ -236,6 +262,7 @@ if __name__ == "__main__":
 		testBuilding(d2c, 1000, options.testTime,
 			         verbose=options.verbose,
 			         dry=options.dry)
+		d2c.shutdown()
 		exit(0)
 
 	######################
@@ -251,6 +278,7 @@ if __name__ == "__main__":
 	if options.stop and len(args) > 1:
 		d2c = daq2Control(args[0], options)
 		d2c.stop()
+		d2c.shutdown()
 		exit(0)
 
 	######################
@@ -280,6 +308,7 @@ if __name__ == "__main__":
 		d2c.start(fragSize, relRMS*fragSize,
 			      rate=options.useRate,
 			      onlyPrepare=True)
+		d2c.shutdown()
 		exit(0)
 
 	######################
@@ -288,6 +317,7 @@ if __name__ == "__main__":
 		d2c = daq2Control(args[0], options)
 		setCurrentSizeFromArgs(d2c, args, options)
 		d2c.configure()
+		d2c.shutdown()
 		exit(0)
 
 	######################
@@ -296,6 +326,7 @@ if __name__ == "__main__":
 		d2c = daq2Control(args[0], options)
 		setCurrentSizeFromArgs(d2c, args, options)
 		d2c.enable()
+		d2c.shutdown()
 		exit(0)
 
 	######################
@@ -327,10 +358,12 @@ if __name__ == "__main__":
 			                dry=options.dry):
 			if options.verbose > 0:
 				print 'Test failed, built less than 1000 events!'
+			d2c.shutdown()
 			exit(-1)
 		if options.verbose > 0:
 			print ('Test successful (built more than 1000 '
 				   'events in each BU), continuing...')
+		d2c.shutdown()
 		exit(0)
 
 	######################
@@ -349,6 +382,7 @@ if __name__ == "__main__":
 		d2c = daq2Control(args[0], options)
 		d2c.changeSize(fragSize, relRMS*fragSize,
 			           rate=options.useRate)
+		d2c.shutdown()
 		exit(0)
 
 	######################
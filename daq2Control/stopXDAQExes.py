@@ -1,7 +1,7 @@
 #! /usr/bin/env python
 from daq2Control import separator
 from daq2SymbolMap import daq2SymbolMap
-from daq2Utils import stopXDAQs
+from daq2Utils import stopXDAQs, STOP_TIMEOUT
 
 if __name__ == "__main__":
 	from optparse import OptionParser
@@ -15,9 +15,14 @@ if __name__ == "__main__":
 					  type="string", dest="symbolMap",
 					  help="Use a symbolmap different from the one set in\
 					        the environment")
+	parser.add_option("-t", "--timeout", default=STOP_TIMEOUT,
+					  action="store", type="float", dest="timeout",
+					  help="Seconds to wait for the executives to stop\
+					        before killing them, [default: %default]")
 	(options, args) = parser.parse_args()
 
 	d2SM  = daq2SymbolMap(options.symbolMap)
-	stopXDAQs(d2SM, verbose=options.verbose, dry=options.dry)
+	results = stopXDAQs(d2SM, verbose=options.verbose, dry=options.dry,
+		                timeout=options.timeout)
 	print separator
-	exit(0)
+	exit(0 if all([r.outcome != 'ALIVE' for r in results]) else 1)
@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+import socket, threading, time, unittest
+import BaseHTTPServer, SocketServer
+
+import daq2SOAP as soap
+
+######################################################################
+## A local keep-alive HTTP server standing in for an xdaq executive
+class ExecutiveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def do_POST(self):
+		self.rfile.read(int(self.headers.getheader('Content-Length')))
+		server = self.server
+		server.requests += 1
+		delay, closeAfter = 0, False
+		if len(server.behaviour) > 0:
+			delay, closeAfter = server.behaviour.pop(0)
+		time.sleep(delay)
+
+		reply = '<xdaq:ConfigureResponse/>'
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/xml')
+		self.send_header('Content-Length', str(len(reply)))
+		self.end_headers()
+		self.wfile.write(reply)
+		## Drop the connection without announcing it, as a stale
+		## kept-alive connection would be
+		if closeAfter: self.close_connection = 1
+
+	def log_message(self, *args):
+		pass
+
+class ExecutiveServer(SocketServer.ThreadingMixIn,
+	                  BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+
+	def handle_error(self, request, client_address):
+		pass ## clients that timed out and went away
+
+class PostTest(unittest.TestCase):
+	def setUp(self):
+		self.server = ExecutiveServer(('127.0.0.1', 0), ExecutiveHandler)
+		self.server.requests = 0
+		self.server.behaviour = [] ## (delay, closeAfter) for each request
+		self.port = self.server.server_address[1]
+		thread = threading.Thread(target=self.server.serve_forever)
+		thread.daemon = True
+		thread.start()
+		self.pool = soap.SOAPConnectionPool(timeout=5)
+
+	def tearDown(self):
+		self.pool.closeAll()
+		self.server.shutdown()
+		self.server.server_close()
+
+	def post(self, timeout=None):
+		return soap.post('127.0.0.1', self.port,
+			             soap.simpleCommandBody('Configure'), {},
+			             timeout=timeout, pool=self.pool)
+
+	def testReusedConnectionGetsNewTimeout(self):
+		"""A short timeout of a previous request does not stick to the
+		pooled connection"""
+		self.server.behaviour = [(0, False), (1, False)]
+		self.post(timeout=0.5)
+		self.assertTrue('ConfigureResponse' in self.post())
+		self.assertEqual(self.server.requests, 2)
+
+	def testTimeoutIsNotRetried(self):
+		"""A request that timed out on a reused connection is not sent
+		again"""
+		self.server.behaviour = [(0, False), (1, False)]
+		self.post()
+		self.assertRaises(socket.timeout, self.post, 0.3)
+		time.sleep(1)
+		self.assertEqual(self.server.requests, 2)
+
+	def testStaleConnectionIsRetried(self):
+		"""A kept-alive connection closed by the server is replaced"""
+		self.server.behaviour = [(0, True)]
+		self.post()
+		time.sleep(0.1)
+		self.assertTrue('ConfigureResponse' in self.post())
+		self.assertEqual(self.server.requests, 2)
+
+if __name__ == '__main__':
+	unittest.main()
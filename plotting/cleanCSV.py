@@ -1,5 +1,43 @@
 #! /usr/bin/env python
+import os, sys, shutil
 from os import path
+
+sys.path.insert(0,path.abspath(path.join(
+	                       path.dirname(path.realpath(__file__)),
+	                       '../daq2Control')))
+import daq2Results
+
+##---------------------------------------------------------------------------
+## Results stores (see daq2Control/daq2Results.py)
+def stripZeros(rates, removeAlsoLeading=False):
+	"""Returns rates with None for the trailing (and leading) zeros"""
+	last = len(rates)
+	while last > 0 and rates[last-1] == 0: last -= 1
+	first = 0
+	if removeAlsoLeading:
+		while first < last and rates[first] == 0: first += 1
+	return [rate if first <= n < last else None
+	                           for n,rate in enumerate(rates)]
+def truncateRates(rates, firstN, lastN=None):
+	"""Returns rates with None for the firstN and lastN entries"""
+	last = len(rates) - (lastN or 0)
+	return [rate if firstN <= n < last else None
+	                           for n,rate in enumerate(rates)]
+def rewriteResultsStore(store, func, suffix, inPlace=False):
+	"""
+	Writes a copy of the store with the rates of each point passed
+	through func to <store>_<suffix>/. With inPlace, the original is
+	moved to <store>_original/ and the copy takes its place.
+	"""
+	print '... processing', store
+	store = store.rstrip('/')
+	target = store+'_'+suffix
+	if daq2Results.isResultsStore(target): shutil.rmtree(target)
+	daq2Results.rewriteStore(store, target, func)
+	if inPlace:
+		os.rename(store, store+'_original')
+		os.rename(target, store)
+
 def stripTrailingZeros(filename, removeAlsoLeading=False, inPlace=False):
 	from subprocess import call
 	print '... processing', filename
@@ -94,8 +132,9 @@ def truncatePoints(filename, firstN, lastN=None, inPlace=False):
 if __name__ == "__main__":
 	from optparse import OptionParser
 	usage = """
-	Use to create a batch of standard plots:
-	%prog  --outDir plots/ data.root
+	Strips zeros from, or truncates, the rate samples of each point in
+	server.csv files or results stores (output directories):
+	%prog [options] server.csv [output/ ...]
 	"""
 	parser = OptionParser(usage=usage)
 	parser.add_option("-t", "--truncate", type='string', default='',
@@ -114,6 +153,11 @@ if __name__ == "__main__":
 
 	if len(args) > 0:
 		for filename in args:
+			## Output directories or results stores, instead of .csv files
+			store = None
+			if not path.isfile(filename):
+				store = daq2Results.findResultsStore(filename)
+
 			if options.truncate:
 				if ',' in options.truncate:
 					firstN, lastN = options.truncate.split(',')
@@ -121,9 +165,20 @@ if __name__ == "__main__":
 				else:
 					firstN = int(options.truncate)
 					lastN = None
+				if store is not None:
+					rewriteResultsStore(store,
+						 lambda rates: truncateRates(rates, firstN, lastN),
+						 'trunc', inPlace=options.inPlace)
+					continue
 				truncatePoints(filename, firstN=firstN, lastN=lastN,
 					           inPlace=options.inPlace)
 			else:
+				if store is not None:
+					rewriteResultsStore(store,
+						 lambda rates: stripZeros(rates,
+						               options.removeAlsoLeading),
+						 'stripped', inPlace=options.inPlace)
+					continue
 				stripTrailingZeros(filename,
 				               removeAlsoLeading=options.removeAlsoLeading,
 				               inPlace=options.inPlace)
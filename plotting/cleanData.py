@@ -1,5 +1,12 @@
 #! /usr/bin/env python
-import os
+import os, sys, shutil
+
+sys.path.insert(0,os.path.abspath(os.path.join(
+	                       os.path.dirname(os.path.realpath(__file__)),
+	                       '../daq2Control')))
+import daq2Results
+
+verbose = 0
 
 ##---------------------------------------------------------------------------------
 ## Cleaning of outliers in a data set
@@ -16,8 +23,8 @@ def cleanData(data, step=1, length=4, cutoff=3, quality=0.05):
 	try:
 		# while mean(stretch) == 0 or mean(stretch) > 0 and std(stretch)/mean(stretch) > quality and pos+length < len(data):
 		while mean(stretch) == 0 or mean(stretch) > 0 and std(stretch)/mean(stretch) > quality and pos+length < len(data):
-			if args.verbose > 4: print stretch
-			if args.verbose > 4: print pos, pos+length, std(stretch)/mean(stretch)
+			if verbose > 4: print stretch
+			if verbose > 4: print pos, pos+length, std(stretch)/mean(stretch)
 			pos += step
 			stretch = data[pos:length+pos]
 	except FloatingPointError, KeyError:
@@ -70,9 +77,19 @@ def cleanFile(filename):
 			o.write('\n')
 		f.close()
 		o.close()
+def cleanStore(store):
+	"""Writes the cleaned rates of a results store to <store>_clean/"""
+	target = store.rstrip('/')+'_clean'
+	if daq2Results.isResultsStore(target): shutil.rmtree(target)
+	daq2Results.rewriteStore(store, target,
+		       lambda rates: map(int, metaCleaning([int(x) for x in rates])))
 def cleanFilesInDir(subdir):
 	if not os.path.isdir(subdir): return
+	store = daq2Results.findResultsStore(subdir)
+	if store is not None:
+		cleanStore(store)
+		return
 	if not os.path.exists(subdir+'/server.csv'):
-		print "  could not locate", directory+subdir+'/server.csv', "... skipping"
+		print "  could not locate a results store or", subdir+'/server.csv', "... skipping"
 		return
 	cleanFile(subdir+'/server.csv')
@@ -1,8 +1,20 @@
 #! /usr/bin/env python
 import os
 from plotData import getConfig
+import daq2Results
 
 
+def processResults(directory, config):
+	from numpy import mean, std
+	nstreams, nrus, nbus, rms, strperfrl = config
+	data = []
+	for eventsize, _, rate in daq2Results.readPoints(directory):
+		## convert already to fragment size and throughput per RU
+		rate = rate.astype(int)
+		fragsize = eventsize/nstreams
+		sufragsize = eventsize/nrus
+		data.append((fragsize, sufragsize*mean(rate)/1e6, sufragsize*std(rate)/1e6))
+	return data
 def processFile(filename, config):
 	from numpy import mean, std
 	f = open(filename,'r')
@@ -65,14 +77,19 @@ if __name__ == "__main__":
 		## 16s8fx1x4_RMS_0.0_flucScan_2kB_CWND_35000
 		if not os.path.isdir(directory+item) or case not in item: continue
 		print "... processing", directory+item
-		if not os.path.exists(directory+item+'/server.csv'):
-			print "   didn't find server.csv file in", directory+item
+		store = daq2Results.findResultsStore(directory+item)
+		if (store is None and
+			not os.path.exists(directory+item+'/server.csv')):
+			print "   didn't find results or server.csv file in", directory+item
 			continue
 		cwnd = item.split("_")[-1]
 		size = item.split("_")[-3]
 		cwnds.add(cwnd)
 		sizes.add(size)
-		data[size+"_"+cwnd] = processFile(directory+item+"/server.csv", config)
+		if store is not None:
+			data[size+"_"+cwnd] = processResults(store, config)
+		else:
+			data[size+"_"+cwnd] = processFile(directory+item+"/server.csv", config)
 		nruns = len(data[size+"_"+cwnd])
 
 		if options.verbose > 0:
@@ -8,6 +8,7 @@ from os import path
 sys.path.insert(0,path.abspath(path.join(
 	                       path.dirname(path.realpath(__file__)),
 	                       '../daq2Control')))
+import daq2Results
 
 months_toint = {"Jan":1, "Feb":2, "Mar":3, "Apr":4, "May":5, "Jun":6,
                 "Jul":7, "Aug":8, "Sep":9, "Oct":10, "Nov":11, "Dec":12}
@@ -17,6 +18,10 @@ months_tostr = {1:"Jan", 2:"Feb", 3:"Mar", 4:"Apr", 5:"May", 6:"Jun",
 ##---------------------------------------------------------------------------------
 ## Utilities
 def extractConfig(filename):
+	if daq2Results.isResultsStore(filename):
+		run = daq2Results.readMetadata(filename)['runs'][0]
+		return (str(run.get('testcase', '')), str(run.get('builder', '')),
+			    str(run.get('protocol', '')), run.get('relRMS', 0.0))
 	builder = ''
 	protocol = ''
 	config = ''
@@ -70,6 +75,11 @@ def getConfig(string):
 
 	return nstreams, nrus, nbus, strperfrl
 def extractDate(filename):
+	if daq2Results.isResultsStore(filename):
+		date = daq2Results.readMetadata(filename)['runs'][0].get('date')
+		if not date: return (0,0,0)
+		data = str(date).split(' ')
+		return data[2][:-1], data[1], data[3]
 	with open(filename, 'r') as f:
 		for line in f:
 			if line.startswith('## Testcase:'): continue
@@ -107,6 +117,60 @@ def drawDate(filename):
 	pave.AddText(date_string)
 	return pave
 
+def readRateSamples(filename, sizeFromRU=False):
+	"""
+	Reads a results store or a server.csv file with lines formatted like:
+	   size, size_ru: rate1, rate2, rate3, ...
+	or
+	   size, rate1, rate2, rate3, ...
+
+	Returns a sorted array of the distinct sizes and a list with an array
+	of rate samples for each of them. Lines with a repeated size are added
+	up sample by sample, after truncating them to the shortest one.
+	"""
+	if daq2Results.isResultsStore(filename):
+		return daq2Results.readRateSamples(filename, sizeFromRU)
+
+	import numpy as np
+	sizes, rows = [], []
+	with open(filename, 'r') as f:
+		for line in f:
+			if len(line.strip()) == 0 or line.strip()[0] == '#': continue
+
+			try:
+				header, body = line.split(':')
+				size, size_ru = tuple([int(_) for _ in header.split(',')])
+				if sizeFromRU: size = size_ru
+			except ValueError:
+				size, body = line.split(',',1)
+				size = int(size)
+
+			# Skip empty lines
+			if len(body.strip()) == 0: continue
+
+			sizes.append(size)
+			rows.append(np.array(body.split(','), dtype=float))
+
+	if len(rows) == 0:
+		return daq2Results.mergeSamples([], [], [])
+
+	## Flatten all rows, truncating the rates to integers
+	lengths = np.array([len(row) for row in rows])
+	values = np.concatenate(rows).astype(np.int64)
+	return daq2Results.mergeSamples(sizes, lengths, values)
+def rateStatistics(samples):
+	"""Returns arrays with the mean and standard deviation of each sample"""
+	import numpy as np
+	if len(samples) == 0:
+		return np.array([]), np.array([])
+	lengths = np.array([len(sample) for sample in samples])
+	values = np.concatenate(samples).astype(float)
+	group = np.repeat(np.arange(len(samples)), lengths)
+	means = np.bincount(group, weights=values)/lengths
+	deviations = values - means[group]
+	stds = np.sqrt(np.bincount(group, weights=deviations**2)/lengths)
+	return means, stds
+
 ##---------------------------------------------------------------------------------
 ## daq2Plotter Class
 ##---------------------------------------------------------------------------------
@@ -119,51 +183,12 @@ class daq2Plotter(object):
 		self.makePNGs = True
 
 	def processFile(self, filename):
-		from numpy import mean, std
-		# from logNormalTest import averageFractionSize
-		###########################
-		## Process .csv file
-		f = open(filename,'r')
-		if not f: raise RuntimeError, "Cannot open "+filename+"\n"
-
-		data_dict = {} ## Store everything in this dictionary of size -> rate
-		for line in f:
-			if len(line.strip()) == 0 or line.strip()[0] == '#': continue
-
-			try:
-				# sufragsize, sizeru: rate1, rate2, rate3, ...
-				header, body = line.split(':')
-				size, size_ru = tuple([int(_) for _ in header.split(',')])
-				if self.args.sizeFromRU: size = size_ru
-			except ValueError:
-				# size, rate1, rate2, rate3, ...
-				line = line.split(',',1)
-				size = int(line[0])
-				body = line[1]
-
-			# Skip empty lines
-			if body == '\n': continue
-
-			rate = [int(float(_)) for _ in body.split(',')]
-
-			if size not in data_dict.keys(): ## First time seeing this size
-				data_dict[size] = rate
-			else: ## Have already a line with this size
-				prev_rate = data_dict[size]
-
-				## Fix different sample sizes:
-				if len(rate) > len(prev_rate):
-					rate = rate[:len(prev_rate)]
-				if len(rate) < len(prev_rate):
-					prev_rate = prev_rate[:len(rate)]
-				## Add to the previous samples
-				data_dict[size] = map(lambda a,b:a+b, prev_rate, rate)
-		f.close()
-		return data_dict
+		"""Returns a dictionary of size -> array of rates"""
+		sizes, samples = readRateSamples(filename, self.args.sizeFromRU)
+		return dict(zip(sizes.tolist(), samples))
 	def getData(self, filename):
-		data_dict = self.processFile(filename)
-		from numpy import mean, std
-		from logNormalTest import averageFractionSize
+		sizes, samples = readRateSamples(filename, self.args.sizeFromRU)
+		from logNormalTest import averageFractionSizeArray
 		config, builder, protocol, rms = extractConfig(filename)
 		nstreams, nrus, nbus, strperfrl = getConfig(config)
 
@@ -184,15 +209,11 @@ class daq2Plotter(object):
 				if builder == 'mstreamio':
 					## For msio, rate is the rate of fragments received, so
 					## have to divide by number of clients (senders)
-					for size in data_dict.keys():
-						newrate = [a/nrus for a in data_dict[size]]
-						data_dict[size] = newrate
+					samples = [rate//nrus for rate in samples]
 				else:
 					## For gevb2g rate is rate of events built in each BU,
 					## but we added them up before, so we have to divide now
-					for size in data_dict.keys():
-						newrate = [a/nbus for a in data_dict[size]]
-						data_dict[size] = newrate
+					samples = [rate//nbus for rate in samples]
 
 			## IGNORE number of RUs now:
 			if builder == 'mstreamio':
@@ -213,10 +234,12 @@ class daq2Plotter(object):
 		output_case = 0 ## 0 (fragsize), 1 (superfragsize), 2 (eventsize)
 		checked = False
 
-		for size in sorted(data_dict.keys()):
+		points = []
+		avrates, stdrates = rateStatistics(samples)
+		for size, avrate, stdrate in zip(sizes.tolist(), avrates.tolist(),
+			                             stdrates.tolist()):
 			## Skip empty lines
-			if (abs(mean(data_dict[size])) < 0.01 and
-			         abs(std(data_dict[size])) < 0.01):
+			if abs(avrate) < 0.01 and abs(stdrate) < 0.01:
 			    continue
 
 			## Determine what the first item in the server.csv file stands for
@@ -256,18 +279,23 @@ class daq2Plotter(object):
 				fragsize    = float(size)/(nstreams-1)*(nrus-1)
 				sufragsize  = float(size)
 
-			## Correct for RMS:
-			if not self.args.sizeFromRU and rms is not None and rms != 0.0:
-				fragsize = averageFractionSize(eventsize/nstreams,
-					                           rms*eventsize/nstreams,
-					                           LOWERLIMIT, UPPERLIMIT)
-				sufragsize = fragsize*nstreams/nrus
-
+			points.append((eventsize, fragsize, sufragsize, avrate, stdrate))
+
+		## Correct for RMS, for all sizes at once:
+		if (len(points) > 0 and not self.args.sizeFromRU and
+			rms is not None and rms != 0.0):
+			from numpy import array
+			eventsizes = array([eventsize for eventsize,_,_,_,_ in points])
+			fragsizes = averageFractionSizeArray(eventsizes/nstreams,
+				                                 rms*eventsizes/nstreams,
+				                                 LOWERLIMIT, UPPERLIMIT)
+			points = [(eventsize, fragsize, fragsize*nstreams/nrus,
+				       avrate, stdrate) for
+			          (eventsize,_,_,avrate,stdrate), fragsize in
+			          zip(points, fragsizes.tolist())]
+
+		for eventsize, fragsize, sufragsize, avrate, stdrate in points:
 			## Calculate rate
-			# throughput  = mean(data_dict[size]) ## in MB/s
-			# throughputE = std(data_dict[size])
-			avrate      = mean(data_dict[size])
-			stdrate     = std(data_dict[size])
 			throughput  = sufragsize*avrate/1e6 ## in MB/s
 			throughputE = sufragsize*stdrate/1e6
 			if self.args.plotBU:
@@ -662,11 +690,13 @@ def buildFileList(inputlist):
 	for location in inputlist:
 		if path.isfile(location) and path.splitext(location)[1] == '.csv':
 			filelist.append(location)
+		elif path.isdir(location) and daq2Results.findResultsStore(location):
+			filelist.append(daq2Results.findResultsStore(location))
 		elif path.isdir(location) and 'server.csv' in os.listdir(location):
 			filelist.append(location+'/server.csv')
 		else: pass
 	if len(filelist) < 1:
-		print "No server.csv files found!"
+		print "No results stores or server.csv files found!"
 		exit(-1)
 	else: return filelist
 
@@ -674,8 +704,8 @@ if __name__ == "__main__":
 	usage = """
 	Plots event rates in .csv files as throughput per RU vs fragment\
 	size.
-	Give .csv files or directories containing a 'server.csv' files as\
-	input.
+	Give .csv files or directories containing a 'results' store or a\
+	'server.csv' file as input.
 
 	Examples:
 	%(prog)s server.csv
@@ -689,7 +719,7 @@ if __name__ == "__main__":
 	parser.add_argument("inputlist", metavar='file_or_dir', type=str,
 		                nargs='+',
 		                help='The .csv files or directories (containing\
-		                	  .csv files) to be plotted.')
+		                	  a results store or .csv files) to be plotted.')
 	args = parser.parse_args()
 
 	if len(args.inputlist) > 0: